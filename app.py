@@ -1,19 +1,77 @@
-from flask import Flask, jsonify, render_template, request, session, redirect, url_for
-import serial
 import time
-import random
+# Referencia del informe de arranque: antes de cualquier otra importación
+_INICIO = time.perf_counter()
+from flask import Flask, jsonify, render_template, request, session, redirect, url_for, Response, stream_with_context, g
 from datetime import datetime
-from collections import deque
 import threading
-import sqlite3
-import hashlib
-import secrets
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import os
+import atexit
+import signal
+import sys
+import zlib
+from ciclo_vida import CicloVida
+from eventos import BusEventos, serializar_evento
+import serie_temporal
+import deteccion
+import metricas
+from ingesta import LectorSerial
+from dispositivos import cargar_registro, lectura_agregada, PublicadorAgregado
+from comandos import GestorComandos, EMERGENCIA, MANUAL, COSMETICO
+import compartido
+import instantaneas
+from estadisticas import EstadisticasAgregadas
+from eventos import CANAL_AGREGADO
+from repositorio import (pool, inicializar_db, registrar_usuario, verificar_usuario,
+                         obtener_usuarios_notificables, obtener_usuario, obtener_notificaciones_usuario,
+                         alternar_notificaciones, cambiar_rol, cambiar_preferencias_email, AlmacenSesiones,
+                         registrar_notificaciones_lote, marcar_notificaciones_enviadas)
+from autenticacion import PoolKDF, Sesiones, CachePerfiles, KDFSaturado, clave_secreta
+from notificaciones import MotorEnvio
+from outbox import Outbox, Despachador, nuevo_id_alerta
+from registro_alertas import RegistroAlertas, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
+import exportacion
+import umbrales
+import canal_ws
+import plantillas
+import supervisor
+
+# Importar este módulo no abre la base, ni puertos, ni arranca hilos:
+# eso son los pasos de `ciclo`, que ejecuta crear_app() (ver ciclo_vida.py)
+ciclo = CicloVida(_INICIO)
+ciclo.importado()
+
+# Papel de este proceso (ver compartido.py): 'unico', 'ingesta' o 'web'
+MODO = compartido.MODO
+# Este proceso es el dueño de las placas (las lee, escribe comandos y avisa)
+INGESTA = MODO != 'web'
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
+
+@ciclo.al_arrancar('clave_secreta')
+def fijar_clave_secreta():
+    # Misma clave en todos los procesos y entre reinicios (SECRET_KEY o fichero .secret_key)
+    app.secret_key = clave_secreta()
+
+# ============================================
+# AUTENTICACIÓN (sesiones del servidor y KDF acotado)
+# ============================================
+# La cookie solo guarda el id de sesión; rol y nombre viven en memoria del servidor
+# (con varios procesos web, respaldadas en SQLite para que cualquiera las vea)
+sesiones = Sesiones(almacen=AlmacenSesiones(pool) if MODO != 'unico' else None)
+# Hash de contraseñas en hilos aparte con cola acotada (las ráfagas de login se rechazan)
+kdf = PoolKDF()
+# Perfil de /perfil cacheado; se invalida al cambiar notificaciones o rol
+perfiles = CachePerfiles(obtener_usuario)
+
+def usuario_actual():
+    """Usuario de la sesión (búsqueda en memoria, sin DB); None si no hay sesión válida"""
+    return sesiones.obtener(session.get('sid'))
+
+def es_admin(usuario):
+    return usuario is not None and usuario['rol'] == 'admin'
+
+def kdf_saturado(e):
+    return jsonify({'success': False, 'mensaje': str(e)}), 503, {'Retry-After': '2'}
 
 # ============================================
 # CONFIGURACIÓN DE EMAIL (GMAIL GRATIS)
@@ -23,401 +81,501 @@ EMAIL_ENABLED = True
 GMAIL_USER = "tucorreo@gmail.com"
 GMAIL_APP_PASSWORD = "tucontraseña"
 
-def enviar_email(destinatario, asunto, cuerpo):
-    """Envía email usando Gmail SMTP"""
-    if not EMAIL_ENABLED:
-        print(f"[SIMULADO] Email a {destinatario}: {asunto}")
-        return True
+# Servidor SMTP (para probar en local: SMTP_HOST=localhost SMTP_PORT=8025 SMTP_STARTTLS=0)
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') != '0'
 
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = GMAIL_USER
-        msg['To'] = destinatario
-        msg['Subject'] = asunto
-        msg.attach(MIMEText(cuerpo, 'plain', 'utf-8'))
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(GMAIL_USER, GMAIL_APP_PASSWORD)
-        text = msg.as_string()
-        server.sendmail(GMAIL_USER, destinatario, text)
-        server.quit()
-        print(f"Email enviado a {destinatario}")
-        return True
-    except Exception as e:
-        print(f"Error al enviar email a {destinatario}: {e}")
-        return False
+# Motor de envío: sesiones SMTP reutilizadas por lote, envío en paralelo con reintentos
+motor_envio = MotorEnvio(SMTP_HOST, SMTP_PORT, GMAIL_USER, GMAIL_APP_PASSWORD,
+                         starttls=SMTP_STARTTLS, simulado=not EMAIL_ENABLED)
 
-# Cola para histórico
-historico_temperatura = deque(maxlen=50)
-historico_humo = deque(maxlen=50)
-historico_alertas = deque(maxlen=20)
+# Histórico de alertas (todas las placas) en la base: inicio, fin, duración y picos
+historial_alertas = RegistroAlertas(pool)
 
-# Estado maestro de peligro (para "enganchar" la alerta)
-estado_peligro_anterior = False
+# Dispositivos configurados (una placa por planta): cada uno con su latch, históricos y lock.
+# En modo web son espejos que el proceso de ingesta actualiza por memoria compartida.
+registro_dispositivos = cargar_registro(clase=None if INGESTA else compartido.DispositivoEspejo)
+# Instantánea de la vista agregada (todas las placas), publicada por los hilos lectores
+agregado = PublicadorAgregado(registro_dispositivos)
+# Estadísticas de la vista agregada, fusionadas a partir de las de cada placa
+estadisticas_agregadas = EstadisticasAgregadas() if INGESTA else compartido.EstadisticasEspejo()
 
-# Última lectura
-ultima_lectura = {
-    'temperatura': 0, 'humo': 0,
-    'nivel_temperatura': 'bajo', 'nivel_humo': 'bajo',
-    'alerta': False, 'timestamp': datetime.now().strftime('%H:%M:%S')
-}
+# Bus de eventos para /stream y /ws (lecturas y alertas empujadas a los dashboards)
+bus_eventos = BusEventos()
+bus_eventos.formatos[canal_ws.FORMATO] = canal_ws.trama_evento
+# Intervalo mínimo entre lecturas agregadas publicadas en el canal '*'
+INTERVALO_AGREGADO = 0.1
+_ultimo_agregado = 0.0
 
-lectura_lock = threading.Lock()
+# 🔑 UMBRALES: configuración versionada y persistida (umbrales.py). Cada cambio publica
+# una versión nueva e inmutable; el hilo lector toma `actual` una vez por muestra.
+configuracion_umbrales = umbrales.GestorUmbrales(pool, registro_dispositivos.ids())
 
-# 🔑 UMBRALES (Basados en tu app.py y leyenda originales)
-UMBRAL_TEMPERATURA_PELIGRO = 45 
-UMBRAL_HUMO_PELIGRO = 600 
-UMBRAL_TEMP_BAJO, UMBRAL_TEMP_NORMAL, UMBRAL_TEMP_ALTO = 20, 30, 40
-UMBRAL_HUMO_BAJO, UMBRAL_HUMO_NORMAL, UMBRAL_HUMO_ALTO = 100, 300, 500
 
+# ============================================
+# NOTIFICACIÓN POR EMAIL (SIN SPAM)
+# ============================================
+def notificar_usuarios_alerta(aviso):
+    """Notifica a usuarios solo cuando es necesario (llamado solo desde cambio de estado a peligro).
 
-# Arduino (real o dummy)
-try:
-    arduino = serial.Serial('COM7', 9600, timeout=0.1)
-    time.sleep(2)
-    print("Arduino conectado en COM7")
-    usar_dummy = False
-except Exception as e:
-    print(f"No se pudo conectar al Arduino: {e}. Usando DummyArduino.")
-    
-    class DummyArduino:
-        def __init__(self):
-            self.counter = 0
-            # Valores base normales
-            self.base_temp = 25
-            self.base_humo = 50
-        def readline(self):
-            self.counter += 1
-            temp = self.base_temp + random.uniform(-3, 8)
-            humo = self.base_humo + random.uniform(-20, 40)
-            
-            # 1% de probabilidad de generar un pico de peligro
-            if random.random() < 0.01: 
-                print("***********************************")
-                print("Dummy: Simulando pico de peligro...")
-                print("***********************************")
-                temp += random.uniform(30, 40) # Supera 45
-                humo += random.uniform(550, 650) # Supera 600
-                
-            return f"T:{temp:.1f},H:{humo:.1f},RH:60.0".encode('utf-8')
-        def write(self, data): 
-            print(f"Dummy.write: {data}")
-            return len(data)
-    
-    arduino = DummyArduino()
-    usar_dummy = True
+    `aviso` es el payload de la outbox. Devuelve los ids de usuario que quedan
+    pendientes; en un reintento solo se envía a esos (aviso['pendientes']).
+    """
+    temp, humo, tipo_alerta = aviso['temperatura'], aviso['humo'], aviso['tipo']
+    umbral_temp, umbral_humo = configuracion_umbrales.actual.para(aviso.get('dispositivo', '*')).peligro
+    reintento = 'pendientes' in aviso
+
+    usuarios = obtener_usuarios_notificables(aviso.get('pendientes'))
+    if not usuarios:
+        print("No hay usuarios para notificar")
+        return []
+
+    # Plantilla por tipo de aviso (plantillas.py): se renderiza una vez por idioma y formato
+    # que pidan los destinatarios; a cada uno solo se le añade su cabecera To
+    render = plantillas.AvisoRenderizado(GMAIL_USER, tipo_alerta, aviso.get('motivo'), {
+        'temp': temp, 'humo': humo, 'umbral_temp': umbral_temp, 'umbral_humo': umbral_humo,
+        'detectado': aviso['detectado'], 'dispositivo': aviso.get('dispositivo', '*'),
+    })
+
+    # Instante de detección en reloj monotónico para medir la latencia extremo a extremo
+    t_deteccion = time.monotonic() - max(time.time() - aviso['detectado'], 0)
+    resultados = motor_envio.enviar_lote(usuarios, render, t_deteccion)
+    tipo = ','.join(tipo_alerta)
+    if reintento:
+        marcar_notificaciones_enviadas(aviso['alerta_id'], [uid for uid, enviado in resultados if enviado])
+    else:
+        registrar_notificaciones_lote(aviso['alerta_id'], render.texto(),
+                                      [(uid, 1 if enviado else 0) for uid, enviado in resultados],
+                                      tipo, temp, humo)
+
+    latencia = motor_envio.ultimas_latencias[-1]
+    print(f"✅ Notificación enviada a {latencia['enviados']}/{len(usuarios)} usuario(s): {tipo} "
+          f"(envío {latencia['envio_s']}s, detección→último email {latencia['latencia_s']}s)")
+    return [uid for uid, enviado in resultados if not enviado]
 
 # ============================================
-# BASE DE DATOS (Incluye la columna 'rol' para Admin)
+# OUTBOX: los avisos sobreviven a reinicios y caídas de SMTP
 # ============================================
-def inicializar_db():
-    conn = sqlite3.connect('alertas.db')
-    c = conn.cursor()
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS usuarios
-              (id INTEGER PRIMARY KEY AUTOINCREMENT,
-               nombre TEXT NOT NULL,
-               email TEXT UNIQUE NOT NULL,
-               telefono TEXT,
-               password_hash TEXT NOT NULL,
-               rol TEXT DEFAULT 'usuario', 
-               notificaciones_activas INTEGER DEFAULT 1,
-               fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS notificaciones
-              (id INTEGER PRIMARY KEY AUTOINCREMENT,
-               usuario_id INTEGER,
-               tipo TEXT NOT NULL,
-               temperatura REAL,
-               humo REAL,
-               mensaje TEXT,
-               enviado INTEGER DEFAULT 0,
-               fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-               FOREIGN KEY (usuario_id) REFERENCES usuarios(id))''')
-    
-    conn.commit()
-    
-    # Crear usuario admin por defecto si no existe
-    c.execute("SELECT * FROM usuarios WHERE email = 'admin@sistema.com'")
-    if not c.fetchone():
-        c.execute('''INSERT INTO usuarios (nombre, email, telefono, password_hash, rol)
-                    VALUES (?, ?, ?, ?, ?)''',
-                  ('Administrador', 'admin@sistema.com', '', 
-                   hash_password('admin123'), 'admin'))
-        conn.commit()
-        print("✅ Usuario admin creado: admin@sistema.com / admin123")
-    
-    conn.close()
-    print("✅ Base de datos inicializada")
-
-def hash_password(p): 
-    return hashlib.sha256(p.encode()).hexdigest()
+outbox_avisos = Outbox(pool)
 
-def registrar_usuario(nombre, email, telefono, password):
+def encolar_aviso(temp, humo, tipos, dispositivo='*', alerta_id=None, motivo=None):
+    """Encolado barato desde el hilo lector o las rutas: sin hilos ni SMTP"""
+    aviso = {'alerta_id': alerta_id or nuevo_id_alerta(), 'temperatura': temp, 'humo': humo,
+             'tipo': tipos, 'dispositivo': dispositivo, 'detectado': time.time(), 'motivo': motivo}
     try:
-        conn = sqlite3.connect('alertas.db')
-        c = conn.cursor()
-        c.execute('INSERT INTO usuarios (nombre, email, telefono, password_hash) VALUES (?, ?, ?, ?)',
-                  (nombre, email, telefono, hash_password(password)))
-        conn.commit()
-        uid = c.lastrowid
-        conn.close()
-        return True, uid
-    except sqlite3.IntegrityError:
-        return False, "Email ya registrado"
+        outbox_avisos.enqueue(aviso['alerta_id'], aviso)
     except Exception as e:
-        return False, str(e)
+        print(f"❌ Error encolando aviso: {e}")
 
-def verificar_usuario(email, password):
-    """Verifica las credenciales del usuario (incluyendo ROL)"""
-    try:
-        conn = sqlite3.connect('alertas.db')
-        c = conn.cursor()
-        
-        password_hash = hash_password(password)
-        c.execute('''SELECT id, nombre, telefono, notificaciones_activas, rol 
-                     FROM usuarios WHERE email = ? AND password_hash = ?''',
-                  (email, password_hash))
-        
-        u = c.fetchone()
-        conn.close()
-        
-        if u:
-            return True, {
-                'id': u[0], 
-                'nombre': u[1], 
-                'telefono': u[2], 
-                'notificaciones_activas': u[3],
-                'rol': u[4]
-            }
-        return False, "Credenciales incorrectas"
-    except Exception as e:
-        return False, str(e)
+def registrar_alerta(datos, dispositivos):
+    """Abre la alerta en el histórico y encola su aviso con la misma alerta_id.
 
-def obtener_usuarios_notificables():
+    Añade el id del histórico a `datos` (el evento SSE) y devuelve la AlertaAbierta,
+    que se cierra cuando todas las `dispositivos` vuelven a seguro (None si la base falló).
+    """
+    alerta_id = nuevo_id_alerta()
+    alerta = None
     try:
-        conn = sqlite3.connect('alertas.db')
-        c = conn.cursor()
-        c.execute('SELECT id, nombre, email FROM usuarios WHERE notificaciones_activas = 1')
-        usuarios = c.fetchall()
-        conn.close()
-        return [{'id': u[0], 'nombre': u[1], 'email': u[2]} for u in usuarios]
+        alerta = historial_alertas.abrir(alerta_id, datos['dispositivo'], datos['tipo'], datos['temperatura'],
+                                         datos['humo'], [d.device_id for d in dispositivos], datos.get('motivo'),
+                                         datos.get('config_version'))
+        datos['id'] = alerta.id
     except Exception as e:
-        print(f"Error usuarios: {e}")
-        return []
+        print(f"❌ Error registrando alerta: {e}")
+    encolar_aviso(datos['temperatura'], datos['humo'], datos['tipo'], datos['dispositivo'], alerta_id,
+                  datos.get('motivo'))
+    return alerta
 
-def registrar_notificacion_db(uid, tipo, temp, humo, msg, enviado):
+def cerrar_alerta(alerta, d, datos):
+    """La placa `d` soltó la alerta; si era la última, se completa el evento 'alerta_fin'"""
     try:
-        conn = sqlite3.connect('alertas.db')
-        c = conn.cursor()
-        c.execute('INSERT INTO notificaciones (usuario_id, tipo, temperatura, humo, mensaje, enviado) VALUES (?, ?, ?, ?, ?, ?)',
-                  (uid, tipo, temp, humo, msg, enviado))
-        conn.commit()
-        conn.close()
+        cerrada = historial_alertas.soltar(alerta, d.device_id)
     except Exception as e:
-        print(f"Error DB notif: {e}")
-
-# ============================================
-# NOTIFICACIÓN POR EMAIL (SIN SPAM)
-# ============================================
-def notificar_usuarios_alerta(temp, humo, tipo_alerta):
-    """Notifica a usuarios solo cuando es necesario (llamado solo desde cambio de estado a peligro)"""
-
-    usuarios = obtener_usuarios_notificables()
-    if not usuarios:
-        print("No hay usuarios para notificar")
+        print(f"❌ Error cerrando alerta: {e}")
         return
+    if cerrada is not None:
+        datos.update(cerrada)
 
-    if 'emergencia_manual' in tipo_alerta:
-        asunto = "🚨 EMERGENCIA ACTIVADA MANUALMENTE"
-        cuerpo = f"""\
-🚨 ¡EMERGENCIA ACTIVADA POR ADMINISTRADOR!
-El administrador ha activado manualmente el protocolo de emergencia.
-¡EVACUAR INMEDIATAMENTE!
-Hora: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
-"""
-    elif 'temperatura' in tipo_alerta and 'humo' in tipo_alerta:
-        asunto = "ALERTA CRÍTICA: Incendio Detectado"
-        cuerpo = f"""\
-🚨 ¡ALERTA CRÍTICA!
-Se ha detectado una emergencia por MÚLTIPLES RIESGOS:
-- Temperatura: {temp:.1f}°C (Umbral: {UMBRAL_TEMPERATURA_PELIGRO}°C)
-- Humo: {humo:.0f} ppm (Umbral: {UMBRAL_HUMO_PELIGRO} ppm)
-¡EVACUAR INMEDIATAMENTE!
-Hora: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
-"""
-    elif 'temperatura' in tipo_alerta:
-        asunto = "ALERTA: Temperatura Alta"
-        cuerpo = f"""\
-🔥 ¡PELIGRO DE INCENDIO!
-Temperatura crítica detectada:
-- Temperatura: {temp:.1f}°C (Umbral: {UMBRAL_TEMPERATURA_PELIGRO}°C)
-Verificar inmediatamente.
-Hora: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
-"""
-    else: # Solo Humo
-        asunto = "ALERTA: Humo Detectado"
-        cuerpo = f"""\
-💨 ¡HUMO DETECTADO!
-Nivel de humo elevado:
-- Humo: {humo:.0f} ppm (Umbral: {UMBRAL_HUMO_PELIGRO} ppm)
-Evacuar el área.
-Hora: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
-"""
-
-    for u in usuarios:
-        enviado = enviar_email(u['email'], asunto, cuerpo)
-        registrar_notificacion_db(u['id'], ','.join(tipo_alerta), temp, humo, cuerpo, 1 if enviado else 0)
-
-    print(f"✅ Notificación enviada a {len(usuarios)} usuario(s): {', '.join(tipo_alerta)}")
+def entregar_aviso(aviso):
+    """Entrega para el despachador: los destinatarios fallidos quedan para el reintento"""
+    pendientes = notificar_usuarios_alerta(aviso)
+    if pendientes:
+        aviso['pendientes'] = pendientes
+        return False
+    return True
 
 # Inicializar DB
-inicializar_db()
+ciclo.al_arrancar('base_de_datos')(inicializar_db)
+ciclo.al_parar('base_de_datos')(pool.cerrar_todas)
+
+if INGESTA:
+    # Última versión guardada de los umbrales (los procesos web la piden por el socket)
+    ciclo.al_arrancar('umbrales')(configuracion_umbrales.cargar)
+
+if INGESTA:
+    @ciclo.al_arrancar('alertas_huerfanas')
+    def cerrar_alertas_huerfanas():
+        # El latch no sobrevive al reinicio: las alertas que quedaron abiertas se cierran
+        n = historial_alertas.cerrar_huerfanas()
+        if n:
+            print(f"⚠️ {n} alerta(s) abiertas de la ejecución anterior cerradas al arrancar")
+
+# Persistencia de lecturas en segundo plano (lotes, sin bloquear la lectura a 10 Hz)
+escritor_lecturas = serie_temporal.EscritorLecturas(pool)
+if INGESTA:
+    ciclo.al_arrancar('escritor_lecturas')(escritor_lecturas.iniciar)
+    # Retención: los días vencidos pasan de la base a archivo/<tabla>/AAAA/MM/*.csv.gz
+    ciclo.al_arrancar('archivador')(exportacion.Archivador(pool).iniciar)
 
 # --------------------------------------------
-# FUNCIÓN CORREGIDA: Usa UMBRAL_..._PELIGRO
-# --------------------------------------------
-def calcular_nivel(valor, tipo):
-    """Clasifica el valor en bajo, normal, alto o peligro."""
-    if tipo == 'temperatura':
-        if valor >= UMBRAL_TEMPERATURA_PELIGRO: return 'peligro' # 45
-        elif valor >= UMBRAL_TEMP_ALTO: return 'alto' # 40
-        elif valor >= UMBRAL_TEMP_NORMAL: return 'normal' # 30
-        elif valor >= UMBRAL_TEMP_BAJO: return 'bajo' # 20
-        else: return 'bajo'
-    else:
-        if valor >= UMBRAL_HUMO_PELIGRO: return 'peligro' # 600
-        elif valor >= UMBRAL_HUMO_ALTO: return 'alto' # 500
-        elif valor >= UMBRAL_HUMO_NORMAL: return 'normal' # 300
-        elif valor >= UMBRAL_HUMO_BAJO: return 'bajo' # 100
-        else: return 'bajo'
+# CLASIFICACIÓN: tablas de bordes compiladas con cada versión de los umbrales
 # --------------------------------------------
+def calcular_nivel(valor, tipo, umbrales_placa=None):
+    """Clasifica el valor en bajo, normal, alto o peligro (misma regla que backtest.py).
 
-def parsear_datos(data_str):
-    try:
-        if 'T:' in data_str and 'H:' in data_str:
-            partes = data_str.split(',')
-            temp = float(partes[0].split(':')[1])
-            humo = float(partes[1].split(':')[1])
-            return temp, humo
-        elif 'Temp:' in data_str and 'Humo:' in data_str:
-            temp = float(data_str.split('Temp:')[1].split('°')[0].strip())
-            humo = float(data_str.split('Humo:')[1].split('|')[0].strip())
-            return temp, humo
-    except: pass
-    return None, None
+    Un bisect sobre la tabla ya compilada de `umbrales_placa` (por defecto, los generales vigentes).
+    """
+    umbrales_placa = umbrales_placa or configuracion_umbrales.actual.general
+    return umbrales_placa.nivel(valor, tipo)
+# --------------------------------------------
 
 # --------------------------------------------
 # 🔑 FUNCIÓN DE LECTURA CORREGIDA (CON "LATCH")
 # --------------------------------------------
-def leer_arduino_continuo():
-    global ultima_lectura, estado_peligro_anterior
-    print("📡 Lectura continua iniciada...")
-    
-    while True:
-        try:
-            if usar_dummy:
-                data = arduino.readline().decode('utf-8', errors='ignore').strip()
-            else:
-                arduino.reset_input_buffer()
-                data = arduino.readline().decode('utf-8', errors='ignore').strip()
-
-            if data:
-                temp, humo = parsear_datos(data)
-                if temp is not None and humo is not None:
-                    with lectura_lock:
-                        ts = datetime.now().strftime('%H:%M:%S')
-                        historico_temperatura.append({'time': ts, 'value': temp})
-                        historico_humo.append({'time': ts, 'value': humo})
-                        
-                        # 1. Calcular niveles actuales
-                        nivel_temp = calcular_nivel(temp, 'temperatura')
-                        nivel_humo = calcular_nivel(humo, 'humo')
-                        
-                        # 2. Determinar si esta lectura específica es peligrosa
-                        peligro_en_esta_lectura = nivel_temp == 'peligro' or nivel_humo == 'peligro'
-
-                        # 3. LÓGICA DE TRANSICIÓN: Detectar un NUEVO peligro
-                        if peligro_en_esta_lectura and not estado_peligro_anterior:
-                            # CAMBIO DE ESTADO: Seguro -> Peligro
-                            print("🚨 ¡NUEVA ALERTA DETECTADA! Enganchando estado de peligro.")
-                            tipos = []
-                            if nivel_temp == 'peligro': tipos.append('temperatura')
-                            if nivel_humo == 'peligro': tipos.append('humo')
-                            
-                            alerta_data = {
-                                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                                'temperatura': temp, 
-                                'humo': humo, 
-                                'tipo': tipos
-                            }
-                            historico_alertas.append(alerta_data)
-                            
-                            # 🔑 ENVÍA EL EMAIL (SOLO 1 VEZ)
-                            threading.Thread(
-                                target=notificar_usuarios_alerta,
-                                args=(temp, humo, tipos),
-                                daemon=True
-                            ).start()
-                            
-                            # ENGANCHAR EL ESTADO
-                            estado_peligro_anterior = True
-
-                        # 4. LÓGICA DE TRANSICIÓN: Detectar que el peligro HA PASADO
-                        elif not peligro_en_esta_lectura and estado_peligro_anterior:
-                            # CAMBIO DE ESTADO: Peligro -> Seguro
-                            print("✅ El peligro ha pasado. Reseteando estado.")
-                            
-                            # SOLTAR EL ESTADO
-                            estado_peligro_anterior = False
-
-                        # 5. Actualizar la última lectura para el cliente
-                        # La bandera 'alerta' AHORA refleja el estado "enganchado"
-                        ultima_lectura.update({
-                            'temperatura': temp, 
-                            'humo': humo,
-                            'nivel_temperatura': nivel_temp, 
-                            'nivel_humo': nivel_humo,
-                            'alerta': estado_peligro_anterior, # 🔑 El cliente ve el estado "enganchado"
-                            'timestamp': ts
-                        })
-
-            time.sleep(0.1) 
-        except Exception as e:
-            print(f"❌ Error lectura: {e}")
-            time.sleep(1)
-
-threading.Thread(target=leer_arduino_continuo, daemon=True).start()
+def procesar_muestra(d, temp, humo, humedad=None, ts_lectura=None):
+    """Clasifica una muestra de la placa `d`, aplica su latch de peligro y la reparte
+    (histórico, disco, SSE, avisos). Solo toma el lock de ese dispositivo."""
+    eventos = []
+    soltada = None
+    canales = (d.device_id, CANAL_AGREGADO)
+    # Una sola lectura de la configuración por muestra: versión entera, sin lock
+    config = configuracion_umbrales.actual
+    umbrales_placa = config.para(d.device_id)
+    with d.lock:
+        ahora = time.time()
+        ts = datetime.fromtimestamp(ahora).strftime('%H:%M:%S')
+        # 'ts' (epoch) ordena y combina las placas; 'time' es la etiqueta del gráfico
+        d.historico_temperatura.append({'ts': round(ahora, 3), 'time': ts, 'value': temp})
+        d.historico_humo.append({'ts': round(ahora, 3), 'time': ts, 'value': humo})
+        
+        # 1. Calcular niveles actuales
+        nivel_temp = calcular_nivel(temp, 'temperatura', umbrales_placa)
+        nivel_humo = calcular_nivel(humo, 'humo', umbrales_placa)
+        
+        # 2. Etapa de detección (deteccion.py): debounce N de M, histéresis y subida rápida.
+        # Un pico aislado no dispara y el latch no se suelta mientras algún detector lo mantenga.
+        disparos, mantiene = d.deteccion.evaluar(time.monotonic() if ts_lectura is None else ts_lectura,
+                                                 (temp, humo), umbrales_placa.peligro)
+
+        # Mismo latch que reproduce backtest.py (deteccion.transicion)
+        cambio = deteccion.transicion(d.estado_peligro_anterior, disparos, mantiene)
+
+        # 3. LÓGICA DE TRANSICIÓN: Detectar un NUEVO peligro
+        if cambio == deteccion.ABRE:
+            # CAMBIO DE ESTADO: Seguro -> Peligro
+            print(f"🚨 ¡NUEVA ALERTA DETECTADA en '{d.device_id}'! Enganchando estado de peligro.")
+            tipos, motivo = deteccion.tipos_y_motivo(disparos)
+            
+            alerta_data = {
+                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'dispositivo': d.device_id,
+                'temperatura': temp, 
+                'humo': humo, 
+                'tipo': tipos,
+                'motivo': motivo,
+                'config_version': config.version
+            }
+            # 🔑 ENVÍA EL EMAIL (SOLO 1 VEZ): histórico y aviso fuera del lock
+            eventos.append(('alerta', alerta_data))
+            
+            # ENGANCHAR EL ESTADO
+            d.estado_peligro_anterior = True
+
+        # 4. LÓGICA DE TRANSICIÓN: Detectar que el peligro HA PASADO
+        elif cambio == deteccion.SUELTA:
+            # CAMBIO DE ESTADO: Peligro -> Seguro
+            print(f"✅ El peligro ha pasado en '{d.device_id}'. Reseteando estado.")
+            eventos.append(('alerta_fin', {'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                                           'dispositivo': d.device_id}))
+            
+            # SOLTAR EL ESTADO
+            d.estado_peligro_anterior = False
+            soltada, d.alerta_abierta = d.alerta_abierta, None
+
+        # Picos de la alerta en curso (solo memoria; se guardan al cerrarla)
+        if d.alerta_abierta is not None:
+            d.alerta_abierta.actualizar(d.device_id, temp, humo)
+
+        # 5. Actualizar la última lectura para el cliente y publicar la instantánea
+        # (las rutas HTTP la leen sin tomar este lock)
+        # La bandera 'alerta' AHORA refleja el estado "enganchado"
+        d.ultima_lectura = {
+            'dispositivo': d.device_id,
+            'temperatura': temp, 
+            'humo': humo,
+            'humedad': humedad,
+            'nivel_temperatura': nivel_temp, 
+            'nivel_humo': nivel_humo,
+            'alerta': d.estado_peligro_anterior, # 🔑 El cliente ve el estado "enganchado"
+            'timestamp': ts,
+            # Epoch con milisegundos ('timestamp' es solo para mostrar) y marca del supervisor
+            'ts': round(ahora, 3),
+            'obsoleta': False
+        }
+        d.publicar_instantanea()
+    if ts_lectura is not None:
+        d.m_latencia_muestra.observar(time.monotonic() - ts_lectura)
+
+    # 6. Guardar en disco y empujar los deltas a los dashboards fuera del lock
+    escritor_lecturas.registrar(time.time(), d.device_id, temp, humo)
+    for tipo, datos in eventos:
+        if tipo == 'alerta':
+            alerta = registrar_alerta(datos, (d,))
+            if alerta is not None:
+                with d.lock:
+                    propia = d.alerta_abierta is None
+                    if propia:
+                        d.alerta_abierta = alerta
+                if not propia:
+                    # Una emergencia manual se adelantó: esta alerta no tiene quien la mantenga
+                    historial_alertas.soltar(alerta, d.device_id)
+        elif soltada is not None:
+            cerrar_alerta(soltada, d, datos)
+        bus_eventos.publicar(tipo, datos, canales)
+    bus_eventos.publicar('lectura', d.instantanea.lectura, (d.device_id,))
+    publicar_agregado(forzar=bool(eventos))
+
+
+def publicar_agregado(forzar=False):
+    """Instantánea y lectura agregadas ('*'), limitadas a INTERVALO_AGREGADO salvo transiciones"""
+    global _ultimo_agregado
+    ahora = time.monotonic()
+    if not forzar and ahora - _ultimo_agregado < INTERVALO_AGREGADO:
+        return
+    _ultimo_agregado = ahora
+    bus_eventos.publicar('lectura', agregado.publicar().lectura)
+
+
+def leer_arduino_continuo(d, generacion):
+    """Hilo lector de `d`; termina cuando el supervisor lo reemplaza (otra `generacion`)"""
+    print(f"📡 Lectura continua iniciada ({d.device_id})...")
+    while d.generacion == generacion:
+        # Bloquea este hilo (no el arranque) hasta que la placa responde, con backoff
+        d.conectar_con_reintentos()
+        if d.generacion != generacion:
+            return
+        if d.lector is None:
+            d.lector = LectorSerial(d.conexion, d.crear_decodificador(), d.device_id)
+            d.lector.al_confirmar = lambda datos: comandos.confirmar(d.device_id, datos)
+        else:
+            d.lector.cambiar_puerto(d.conexion)
+
+        while d.conexion is not None and d.generacion == generacion:
+            try:
+                # Sin reset_input_buffer(): se procesan todas las líneas llegadas desde la vuelta anterior
+                for ts_mono, temp, humo, humedad in d.lector.leer_muestras():
+                    if d.generacion != generacion:
+                        # Un read() que se desbloqueó tras el reinicio: lo que traiga es del lector nuevo
+                        return
+                    d.buffer.agregar(ts_mono, temp, humo)
+                    d.estadisticas.agregar(ts_mono, temp, humo)
+                    procesar_muestra(d, temp, humo, humedad, ts_mono)
+                    d.marcar_muestra(ts_mono)
+            except Exception as e:
+                if d.generacion != generacion:
+                    return
+                d.errores_lectura += 1
+                if isinstance(e, OSError) and not d.usar_dummy:
+                    # Placa desenchufada (SerialException es un OSError): se vuelve a conectar
+                    print(f"🔌 '{d.device_id}' desconectado ({e}). Reconectando...")
+                    d.desconectar()
+                else:
+                    d.errores_seguidos += 1
+                    print(f"❌ Error lectura ({d.device_id}): {e}")
+                    time.sleep(1)
+
+def iniciar_lector(d):
+    """Hilo lector de la generación actual de `d` (los de generaciones anteriores salen solos)"""
+    d.errores_seguidos = 0
+    d.hilo = threading.Thread(target=leer_arduino_continuo, args=(d, d.generacion),
+                              name=f'lector-{d.device_id}', daemon=True)
+    d.hilo.start()
+
+def reiniciar_lector(d, motivo):
+    """Supervisor: cierra el puerto (desbloquea un read() colgado) y arranca otro lector"""
+    print(f"♻️ Reiniciando el lector de '{d.device_id}' ({motivo})")
+    d.reinicios[motivo] = d.reinicios.get(motivo, 0) + 1
+    # Primero la generación: así el hilo viejo no reabre el puerto que se cierra aquí
+    d.generacion += 1
+    d.desconectar()
+    iniciar_lector(d)
+
+def marcar_obsoleta(d):
+    """Supervisor: republica la última lectura de `d` con 'obsoleta': true (la próxima muestra la limpia)"""
+    with d.lock:
+        if d.ultima_lectura.get('obsoleta'):
+            return
+        d.ultima_lectura = dict(d.ultima_lectura, obsoleta=True)
+        d.publicar_instantanea()
+    bus_eventos.publicar('lectura', d.instantanea.lectura, (d.device_id,))
+    publicar_agregado(forzar=True)
+
+def aviso_comando(comando):
+    """Cada cambio de estado de un comando se empuja por SSE (evento 'comando')"""
+    bus_eventos.publicar('comando', comando.resumen(), (comando.device_id, CANAL_AGREGADO))
+
+# Operaciones que solo puede hacer el proceso de ingesta (los procesos web las piden por socket)
+cliente_ingesta = compartido.ClienteIngesta()
+
+if INGESTA:
+    # Un hilo escritor por placa: el único que escribe en el puerto serie
+    comandos = GestorComandos(registro_dispositivos, aviso_comando)
+    ciclo.al_arrancar('comandos')(comandos.iniciar)
+
+    @ciclo.al_arrancar('lectores')
+    def iniciar_lectores():
+        # Un hilo de ingesta por placa; cada uno conecta (y reconecta) su puerto
+        for d in registro_dispositivos.todos():
+            iniciar_lector(d)
+
+    # Edad de la última muestra, lectores atascados y el cuerpo de /health y /ready
+    supervisor_salud = supervisor.Supervisor(registro_dispositivos, marcar_obsoleta, reiniciar_lector)
+    ciclo.al_arrancar('supervisor')(supervisor_salud.iniciar)
+
+    @ciclo.al_parar('lectores')
+    def cerrar_puertos():
+        for d in registro_dispositivos.todos():
+            d.desconectar()
+
+    ciclo.al_arrancar('despachador')(Despachador(outbox_avisos, entregar_aviso).iniciar)
+else:
+    comandos = compartido.ClienteComandos(cliente_ingesta)
+
+# ============================================
+# MÉTRICAS (/metrics en formato Prometheus)
+# ============================================
+LATENCIA_HTTP = metricas.histograma('http_peticion_segundos', 'Latencia del handler por ruta', ('ruta', 'metodo'),
+                                    metricas.BUCKETS_LENTOS)
+RESPUESTAS_HTTP = metricas.contador('http_respuestas_total', 'Respuestas por ruta y código', ('ruta', 'codigo'))
+LINEAS_SERIE = metricas.contador('serie_lineas_total', 'Líneas o tramas recibidas del puerto serie',
+                                 ('dispositivo', 'resultado'))
+LECTURAS_DB = metricas.contador('db_lecturas_total',
+                                'Lecturas persistidas, descartadas por cola llena o perdidas tras reintentar el lote',
+                                ('resultado',))
+COLA_ESCRITOR = metricas.gauge('db_lecturas_pendientes', 'Lecturas en cola del escritor')
+OUTBOX_PENDIENTES = metricas.gauge('outbox_pendientes', 'Avisos sin entregar en la outbox')
+OUTBOX_EDAD = metricas.gauge('outbox_edad_pendiente_mas_antigua_segundos', 'Antigüedad del aviso pendiente más viejo')
+SUSCRIPTORES_SSE = metricas.gauge('sse_suscriptores', 'Clientes conectados a /stream')
+COLA_COMANDOS = metricas.gauge('comandos_pendientes', 'Comandos a actuadores sin escribir', ('dispositivo',))
+EVALUACIONES_DETECCION = metricas.contador('deteccion_evaluaciones_total', 'Muestras evaluadas por cada detector',
+                                           ('dispositivo', 'detector'))
+COSTE_DETECCION = metricas.contador('deteccion_evaluacion_segundos_total', 'Tiempo acumulado evaluando cada detector',
+                                    ('dispositivo', 'detector'))
+EDAD_MUESTRA = metricas.gauge('lector_ultima_muestra_edad_segundos', 'Segundos desde la última muestra de la placa',
+                              ('dispositivo',))
+RITMO_MUESTRAS = metricas.gauge('lector_muestras_por_segundo', 'Muestras por segundo en la ventana del supervisor',
+                                ('dispositivo',))
+ERRORES_LECTOR = metricas.contador('lector_errores_total', 'Vueltas del hilo lector que acabaron en excepción',
+                                   ('dispositivo',))
+REINICIOS_LECTOR = metricas.contador('lector_reinicios_total', 'Lectores reiniciados por el supervisor',
+                                     ('dispositivo', 'motivo'))
+
+def refrescar_metricas():
+    ahora = time.monotonic()
+    for d in registro_dispositivos.todos():
+        if d.ultima_muestra is not None:
+            EDAD_MUESTRA.con(d.device_id).fijar(ahora - d.ultima_muestra)
+        RITMO_MUESTRAS.con(d.device_id).fijar(supervisor_salud.ritmos.get(d.device_id, 0.0))
+        ERRORES_LECTOR.con(d.device_id).fijar(d.errores_lectura)
+        for motivo, total in list(d.reinicios.items()):
+            REINICIOS_LECTOR.con(d.device_id, motivo).fijar(total)
+        if d.lector:
+            totales = d.lector.contadores.totales
+            LINEAS_SERIE.con(d.device_id, 'parseada').fijar(totales['parseadas'])
+            LINEAS_SERIE.con(d.device_id, 'malformada').fijar(totales['malformadas'])
+        for detector in d.deteccion.detectores:
+            EVALUACIONES_DETECCION.con(d.device_id, detector.nombre).fijar(detector.evaluaciones)
+            COSTE_DETECCION.con(d.device_id, detector.nombre).fijar(detector.coste_s)
+    LECTURAS_DB.con('escrita').fijar(escritor_lecturas.escritas)
+    LECTURAS_DB.con('descartada').fijar(escritor_lecturas.descartadas)
+    LECTURAS_DB.con('perdida').fijar(escritor_lecturas.perdidas)
+    COLA_ESCRITOR.fijar(escritor_lecturas.pendientes())
+    OUTBOX_PENDIENTES.fijar(outbox_avisos.profundidad())
+    OUTBOX_EDAD.fijar(outbox_avisos.edad_pendiente_mas_antigua())
+    SUSCRIPTORES_SSE.fijar(bus_eventos.total_suscriptores('sse'))
+    for device_id, canal in comandos.canales.items():
+        COLA_COMANDOS.con(device_id).fijar(canal.profundidad())
+
+# En modo web este estado vive en el proceso de ingesta (sus métricas llegan por el socket)
+if INGESTA:
+    metricas.REGISTRO.colector(refrescar_metricas)
+
+# /ws lo sirven el proceso único o los workers web, nunca el de ingesta
+if MODO != 'ingesta':
+    CONEXIONES_WS = metricas.gauge('ws_conexiones', 'Dashboards conectados a /ws')
+    CORTADAS_WS = metricas.contador('ws_cortadas_total', 'Conexiones /ws cortadas por clientes lentos')
+
+@app.before_request
+def iniciar_cronometro():
+    g.inicio_peticion = time.perf_counter()
+
+@app.after_request
+def medir_peticion(respuesta):
+    inicio = getattr(g, 'inicio_peticion', None)
+    if inicio is not None:
+        # La plantilla de la ruta (no la URL) mantiene acotado el número de series
+        regla = getattr(request, 'url_rule', None)
+        ruta = regla.rule if regla is not None else 'sin_ruta'
+        LATENCIA_HTTP.con(ruta, request.method).desde(inicio)
+        RESPUESTAS_HTTP.con(ruta, respuesta.status_code).sumar()
+    return respuesta
+
+@app.route('/metrics')
+def exponer_metricas():
+    if INGESTA:
+        cuerpo = metricas.REGISTRO.exponer()
+    else:
+        # Las del proceso de ingesta más las HTTP y WebSocket de este worker
+        cuerpo = (cliente_ingesta.llamar('metricas').encode('utf-8')
+                  + metricas.REGISTRO.exponer((LATENCIA_HTTP.nombre, RESPUESTAS_HTTP.nombre,
+                                               CONEXIONES_WS.nombre, CORTADAS_WS.nombre)))
+    return Response(cuerpo, content_type=metricas.TIPO_CONTENIDO)
+
+@app.errorhandler(compartido.IngestaNoDisponible)
+def ingesta_no_disponible(e):
+    return jsonify({'success': False, 'mensaje': str(e)}), 503, {'Retry-After': '2'}
+
+@app.errorhandler(compartido.ErrorRemoto)
+def error_remoto(e):
+    return jsonify({'success': False, 'error': str(e)}), 502
 
 # ============================================
 # RUTAS FLASK (CON LÓGICA DE ADMIN)
 # ============================================
 @app.route('/')
 def index():
-    if 'usuario_id' in session:
-        # Esta lógica es necesaria para que funcione el {% if es_admin %} en index.html
-        es_admin = False
-        if session.get('usuario_rol') == 'admin':
-             es_admin = True
-             
+    u = usuario_actual()
+    if u is not None:
+        # es_admin es necesario para que funcione el {% if es_admin %} en index.html
         return render_template('index.html', 
-                               usuario=session.get('usuario_nombre'),
-                               es_admin=es_admin) # Pasar es_admin al template
+                               usuario=u['nombre'],
+                               es_admin=es_admin(u)) # Pasar es_admin al template
     return redirect(url_for('login'))
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         data = request.get_json()
-        exito, res = verificar_usuario(data.get('email'), data.get('password'))
+        try:
+            exito, res = verificar_usuario(data.get('email'), data.get('password'), kdf)
+        except KDFSaturado as e:
+            return kdf_saturado(e)
         if exito:
-            # Guardar el ROL en la sesión es crucial para el Admin
-            session.update({
-                'usuario_id': res['id'],
-                'usuario_nombre': res['nombre'],
-                'usuario_telefono': res['telefono'],
-                'usuario_rol': res.get('rol', 'usuario') # Guardar el rol
-            })
+            # El ROL queda en la sesión del servidor; la cookie solo lleva el id opaco
+            sesiones.cerrar(session.get('sid'))
+            session.clear()
+            session['sid'] = sesiones.crear(res)
             return jsonify({'success': True})
         return jsonify({'success': False, 'mensaje': res}), 401
     return render_template('login.html')
@@ -431,7 +589,10 @@ def registro():
                 return jsonify({'success': False, 'mensaje': f'{campo} requerido'}), 400
         if len(data['password']) < 6:
             return jsonify({'success': False, 'mensaje': 'Contraseña mínima 6 caracteres'}), 400
-        exito, res = registrar_usuario(data['nombre'], data['email'], data.get('telefono', ''), data['password'])
+        try:
+            exito, res = registrar_usuario(data['nombre'], data['email'], data.get('telefono', ''), data['password'], kdf)
+        except KDFSaturado as e:
+            return kdf_saturado(e)
         if exito:
             return jsonify({'success': True})
         return jsonify({'success': False, 'mensaje': res}), 400
@@ -439,169 +600,585 @@ def registro():
 
 @app.route('/logout')
 def logout():
+    sesiones.cerrar(session.get('sid'))
     session.clear()
     return redirect(url_for('login'))
 
 @app.route('/perfil')
 def perfil():
-    if 'usuario_id' not in session:
+    u = usuario_actual()
+    if u is None:
         return redirect(url_for('login'))
-    conn = sqlite3.connect('alertas.db')
-    c = conn.cursor()
-    c.execute('SELECT nombre, email, telefono, notificaciones_activas, fecha_registro FROM usuarios WHERE id = ?', (session['usuario_id'],))
-    usuario = c.fetchone()
-    c.execute('SELECT tipo, temperatura, humo, mensaje, enviado, fecha FROM notificaciones WHERE usuario_id = ? ORDER BY fecha DESC LIMIT 20', (session['usuario_id'],))
-    notifs = c.fetchall()
-    conn.close()
+    usuario = perfiles.obtener(u['id'])
+    notifs = obtener_notificaciones_usuario(u['id'])
     return render_template('perfil.html', usuario=usuario, notificaciones=notifs)
 
 @app.route('/toggle_notificaciones', methods=['POST'])
 def toggle_notificaciones():
-    if 'usuario_id' not in session:
+    u = usuario_actual()
+    if u is None:
         return jsonify({'success': False}), 401
-    conn = sqlite3.connect('alertas.db')
-    c = conn.cursor()
-    c.execute('UPDATE usuarios SET notificaciones_activas = NOT notificaciones_activas WHERE id = ?', (session['usuario_id'],))
-    c.execute('SELECT notificaciones_activas FROM usuarios WHERE id = ?', (session['usuario_id'],))
-    estado = bool(c.fetchone()[0])
-    conn.commit()
-    conn.close()
+    estado = alternar_notificaciones(u['id'])
+    perfiles.invalidar(u['id'])
     return jsonify({'success': True, 'notificaciones_activas': estado})
 
+@app.route('/preferencias_email', methods=['POST'])
+def preferencias_email():
+    """Idioma y formato ('texto' o 'html') de los emails de alerta del usuario"""
+    u = usuario_actual()
+    if u is None:
+        return jsonify({'success': False}), 401
+    data = request.get_json(silent=True) or {}
+    idioma = data.get('idioma', plantillas.IDIOMA_POR_DEFECTO)
+    formato = data.get('formato', plantillas.FORMATO_POR_DEFECTO)
+    if idioma not in plantillas.IDIOMAS or formato not in plantillas.FORMATOS:
+        return jsonify({'success': False, 'mensaje': f"idioma: {', '.join(plantillas.IDIOMAS)}; "
+                                                     f"formato: {', '.join(plantillas.FORMATOS)}"}), 400
+    cambiar_preferencias_email(u['id'], idioma, formato)
+    perfiles.invalidar(u['id'])
+    return jsonify({'success': True, 'idioma': idioma, 'formato': formato})
+
+@app.route('/usuarios/<int:uid>/rol', methods=['POST'])
+def asignar_rol(uid):
+    """Cambia el rol de un usuario (solo admin); sus sesiones abiertas se cierran"""
+    if not es_admin(usuario_actual()):
+        return jsonify({'success': False, 'mensaje': 'Solo administradores'}), 403
+    rol = (request.get_json(silent=True) or {}).get('rol')
+    if rol not in ('admin', 'usuario'):
+        return jsonify({'success': False, 'mensaje': "rol debe ser 'admin' o 'usuario'"}), 400
+    if not cambiar_rol(uid, rol):
+        return jsonify({'success': False, 'mensaje': 'Usuario no encontrado'}), 404
+    sesiones.cerrar_usuario(uid)
+    perfiles.invalidar(uid)
+    return jsonify({'success': True, 'rol': rol})
+
+def dispositivos_solicitados():
+    """Placas pedidas con ?dispositivo=<id> (todas si no se indica); None si el id no existe"""
+    device_id = request.args.get('dispositivo')
+    if not device_id or device_id == CANAL_AGREGADO:
+        return registro_dispositivos.todos()
+    d = registro_dispositivos.obtener(device_id)
+    return [d] if d else None
+
+def cuerpo_dispositivo_desconocido():
+    return {'success': False, 'mensaje': 'Dispositivo desconocido', 'dispositivos': registro_dispositivos.ids()}
+
+def dispositivo_desconocido():
+    return jsonify(cuerpo_dispositivo_desconocido()), 404
+
+@app.route('/dispositivos')
+def listar_dispositivos():
+    return jsonify({'dispositivos': [d.estado() for d in registro_dispositivos.todos()]})
+
+def instantanea_solicitada(dispositivos):
+    """Instantánea publicada de una placa o de la vista agregada (sin locks)"""
+    return dispositivos[0].instantanea if len(dispositivos) == 1 else agregado.instantanea
+
+def placas_obsoletas(dispositivos):
+    """Placas sin muestras recientes según sus instantáneas publicadas (sin locks)"""
+    return [d.device_id for d in dispositivos if d.instantanea.lectura.get('obsoleta', False)]
+
+def responder_json(cuerpo, etag):
+    """Bytes ya codificados con ETag; 304 si el cliente ya tiene esa versión"""
+    cabeceras = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+    if etag in request.if_none_match:
+        return Response(status=304, headers=cabeceras)
+    return Response(cuerpo, mimetype='application/json', headers=cabeceras)
+
 @app.route('/leer') 
 def leer(): 
-    with lectura_lock: 
-        return jsonify(ultima_lectura)
+    dispositivos = dispositivos_solicitados()
+    if dispositivos is None:
+        return dispositivo_desconocido()
+    inst = instantanea_solicitada(dispositivos)
+    return responder_json(inst.lectura_json, inst.etag)
 
 @app.route('/historico') 
 def historico(): 
-    with lectura_lock: 
-        return jsonify({'temperatura': list(historico_temperatura), 'humo': list(historico_humo)})
+    dispositivos = dispositivos_solicitados()
+    if dispositivos is None:
+        return dispositivo_desconocido()
+
+    # Sin parámetros: últimas lecturas en memoria (gráficos del dashboard)
+    if not any(k in request.args for k in ('desde', 'hasta', 'resolucion')):
+        inst = instantanea_solicitada(dispositivos)
+        return responder_json(inst.historico_json(), f'{inst.etag}-h')
+
+    # Con rango: buckets min/avg/max desde la base de datos (?desde=&hasta=&resolucion=)
+    device_id = dispositivos[0].device_id if len(dispositivos) == 1 and 'dispositivo' in request.args else None
+    try:
+        hasta = serie_temporal.parsear_instante(request.args['hasta']) if 'hasta' in request.args else time.time()
+        desde = serie_temporal.parsear_instante(request.args['desde']) if 'desde' in request.args else hasta - 3600
+        resolucion = request.args.get('resolucion', 'auto')
+        if resolucion == 'auto':
+            resolucion = serie_temporal.resolucion_automatica(desde, hasta)
+        with pool.conexion() as conn:
+            datos = serie_temporal.consultar_historico(conn, desde, hasta, resolucion, device_id)
+    except (ValueError, OverflowError) as e:
+        return jsonify({'success': False, 'mensaje': f'Parámetros inválidos: {e}'}), 400
+    # Lo más reciente del rango puede faltar si alguna placa dejó de enviar
+    obsoletas = placas_obsoletas(dispositivos)
+    datos['obsoleta'] = bool(obsoletas)
+    datos['dispositivos_obsoletos'] = obsoletas
+    return jsonify(datos)
 
 @app.route('/alertas') 
 def alertas(): 
-    with lectura_lock: 
-        return jsonify({'alertas': list(historico_alertas)})
+    """Histórico de alertas en orden de id; ?after_id=N devuelve solo las posteriores a N.
+
+    Filtros: ?dispositivo=, ?tipo=temperatura|humo|emergencia_manual, ?desde=, ?hasta=, ?limite=
+    """
+    device_id = request.args.get('dispositivo')
+    try:
+        after_id = int(request.args['after_id']) if 'after_id' in request.args else None
+        limite = min(max(int(request.args.get('limite', LIMITE_POR_DEFECTO)), 1), LIMITE_MAXIMO)
+        desde = serie_temporal.parsear_instante(request.args['desde']) if 'desde' in request.args else None
+        hasta = serie_temporal.parsear_instante(request.args['hasta']) if 'hasta' in request.args else None
+    except ValueError as e:
+        return jsonify({'success': False, 'mensaje': f'Parámetros inválidos: {e}'}), 400
+    lista = historial_alertas.listar(after_id, limite, request.args.get('tipo'),
+                                     device_id if device_id != CANAL_AGREGADO else None, desde, hasta)
+    # Cursor para la siguiente petición (el mismo si no hubo nada nuevo)
+    ultimo_id = lista[-1]['id'] if lista else after_id
+    return jsonify({'alertas': lista, 'ultimo_id': ultimo_id})
+
+@app.route('/stream')
+def stream():
+    """Server-Sent Events: lectura actual al conectar y después solo deltas (?dispositivo= filtra)"""
+    dispositivos = dispositivos_solicitados()
+    if dispositivos is None:
+        return dispositivo_desconocido()
+    canal = request.args.get('dispositivo') or CANAL_AGREGADO
+    # El estado inicial se toma ya suscrito: lo que se publique entretanto llega como delta
+    inicial = lambda: [serializar_evento('lectura', instantanea_solicitada(dispositivos).lectura)]
+    return Response(
+        stream_with_context(bus_eventos.escuchar(canal, inicial)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def dispositivo_actuador():
+    """Placa destino de un comando (?dispositivo=, por defecto la principal)"""
+    device_id = request.args.get('dispositivo')
+    return registro_dispositivos.obtener(device_id) if device_id else registro_dispositivos.principal()
+
+@app.route('/comandos/<int:comando_id>')
+def estado_comando(comando_id):
+    comando = comandos.obtener(comando_id)
+    if comando is None:
+        return jsonify({'success': False, 'mensaje': 'Comando desconocido'}), 404
+    return jsonify({'success': True, 'comando': comando.resumen()})
+
+# Actuador -> (bytes por acción, prioridad, solo admin)
+ACTUADORES = {
+    'led': ({'on': b'L', 'off': b'l'}, COSMETICO, False),
+    'ventilador': ({'on': b'V', 'off': b'v'}, MANUAL, True),
+    'servomotor': ({'abrir': b'A', 'cerrar': b'C'}, MANUAL, True),
+}
+
+def orden_actuador(usuario, actuador, accion, d):
+    """(cuerpo, código HTTP) de un comando a un actuador: lo comparten las rutas POST y /ws.
+
+    202: el comando queda en la cola de la placa; su estado se consulta en /comandos/<id> o llega por SSE/WS.
+    """
+    acciones, prioridad, solo_admin = ACTUADORES[actuador]
+    if solo_admin and not es_admin(usuario):
+        return {'success': False, 'mensaje': 'No autorizado'}, 403
+    if d is None:
+        return cuerpo_dispositivo_desconocido(), 404
+    datos = acciones.get(accion)
+    if datos is None:
+        return {'success': False, 'mensaje': 'Acción desconocida'}, 400
+    comando = comandos.enviar(d, datos, prioridad)
+    if actuador == 'ventilador':
+        print(f"✅ Ventilador {'encendido' if accion == 'on' else 'apagado'} (comando {comando.id})")
+    elif actuador == 'servomotor':
+        print(f"✅ Servomotores: Puertas {'ABIERTAS' if accion == 'abrir' else 'CERRADAS'} (comando {comando.id})")
+    return {'success': True, 'estado': accion, 'comando': comando.resumen()}, 202
 
 @app.route('/led/<accion>', methods=['POST'])
 def led(accion):
-    try:
-        arduino.write(b'L' if accion == 'on' else b'l')
-        return jsonify({'success': True, 'estado': accion})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+    cuerpo, codigo = orden_actuador(usuario_actual(), 'led', accion, dispositivo_actuador())
+    return jsonify(cuerpo), codigo
     
 @app.route('/ventilador/<accion>', methods=['POST'])
 def ventilador(accion):
     # Solo Admin puede usar esto
-    if session.get('usuario_rol') != 'admin':
-        return jsonify({'success': False, 'mensaje': 'No autorizado'}), 403
-    try:
-        if accion == 'on':
-            arduino.write(b'V')
-            print("✅ Ventilador encendido")
-        elif accion == 'off':
-            arduino.write(b'v')
-            print("✅ Ventilador apagado")
-        return jsonify({'success': True, 'estado': accion})
-    except Exception as e:
-        print(f"❌ Error al controlar ventilador: {e}")
-        return jsonify({'success': False, 'error': str(e)})
+    cuerpo, codigo = orden_actuador(usuario_actual(), 'ventilador', accion, dispositivo_actuador())
+    return jsonify(cuerpo), codigo
 
 @app.route('/servomotor/<accion>', methods=['POST'])
 def servomotor(accion):
     # Solo Admin puede usar esto
-    if session.get('usuario_rol') != 'admin':
-        return jsonify({'success': False, 'mensaje': 'No autorizado'}), 403
+    cuerpo, codigo = orden_actuador(usuario_actual(), 'servomotor', accion, dispositivo_actuador())
+    return jsonify(cuerpo), codigo
+
+@app.route('/emergencia/manual', methods=['POST'])
+def emergencia_manual():
+    """Activa emergencia manualmente en todas las placas (solo admin)"""
     try:
-        if accion == 'abrir':
-            arduino.write(b'A')
-            print("✅ Servomotores: Puertas ABIERTAS")
-        elif accion == 'cerrar':
-            arduino.write(b'C')
-            print("✅ Servomotores: Puertas CERRADAS")
-        return jsonify({'success': True, 'estado': accion})
+        cuerpo, codigo = orden_emergencia(usuario_actual())
+        return jsonify(cuerpo), codigo
+    except compartido.IngestaNoDisponible as e:
+        return ingesta_no_disponible(e)
     except Exception as e:
-        print(f"❌ Error al controlar servomotor: {e}")
+        print(f"❌ Error en emergencia manual: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/emergencia/manual', methods=['POST'])
-def emergencia_manual():
-    """Activa emergencia manualmente (solo admin)"""
-    global estado_peligro_anterior
+def orden_emergencia(usuario):
+    """(cuerpo, código HTTP) de la emergencia manual pedida por `usuario` (POST o /ws)"""
+    if usuario is None:
+        return {'success': False, 'mensaje': 'No autorizado'}, 401
+    if not es_admin(usuario):
+        return {'success': False, 'mensaje': 'Solo administradores'}, 403
+    enviados = activar_emergencia_manual() if INGESTA else cliente_ingesta.llamar('emergencia')
+    return {'success': True, 'mensaje': 'Emergencia activada', 'comandos': enviados}, 202
+
+def activar_emergencia_manual():
+    """Comandos, latch, alerta y aviso de la emergencia manual (en el proceso dueño de las placas)"""
+    dispositivos = registro_dispositivos.todos()
+    # Comandos de hardware (en todas las plantas), por delante de cualquier otro en cola
+    enviados = [comandos.enviar(d, datos, EMERGENCIA) for d in dispositivos for datos in (b'V', b'A')]
+    print("✅ Emergencia manual: Ventilador y puertas activados")
     
-    if 'usuario_id' not in session:
-        return jsonify({'success': False, 'mensaje': 'No autorizado'}), 401
-    
-    if session.get('usuario_rol') != 'admin':
-        return jsonify({'success': False, 'mensaje': 'Solo administradores'}), 403
+    # Registrar como alerta manual (valores: peor caso del edificio) y notificar (vía outbox)
+    lectura_actual = lectura_agregada(dispositivos)
+    alerta = {
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'dispositivo': CANAL_AGREGADO,
+        'temperatura': lectura_actual['temperatura'],
+        'humo': lectura_actual['humo'],
+        'tipo': ['emergencia_manual'],
+        'motivo': 'manual',
+        'config_version': configuracion_umbrales.actual.version
+    }
+    abierta = registrar_alerta(alerta, dispositivos)
     
+    # ENGANCHAR EL ESTADO de cada placa (la alerta dura hasta que todas vuelvan a seguro)
+    for d in dispositivos:
+        with d.lock:
+            d.estado_peligro_anterior = True
+            propia = d.alerta_abierta is not None
+            if not propia:
+                d.alerta_abierta = abierta
+            d.ultima_lectura = dict(d.ultima_lectura, alerta=True)
+            d.publicar_instantanea()
+        if propia and abierta is not None:
+            # La placa ya tenía su propia alerta en curso: la emergencia no espera por ella
+            historial_alertas.soltar(abierta, d.device_id)
+
+    bus_eventos.publicar('alerta', alerta, [CANAL_AGREGADO] + registro_dispositivos.ids())
+    publicar_agregado(forzar=True)
+    return [c.resumen() for c in enviados]
+
+
+# ============================================
+# WEBSOCKET (/ws: eventos y órdenes en una conexión, ver canal_ws.py)
+# ============================================
+def orden_ws(conexion, mensaje):
+    """(cuerpo, código) de una orden recibida por /ws; la sesión se comprueba en cada una"""
+    usuario = sesiones.obtener(conexion.sid)
+    if usuario is None:
+        return {'success': False, 'mensaje': 'Sesión caducada'}, 401
+    tipo, argumentos = mensaje[0], mensaje[2:]
+    if not all(isinstance(a, str) for a in argumentos):
+        return {'success': False, 'mensaje': 'Argumentos inválidos'}, 400
     try:
-        # Comandos de hardware
-        arduino.write(b'V')
-        arduino.write(b'A')
-        print("✅ Emergencia manual: Ventilador y puertas activados")
-        
-        # Registrar en base de datos como alerta manual
-        with lectura_lock:
-            temp_actual = ultima_lectura['temperatura']
-            humo_actual = ultima_lectura['humo']
+        if tipo in ACTUADORES:
+            if not argumentos:
+                return {'success': False, 'mensaje': 'Falta la acción'}, 400
+            # [actuador, id, acción, placa?]: sin placa, la principal (como las rutas POST)
+            d = (registro_dispositivos.obtener(argumentos[1]) if len(argumentos) > 1
+                 else registro_dispositivos.principal())
+            return orden_actuador(usuario, tipo, argumentos[0], d)
+        if tipo == 'emergencia':
+            return orden_emergencia(usuario)
+        if tipo == 'canal':
+            return cambiar_canal_ws(conexion, argumentos[0] if argumentos else CANAL_AGREGADO)
+    except compartido.IngestaNoDisponible as e:
+        return {'success': False, 'mensaje': str(e)}, 503
+    except compartido.ErrorRemoto as e:
+        return {'success': False, 'error': str(e)}, 502
+    return {'success': False, 'mensaje': f'Orden desconocida: {tipo}'}, 400
 
-            alerta = {
-                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'temperatura': temp_actual,
-                'humo': humo_actual,
-                'tipo': ['emergencia_manual']
-            }
-            historico_alertas.append(alerta)
-            
-            # ENGANCHAR EL ESTADO
-            estado_peligro_anterior = True
-            
-            # Notificar a usuarios
-            threading.Thread(
-                target=notificar_usuarios_alerta,
-                args=(
-                    temp_actual, 
-                    humo_actual, 
-                    ['emergencia_manual']
-                ),
-                daemon=True
-            ).start()
-        
-        return jsonify({'success': True, 'mensaje': 'Emergencia activada'})
-    except Exception as e:
-        print(f"❌ Error en emergencia manual: {e}")
-        return jsonify({'success': False, 'error': str(e)})
+def cambiar_canal_ws(conexion, canal):
+    """Pasa el dashboard a otra placa (o a '*') y le envía su lectura actual"""
+    if canal == CANAL_AGREGADO:
+        inst = agregado.instantanea
+    else:
+        d = registro_dispositivos.obtener(canal)
+        if d is None:
+            return cuerpo_dispositivo_desconocido(), 404
+        inst = d.instantanea
+    bus_eventos.cambiar_canal(conexion.cola, canal)
+    conexion.encolar(canal_ws.trama_evento('lectura', inst.lectura))
+    return {'success': True, 'canal': canal}, 200
+
+central_ws = canal_ws.CentralWS(bus_eventos, orden_ws)
+
+class RespuestaWS(Response):
+    """Lo que devuelve /ws tras el cierre: el socket ya no habla HTTP y no se escribe nada"""
+
+    def __call__(self, environ, start_response):
+        canal_ws.terminar_peticion(environ)
+
+@app.route('/ws')
+def websocket():
+    """WebSocket del dashboard: eventos como /stream (?dispositivo= elige el canal) y órdenes
+    como las rutas POST, con la sesión de la cookie"""
+    if usuario_actual() is None:
+        return jsonify({'success': False, 'mensaje': 'No autorizado'}), 401
+    dispositivos = dispositivos_solicitados()
+    if dispositivos is None:
+        return dispositivo_desconocido()
+    if not canal_ws.es_handshake(request.environ):
+        return jsonify({'success': False, 'mensaje': 'Se esperaba un handshake WebSocket'}), 426, {'Upgrade': 'websocket'}
+    if not canal_ws.origen_permitido(request.environ):
+        # WebSocket entre sitios: otra página abriendo el canal con la cookie del usuario
+        return jsonify({'success': False, 'mensaje': 'Origen no permitido'}), 403
+    sock = canal_ws.socket_crudo(request.environ)
+    if sock is None:
+        return jsonify({'success': False, 'mensaje': 'El servidor no expone el socket (usar Gunicorn gthread)'}), 501
+    canal = request.args.get('dispositivo') or CANAL_AGREGADO
+    inicial = lambda: [canal_ws.trama_evento('lectura', instantanea_solicitada(dispositivos).lectura)]
+    conexion = central_ws.aceptar(sock, request.environ['HTTP_SEC_WEBSOCKET_KEY'], canal,
+                                  session.get('sid'), inicial)
+    if conexion is None:
+        return jsonify({'success': False, 'mensaje': 'Demasiadas conexiones'}), 503, {'Retry-After': '5'}
+    # Este hilo envía los eventos hasta que el cliente se va o se le corta
+    conexion.servir()
+    return RespuestaWS(status=101)
+
+if MODO != 'ingesta':
+    ciclo.al_arrancar('canal_ws')(central_ws.iniciar)
+
+    @metricas.REGISTRO.colector
+    def refrescar_metricas_ws():
+        CONEXIONES_WS.fijar(central_ws.conexiones)
+        CORTADAS_WS.con().fijar(central_ws.cortadas)
 
 
 @app.route('/configuracion', methods=['GET', 'POST'])
 def configuracion():
-    # 🔑 LÍNEA CORREGIDA (eliminando <\ctrl61>O)
-    global UMBRAL_TEMPERATURA_PELIGRO, UMBRAL_HUMO_PELIGRO
-    
+    """Umbrales vigentes (GET) o un cambio parcial que crea una versión nueva (POST, solo admin)"""
     if request.method == 'POST':
-        data = request.get_json()
-        UMBRAL_TEMPERATURA_PELIGRO = data.get('umbral_temperatura', UMBRAL_TEMPERATURA_PELIGRO)
-        UMBRAL_HUMO_PELIGRO = data.get('umbral_humo', UMBRAL_HUMO_PELIGRO)
-        return jsonify({'success': True})
-    return jsonify({'umbral_temperatura': UMBRAL_TEMPERATURA_PELIGRO, 'umbral_humo': UMBRAL_HUMO_PELIGRO})
+        usuario = usuario_actual()
+        if not es_admin(usuario):
+            return jsonify({'success': False, 'mensaje': 'Solo administradores'}), 403
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'success': False, 'mensaje': 'Se esperaba un objeto JSON'}), 400
+        if INGESTA:
+            cuerpo, codigo = aplicar_configuracion(data, usuario['id'])
+        else:
+            cuerpo, codigo = cliente_ingesta.llamar('configuracion', datos=data, usuario_id=usuario['id'])
+        return jsonify(cuerpo), codigo
+    return jsonify(leer_configuracion() if INGESTA else cliente_ingesta.llamar('configuracion'))
+
+@app.route('/configuracion/<int:version>')
+def version_configuracion(version):
+    """Una versión pasada de los umbrales (cada alerta guarda la suya en config_version)"""
+    config = configuracion_umbrales.version(version)
+    if config is None:
+        return jsonify({'success': False, 'mensaje': 'Versión desconocida'}), 404
+    return jsonify(config.json())
+
+def leer_configuracion():
+    return configuracion_umbrales.actual.json()
+
+def aplicar_configuracion(data, usuario_id=None):
+    """(cuerpo, código HTTP) del cambio: así viaja igual por el socket desde los procesos web.
+
+    `version` (la que el cliente leyó con GET) es opcional: si ya no es la vigente, 409.
+    """
+    data = dict(data)
+    version = data.pop('version', None)
+    try:
+        nueva = configuracion_umbrales.aplicar(data, usuario_id, version)
+    except umbrales.ConfiguracionInvalida as e:
+        return {'success': False, 'mensaje': str(e)}, 400
+    except umbrales.VersionObsoleta as e:
+        return {'success': False, 'mensaje': str(e), 'configuracion': leer_configuracion()}, 409
+    return {'success': True, 'configuracion': nueva.json()}, 200
 
 @app.route('/estadisticas')
 def estadisticas():
-    with lectura_lock:
-        if historico_temperatura:
-            temps = [x['value'] for x in historico_temperatura]
-            humos = [x['value'] for x in historico_humo]
-            return jsonify({
-                'temp_promedio': sum(temps)/len(temps), 'temp_max': max(temps), 'temp_min': min(temps),
-                'humo_promedio': sum(humos)/len(humos), 'humo_max': max(humos), 'humo_min': min(humos),
-                'total_alertas': len(historico_alertas), 'lecturas_realizadas': len(historico_temperatura)
-            })
-        return jsonify({k: 0 for k in ['temp_promedio', 'temp_max', 'temp_min', 'humo_promedio', 'humo_max', 'humo_min', 'total_alertas', 'lecturas_realizadas']})
+    dispositivos = dispositivos_solicitados()
+    if dispositivos is None:
+        return dispositivo_desconocido()
+    # Resumen precalculado al cerrar cada segundo: lectura O(1) sea cual sea la ventana
+    resumen = estadisticas_agregadas.obtener([d.estadisticas for d in dispositivos])
+    total_alertas = historial_alertas.total()
+    obsoletas = placas_obsoletas(dispositivos)
+    # Las placas obsoletas cambian el cuerpo: entran en el ETag (crc32, igual en todos los procesos)
+    etag = f'{resumen.etag}-{total_alertas}' + (f'-o{zlib.crc32(",".join(obsoletas).encode()):x}' if obsoletas else '')
+    return responder_json(resumen.json(total_alertas, obsoletas), etag)
+
+@app.route('/enlace')
+def enlace():
+    """Salud del enlace serie: líneas recibidas/parseadas/malformadas por segundo y totales"""
+    dispositivos = dispositivos_solicitados()
+    if dispositivos is None:
+        return dispositivo_desconocido()
+    return jsonify({d.device_id: d.estado_enlace() for d in dispositivos})
+
+@app.route('/outbox')
+def estado_outbox():
+    """Salud de la cola de avisos: profundidad y antigüedad del más viejo sin entregar"""
+    return jsonify({
+        'pendientes': outbox_avisos.profundidad(),
+        'edad_pendiente_mas_antigua_s': round(outbox_avisos.edad_pendiente_mas_antigua(), 1)
+    })
+
+
+# ============================================
+# EXPORTACIÓN (CSV/PARQUET EN STREAMING)
+# ============================================
+def parametros_exportacion():
+    """?desde=&hasta= (epoch o ISO; por defecto las últimas 24 h), ?formato=csv|parquet y ?gzip=1"""
+    hasta = serie_temporal.parsear_instante(request.args['hasta']) if 'hasta' in request.args else time.time()
+    desde = (serie_temporal.parsear_instante(request.args['desde']) if 'desde' in request.args
+             else hasta - exportacion.RANGO_POR_DEFECTO_S)
+    exportacion.comprobar_rango(desde, hasta)
+    formato = request.args.get('formato', 'csv')
+    exportacion.comprobar_formato(formato)
+    return desde, hasta, formato, request.args.get('gzip') == '1'
 
+def respuesta_exportacion(tabla, lotes, desde, hasta, formato, comprimida):
+    """Descarga troceada: las filas se leen y codifican mientras se envían"""
+    nombre = f'{tabla}_{exportacion.dia_utc(desde)}_{exportacion.dia_utc(hasta)}.{formato}'
+    if comprimida:
+        nombre += '.gz'
+    return Response(
+        stream_with_context(exportacion.exportar(tabla, lotes, formato, comprimida)),
+        content_type='application/gzip' if comprimida else exportacion.TIPOS_CONTENIDO[formato],
+        headers={'Content-Disposition': f'attachment; filename="{nombre}"', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/export/lecturas')
+def exportar_lecturas():
+    """Lecturas crudas de un rango (incluidos los días ya archivados); ?dispositivo= filtra una placa"""
+    try:
+        desde, hasta, formato, comprimida = parametros_exportacion()
+    except (ValueError, OverflowError) as e:
+        return jsonify({'success': False, 'mensaje': f'Parámetros inválidos: {e}'}), 400
+    except exportacion.FormatoNoDisponible as e:
+        return jsonify({'success': False, 'mensaje': str(e)}), 501
+    lotes = exportacion.lotes_lecturas(pool, desde, hasta, request.args.get('dispositivo'))
+    return respuesta_exportacion('lecturas', lotes, desde, hasta, formato, comprimida)
+
+@app.route('/export/notificaciones')
+def exportar_notificaciones():
+    """Notificaciones enviadas en un rango, con su alerta y destinatario (solo admin: lleva emails)"""
+    if not es_admin(usuario_actual()):
+        return jsonify({'success': False, 'mensaje': 'Solo administradores'}), 403
+    try:
+        desde, hasta, formato, comprimida = parametros_exportacion()
+    except (ValueError, OverflowError) as e:
+        return jsonify({'success': False, 'mensaje': f'Parámetros inválidos: {e}'}), 400
+    except exportacion.FormatoNoDisponible as e:
+        return jsonify({'success': False, 'mensaje': str(e)}), 501
+    lotes = exportacion.lotes_notificaciones(pool, desde, hasta)
+    return respuesta_exportacion('notificaciones', lotes, desde, hasta, formato, comprimida)
+
+
+# ============================================
+# MODO MULTIPROCESO (ver compartido.py y gunicorn.conf.py)
+# ============================================
+def op_comando(dispositivo, datos, prioridad):
+    d = registro_dispositivos.obtener(dispositivo)
+    if d is None:
+        raise ValueError(f"Dispositivo desconocido: {dispositivo}")
+    return comandos.enviar(d, datos.encode('latin-1'), prioridad).resumen()
+
+def op_estado_comando(comando_id):
+    comando = comandos.obtener(comando_id)
+    return comando.resumen() if comando else None
+
+def op_configuracion(datos=None, usuario_id=None):
+    if datos is not None:
+        return aplicar_configuracion(datos, usuario_id)
+    return leer_configuracion()
+
+if MODO == 'ingesta':
+    @ciclo.al_arrancar('segmento_compartido')
+    def iniciar_replicador():
+        # Estado que leen las rutas -> memoria compartida
+        segmento = compartido.Segmento.crear(compartido.Replicador.ranuras(registro_dispositivos),
+                                             instantaneas.ARRANQUE)
+        replicador = compartido.Replicador(segmento, registro_dispositivos, agregado, estadisticas_agregadas,
+                                           supervisor_salud)
+        bus_eventos.al_publicar = replicador.registrar_evento
+        replicador.iniciar()
+
+    @ciclo.al_arrancar('socket_ingesta')
+    def iniciar_servidor_ingesta():
+        # Operaciones <- socket Unix
+        compartido.ServidorIngesta({
+            'comando': op_comando,
+            'estado_comando': op_estado_comando,
+            'emergencia': activar_emergencia_manual,
+            'configuracion': op_configuracion,
+            'metricas': lambda: metricas.REGISTRO.exponer().decode('utf-8'),
+        }).iniciar()
+elif MODO == 'web':
+    espejo = compartido.Espejo(registro_dispositivos, agregado, estadisticas_agregadas, bus_eventos)
+    ciclo.al_arrancar('espejo')(espejo.iniciar)
+    # /health y /ready: el cuerpo del supervisor de la ingesta, mientras el segmento siga vivo
+    supervisor_salud = supervisor.SupervisorEspejo(espejo, compartido.PLAZO_REENGANCHE_S)
+    ciclo.al_arrancar('supervisor')(supervisor_salud.iniciar)
+
+
+# ============================================
+# FÁBRICA DE LA APLICACIÓN
+# ============================================
+def crear_app():
+    """Ejecuta los pasos de arranque (una sola vez por proceso) y devuelve la app.
+
+    Gunicorn la usa como `app:crear_app()`; `python app.py` la llama en __main__.
+    """
+    if ciclo.arrancar():
+        atexit.register(ciclo.parar)
+        ciclo.imprimir_informe()
+    return app
+
+# Sondeos de balanceadores y watchdogs: cuerpo precalculado por el supervisor, sin locks ni base
+CABECERAS_SALUD = {'Cache-Control': 'no-store'}
+
+@app.route('/health')
+def salud():
+    """Vivo: 200 mientras el supervisor refresque su estado (aunque alguna placa esté degradada)"""
+    cuerpo, codigo = supervisor_salud.salud()
+    return Response(cuerpo, codigo, mimetype='application/json', headers=CABECERAS_SALUD)
+
+@app.route('/ready')
+def preparado():
+    """Listo para tráfico: arranque terminado y al menos una placa con lecturas frescas"""
+    cuerpo, codigo = supervisor_salud.preparado()
+    return Response(cuerpo, codigo if ciclo.iniciado else 503, mimetype='application/json',
+                    headers=CABECERAS_SALUD)
+
+@app.route('/arranque')
+def informe_arranque():
+    """Dónde se fue el tiempo de arranque y cuánto tardó cada placa en conectar"""
+    informe = ciclo.informe()
+    informe['modo'] = MODO
+    if INGESTA:
+        informe['primera_conexion_s'] = {d.device_id: ciclo.desde_inicio(d.conectado_en)
+                                         for d in registro_dispositivos.todos()}
+    return jsonify(informe)
+
+
+if __name__ == '__main__' and MODO == 'ingesta':
+    crear_app()
+    print("🏭 Proceso de ingesta iniciado: placas, comandos y avisos (HTTP en los workers web)")
+    # SIGTERM (Gunicorn al parar) sale por sys.exit para liberar el segmento y el socket
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    while True:
+        time.sleep(3600)
 
 if __name__ == '__main__':
+    crear_app()
     print("🚀 Servidor Flask iniciado - Sistema de Alertas Inteligente")
     print("📧 Notificaciones por EMAIL (Gmail)")
     print("✅ Alertas solo se registran al detectar NUEVO peligro (Lógica de Latch Activada)")
@@ -0,0 +1,246 @@
+"""Autenticación: hash de contraseñas con sal (PBKDF2), pool acotado para el KDF y cachés en memoria.
+
+- Contraseñas: `pbkdf2_sha256$<iteraciones>$<sal hex>$<hash hex>`. Los hashes SHA-256
+  sin sal de versiones anteriores se siguen aceptando y se rehacen al iniciar sesión.
+- El KDF es caro a propósito; se ejecuta en un pool de pocos hilos con una cola
+  acotada, así que una ráfaga de logins se rechaza pronto en vez de acaparar la CPU.
+- Sesiones del servidor (la cookie solo lleva un identificador) y perfiles de
+  usuario en cachés TTL/LRU: autorizar una petición es una búsqueda en un dict.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+ALGORITMO = 'pbkdf2_sha256'
+# Iteraciones del KDF (subirlas con el hardware; los hashes viejos se rehacen al entrar)
+ITERACIONES_KDF = int(os.environ.get('KDF_ITERACIONES', '200000'))
+BYTES_SAL = 16
+# Hilos que calculan el KDF y cálculos en espera antes de rechazar logins
+HILOS_KDF = int(os.environ.get('KDF_HILOS', '2'))
+MAX_KDF_PENDIENTES = 32
+TIMEOUT_KDF_S = 10
+
+# Sesiones: inactividad máxima y sesiones simultáneas en memoria
+TTL_SESION_S = 8 * 3600
+MAX_SESIONES = 10000
+# Con almacén compartido (varios procesos web), vida de la copia local de cada sesión:
+# un logout o cambio de rol hecho en otro proceso tarda como mucho esto en verse
+TTL_SESION_LOCAL_S = 5
+# Clave de firma de cookies compartida por todos los procesos (SECRET_KEY o este fichero)
+RUTA_CLAVE_SECRETA = os.environ.get('RUTA_CLAVE_SECRETA', '.secret_key')
+# Perfiles de usuario cacheados para /perfil
+TTL_PERFIL_S = 300
+MAX_PERFILES = 2000
+
+
+class KDFSaturado(Exception):
+    """Demasiados cálculos de contraseña en curso: el cliente debe reintentar"""
+
+
+# ============================================
+# HASH DE CONTRASEÑAS
+# ============================================
+def hash_password(password, iteraciones=None, sal=None):
+    iteraciones = iteraciones or ITERACIONES_KDF
+    sal = sal or secrets.token_bytes(BYTES_SAL)
+    dk = hashlib.pbkdf2_hmac('sha256', password.encode(), sal, iteraciones)
+    return f'{ALGORITMO}${iteraciones}${sal.hex()}${dk.hex()}'
+
+
+def verificar_password(password, almacenado):
+    """Devuelve (correcta, hay_que_rehacer_el_hash)"""
+    if not almacenado:
+        return False, False
+    if not almacenado.startswith(ALGORITMO + '$'):
+        # Hash SHA-256 sin sal de la versión anterior
+        legado = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legado, almacenado), True
+    try:
+        _, iteraciones, sal, esperado = almacenado.split('$')
+        iteraciones = int(iteraciones)
+        sal = bytes.fromhex(sal)
+    except ValueError:
+        return False, False
+    dk = hashlib.pbkdf2_hmac('sha256', password.encode(), sal, iteraciones)
+    return hmac.compare_digest(dk.hex(), esperado), iteraciones < ITERACIONES_KDF
+
+
+class PoolKDF:
+    """Ejecuta el KDF fuera de los hilos de petición con una cola acotada.
+
+    pbkdf2_hmac libera el GIL, así que HILOS_KDF cálculos corren en paralelo
+    mientras el resto de peticiones (lecturas, SSE) siguen atendiéndose.
+    """
+
+    def __init__(self, hilos=HILOS_KDF, max_pendientes=MAX_KDF_PENDIENTES):
+        self._executor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='kdf')
+        self._plazas = threading.BoundedSemaphore(max_pendientes)
+
+    def ejecutar(self, funcion, *args, timeout=TIMEOUT_KDF_S):
+        if not self._plazas.acquire(blocking=False):
+            raise KDFSaturado("Demasiados inicios de sesión simultáneos, reintente en unos segundos")
+        try:
+            futuro = self._executor.submit(funcion, *args)
+        except Exception:
+            self._plazas.release()
+            raise
+        futuro.add_done_callback(lambda _: self._plazas.release())
+        return futuro.result(timeout=timeout)
+
+    def hash_password(self, password):
+        return self.ejecutar(hash_password, password)
+
+    def verificar_password(self, password, almacenado):
+        return self.ejecutar(verificar_password, password, almacenado)
+
+
+# ============================================
+# CLAVE DE FIRMA DE COOKIES
+# ============================================
+def clave_secreta(ruta=RUTA_CLAVE_SECRETA):
+    """Clave de Flask estable entre reinicios y procesos: SECRET_KEY o un fichero creado una vez"""
+    clave = os.environ.get('SECRET_KEY')
+    if clave:
+        return clave
+    try:
+        # O_EXCL: si varios procesos arrancan a la vez, solo uno la genera
+        fd = os.open(ruta, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(50):
+            with open(ruta) as f:
+                clave = f.read().strip()
+            if clave:
+                return clave
+            # El proceso que la creó aún no terminó de escribirla
+            time.sleep(0.01)
+        raise RuntimeError(f"Fichero de clave vacío: {ruta}")
+    clave = secrets.token_hex(32)
+    with os.fdopen(fd, 'w') as f:
+        f.write(clave)
+    return clave
+
+
+# ============================================
+# CACHÉS EN MEMORIA
+# ============================================
+class CacheTTL:
+    """Diccionario LRU con caducidad: O(1) por operación, seguro entre hilos"""
+
+    def __init__(self, max_entradas, ttl, renovar=False):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        # renovar=True: cada acierto alarga la vida (caducidad por inactividad)
+        self.renovar = renovar
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave):
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None or entrada[0] <= ahora:
+                if entrada is not None:
+                    del self._datos[clave]
+                self.fallos += 1
+                return None
+            self._datos.move_to_end(clave)
+            if self.renovar:
+                self._datos[clave] = (ahora + self.ttl, entrada[1])
+            self.aciertos += 1
+            return entrada[1]
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def invalidar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def invalidar_si(self, condicion):
+        """Borra las entradas cuyo valor cumple `condicion` (operación rara: cambios de rol)"""
+        with self._lock:
+            for clave in [c for c, (_, v) in self._datos.items() if condicion(v)]:
+                del self._datos[clave]
+
+    def __len__(self):
+        return len(self._datos)
+
+
+class Sesiones:
+    """Sesiones del servidor: identificador opaco -> datos del usuario autenticado.
+
+    Con `almacen` (p. ej. repositorio.AlmacenSesiones) la fuente de verdad es
+    compartida y la caché local solo ahorra la consulta durante TTL_SESION_LOCAL_S.
+    """
+
+    def __init__(self, max_sesiones=MAX_SESIONES, ttl=TTL_SESION_S, almacen=None):
+        self.ttl = ttl
+        self.almacen = almacen
+        if almacen is None:
+            self._cache = CacheTTL(max_sesiones, ttl, renovar=True)
+        else:
+            self._cache = CacheTTL(max_sesiones, TTL_SESION_LOCAL_S)
+
+    def crear(self, usuario):
+        sid = secrets.token_urlsafe(32)
+        datos = {'id': usuario['id'], 'nombre': usuario['nombre'],
+                 'telefono': usuario.get('telefono', ''), 'rol': usuario.get('rol') or 'usuario'}
+        if self.almacen is not None:
+            self.almacen.guardar(sid, datos, time.time() + self.ttl)
+        self._cache.guardar(sid, datos)
+        return sid
+
+    def obtener(self, sid):
+        if not sid:
+            return None
+        datos = self._cache.obtener(sid)
+        if datos is None and self.almacen is not None:
+            datos = self.almacen.cargar(sid, time.time() + self.ttl)
+            if datos is not None:
+                self._cache.guardar(sid, datos)
+        return datos
+
+    def cerrar(self, sid):
+        if sid:
+            self._cache.invalidar(sid)
+            if self.almacen is not None:
+                self.almacen.borrar(sid)
+
+    def cerrar_usuario(self, uid):
+        """Invalida todas las sesiones de un usuario (p. ej. tras cambiarle el rol)"""
+        self._cache.invalidar_si(lambda datos: datos['id'] == uid)
+        if self.almacen is not None:
+            self.almacen.borrar_usuario(uid)
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class CachePerfiles:
+    """Fila de `usuarios` por id, con caducidad; se invalida al modificar al usuario"""
+
+    def __init__(self, cargar, max_perfiles=MAX_PERFILES, ttl=TTL_PERFIL_S):
+        self._cargar = cargar
+        self._cache = CacheTTL(max_perfiles, ttl)
+
+    def obtener(self, uid):
+        perfil = self._cache.obtener(uid)
+        if perfil is None:
+            perfil = self._cargar(uid)
+            if perfil is not None:
+                self._cache.guardar(uid, perfil)
+        return perfil
+
+    def invalidar(self, uid):
+        self._cache.invalidar(uid)
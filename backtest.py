@@ -0,0 +1,332 @@
+"""Backtest de umbrales y latch de peligro sobre lecturas grabadas (NumPy).
+
+Reproduce, en operaciones vectoriales, la clasificación de `calcular_nivel` y las
+transiciones seguro -> peligro -> seguro del latch de `procesar_muestra`, y
+cuenta para cada par de umbrales (temperatura, humo):
+
+- alertas: transiciones seguro -> peligro (los emails que se habrían enviado)
+- falsos: alertas cuyo episodio de peligro duró una sola muestra
+- tiempo en alarma: segundos con el latch enganchado
+
+El barrido no recorre los pares uno a uno: cada cuenta es un recuento de puntos
+en un cuadrante (T < ut y H < uh), que sale de un histograma 2D acumulado sobre
+la rejilla de umbrales. El coste es O(muestras + pares).
+
+La pertenencia a 'peligro' usa la misma regla que `clasificacion.nivel`
+(`valor >= umbral`, `searchsorted(side='right')` = `bisect_right`); --verificar
+lo comprueba contra una reproducción muestra a muestra.
+
+El barrido en bloque modela el cruce de umbral simple: la etapa de
+deteccion.py con DETECTORES=umbral, DETECCION_N_DE_M=1/1 y DETECCION_BANDAS a 0.
+Lo que abriría producción se obtiene reproduciendo las muestras, una a una, por
+`deteccion.EtapaDeteccion` con la configuración del entorno (DETECTORES,
+DETECCION_N_DE_M, DETECCION_BANDAS) y el mismo latch (`deteccion.transicion`):
+siempre para los umbrales vigentes y, con --etapa, para los mejores pares.
+
+La fila "umbrales actuales" usa la configuración vigente de la base
+(umbrales.GestorUmbrales: la última versión, con la sustitución de
+--dispositivo si la tiene); --config-db elige otra base y, si no hay
+ninguna, se usan los umbrales por defecto.
+
+Uso:
+    python backtest.py --log arduino.log --temp 35:60:0.5 --humo 300:900:5
+    python backtest.py --db alertas.db --dispositivo principal --csv barrido.csv
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+
+import clasificacion
+import deteccion
+import umbrales
+from repositorio import PoolConexiones, RUTA_DB
+
+try:
+    import numpy as np
+except ImportError:  # dependencia opcional: solo la necesita esta herramienta
+    np = None
+
+# Periodo asumido entre líneas de un log sin marcas de tiempo (Arduino a ~10 Hz)
+PERIODO_LOG_S = 0.1
+# Un hueco mayor que esto (placa desconectada) no cuenta como tiempo en alarma
+MAX_HUECO_S = 5.0
+PATRON_LOG = r'T:\s*(-?\d+(?:\.\d*)?)\s*,\s*H:\s*(-?\d+(?:\.\d*)?)'
+
+
+# ============================================
+# CARGA DE DATOS
+# ============================================
+def cargar_log(ruta, periodo=PERIODO_LOG_S):
+    """Líneas 'T:..,H:..' de un log -> (ts, temperatura, humo); las demás se ignoran"""
+    datos = np.fromregex(ruta, PATRON_LOG, dtype=[('t', 'f8'), ('h', 'f8')])
+    ts = np.arange(len(datos), dtype=float) * periodo
+    return ts, datos['t'], datos['h']
+
+
+def cargar_db(ruta, dispositivo=None, desde=None, hasta=None):
+    """Lecturas guardadas por serie_temporal, en orden temporal"""
+    condiciones, parametros = [], []
+    for sql, valor in (('dispositivo = ?', dispositivo), ('ts >= ?', desde), ('ts < ?', hasta)):
+        if valor is not None:
+            condiciones.append(sql)
+            parametros.append(valor)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+    conn = sqlite3.connect(ruta)
+    try:
+        filas = conn.execute(f'SELECT ts, temperatura, humo FROM lecturas {where} ORDER BY ts',
+                             parametros).fetchall()
+    finally:
+        conn.close()
+    datos = np.array(filas, dtype=float).reshape(-1, 3)
+    return datos[:, 0], datos[:, 1], datos[:, 2]
+
+
+def duraciones(ts, max_hueco=MAX_HUECO_S):
+    """Segundos que 'representa' cada muestra (hasta la siguiente)"""
+    if len(ts) < 2:
+        return np.zeros(len(ts))
+    dt = np.diff(ts)
+    return np.minimum(np.append(dt, np.median(dt)), max_hueco)
+
+
+def cargar_umbrales(ruta, dispositivo=None):
+    """Umbrales vigentes de la placa según la base de la aplicación (por defecto si no hay configuración)"""
+    if not os.path.exists(ruta):
+        print(f"⚠️ No existe {ruta}: se usan los umbrales por defecto")
+        return umbrales.por_defecto().version, umbrales.por_defecto().para(dispositivo)
+    pool = PoolConexiones(ruta)
+    try:
+        config = umbrales.GestorUmbrales(pool).cargar()
+    except sqlite3.Error as e:
+        print(f"⚠️ Sin configuración de umbrales en {ruta} ({e}): se usan los valores por defecto")
+        config = umbrales.por_defecto()
+    finally:
+        pool.cerrar_todas()
+    return config.version, config.para(dispositivo)
+
+
+# ============================================
+# MOTOR VECTORIAL
+# ============================================
+def _cuadrante(x, y, umbrales_t, umbrales_h, pesos=None):
+    """Para cada (a, b): nº de puntos (o suma de pesos) con x < umbrales_t[a] e y < umbrales_h[b]"""
+    # searchsorted(side='right') = nº de umbrales <= valor: misma regla que clasificacion.nivel
+    ix = np.searchsorted(umbrales_t, x, side='right')
+    iy = np.searchsorted(umbrales_h, y, side='right')
+    ancho = len(umbrales_h) + 1
+    hist = np.bincount(ix * ancho + iy, weights=pesos, minlength=(len(umbrales_t) + 1) * ancho)
+    return hist.reshape(-1, ancho).cumsum(axis=0).cumsum(axis=1)[:-1, :-1]
+
+
+def barrido(temp, humo, dt, umbrales_t, umbrales_h):
+    """Alertas, falsos disparos y tiempo en alarma para cada par de umbrales (rejillas ordenadas).
+
+    Una muestra está a salvo si T < ut y H < uh. El latch sigue exactamente a esa
+    condición, así que una alerta es un par (anterior a salvo, actual no) y un
+    falso disparo un trío (a salvo, no, a salvo); ambos se cuentan por
+    inclusión-exclusión de recuentos de cuadrante.
+    """
+    umbrales_t = np.asarray(umbrales_t, dtype=float)
+    umbrales_h = np.asarray(umbrales_h, dtype=float)
+    # Muestra virtual inicial a salvo: el latch arranca desenganchado
+    t = np.concatenate(([-np.inf], temp))
+    h = np.concatenate(([-np.inf], humo))
+    cuadrante = lambda x, y, pesos=None: _cuadrante(x, y, umbrales_t, umbrales_h, pesos)
+
+    anterior_a_salvo = cuadrante(t[:-1], h[:-1])
+    ambas_a_salvo = cuadrante(np.maximum(t[:-1], t[1:]), np.maximum(h[:-1], h[1:]))
+    alertas = anterior_a_salvo - ambas_a_salvo
+
+    # Episodios de una muestra: (i-1 a salvo, i en peligro, i+1 a salvo)
+    extremos = cuadrante(np.maximum(t[:-2], t[2:]), np.maximum(h[:-2], h[2:]))
+    los_tres = cuadrante(np.maximum(np.maximum(t[:-2], t[1:-1]), t[2:]),
+                         np.maximum(np.maximum(h[:-2], h[1:-1]), h[2:]))
+    falsos = extremos - los_tres
+
+    tiempo_alarma = dt.sum() - cuadrante(temp, humo, dt)
+    return {'umbrales_temperatura': umbrales_t, 'umbrales_humo': umbrales_h,
+            'alertas': alertas.astype(np.int64), 'falsos': falsos.astype(np.int64),
+            'tiempo_alarma_s': tiempo_alarma}
+
+
+def distribucion_niveles(valores, tabla):
+    """Fracción de muestras en cada nivel con los umbrales dados"""
+    cuentas = np.bincount(clasificacion.indices_nivel(valores, tabla), minlength=len(clasificacion.NIVELES))
+    return dict(zip(clasificacion.NIVELES, (cuentas / max(1, len(valores))).round(4).tolist()))
+
+
+# ============================================
+# REPRODUCCIÓN MUESTRA A MUESTRA (referencia)
+# ============================================
+def reproducir(temp, humo, dt, umbral_t, umbral_h):
+    """Mismo cálculo que `barrido`, con `clasificacion.nivel` y el latch de procesar_muestra"""
+    tabla_t = clasificacion.bordes(umbral_t, umbral_t, umbral_t)
+    tabla_h = clasificacion.bordes(umbral_h, umbral_h, umbral_h)
+    enganchado = False
+    alertas = falsos = 0
+    tiempo = 0.0
+    duracion_episodio = 0
+    for temperatura, h, d in zip(temp.tolist(), humo.tolist(), dt.tolist()):
+        peligro = (clasificacion.nivel(temperatura, tabla_t) == 'peligro'
+                   or clasificacion.nivel(h, tabla_h) == 'peligro')
+        cambio = deteccion.transicion(enganchado, peligro, False)
+        if cambio == deteccion.ABRE:
+            alertas += 1
+            duracion_episodio = 0
+        elif cambio == deteccion.SUELTA and duracion_episodio == 1:
+            falsos += 1
+        enganchado = peligro
+        if enganchado:
+            duracion_episodio += 1
+            tiempo += d
+    return alertas, falsos, tiempo
+
+
+def reproducir_etapa(ts, temp, humo, dt, umbral_t, umbral_h, config=None):
+    """Alertas, falsos y tiempo en alarma con la etapa de detección y el latch de producción"""
+    etapa = deteccion.crear_etapa(config)
+    peligro = (umbral_t, umbral_h)
+    enganchado = False
+    alertas = falsos = 0
+    tiempo = 0.0
+    duracion_episodio = 0
+    for t, temperatura, h, d in zip(ts.tolist(), temp.tolist(), humo.tolist(), dt.tolist()):
+        disparos, mantiene = etapa.evaluar(t, (temperatura, h), peligro)
+        cambio = deteccion.transicion(enganchado, disparos, mantiene)
+        if cambio == deteccion.ABRE:
+            alertas += 1
+            duracion_episodio = 0
+            enganchado = True
+        elif cambio == deteccion.SUELTA:
+            if duracion_episodio == 1:
+                falsos += 1
+            enganchado = False
+        if enganchado:
+            duracion_episodio += 1
+            tiempo += d
+    return alertas, falsos, tiempo
+
+
+def describir_etapa(config):
+    n, m = config['n_de_m']
+    bandas = ', '.join(f'{campo} {banda:g}' for campo, banda in config['bandas'].items())
+    return f"{'+'.join(config['detectores'])}, {n} de {m}, bandas {bandas}"
+
+
+def verificar(temp, humo, dt, resultado, pares=20, max_muestras=200000):
+    """Compara pares al azar del barrido con la reproducción escalar"""
+    temp, humo, dt = temp[:max_muestras], humo[:max_muestras], dt[:max_muestras]
+    parcial = barrido(temp, humo, dt, resultado['umbrales_temperatura'], resultado['umbrales_humo'])
+    errores = 0
+    for _ in range(pares):
+        a = random.randrange(len(parcial['umbrales_temperatura']))
+        b = random.randrange(len(parcial['umbrales_humo']))
+        esperado = reproducir(temp, humo, dt, parcial['umbrales_temperatura'][a], parcial['umbrales_humo'][b])
+        obtenido = (parcial['alertas'][a, b], parcial['falsos'][a, b], parcial['tiempo_alarma_s'][a, b])
+        if esperado[:2] != tuple(int(v) for v in obtenido[:2]) or abs(esperado[2] - obtenido[2]) > 1e-6 * max(1.0, esperado[2]):
+            errores += 1
+            print(f"❌ ({parcial['umbrales_temperatura'][a]}, {parcial['umbrales_humo'][b]}): "
+                  f"escalar={esperado} vectorial={obtenido}")
+    return errores
+
+
+# ============================================
+# LÍNEA DE COMANDOS
+# ============================================
+def rango(texto):
+    """'inicio:fin:paso' (fin incluido) o lista 'a,b,c'"""
+    if ':' in texto:
+        inicio, fin, paso = (float(v) for v in texto.split(':'))
+        return np.arange(inicio, fin + paso / 2, paso)
+    return np.array(sorted(float(v) for v in texto.split(',')))
+
+
+def guardar_csv(ruta, resultado):
+    ut, uh = np.meshgrid(resultado['umbrales_temperatura'], resultado['umbrales_humo'], indexing='ij')
+    tabla = np.column_stack([ut.ravel(), uh.ravel(), resultado['alertas'].ravel(),
+                             resultado['falsos'].ravel(), resultado['tiempo_alarma_s'].ravel()])
+    np.savetxt(ruta, tabla, delimiter=',', fmt=['%g', '%g', '%d', '%d', '%.1f'],
+               header='umbral_temperatura,umbral_humo,alertas,falsos,tiempo_alarma_s', comments='')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    origen = parser.add_mutually_exclusive_group(required=True)
+    origen.add_argument('--log', help="fichero con líneas 'T:..,H:..'")
+    origen.add_argument('--db', help='base de datos con la tabla lecturas')
+    parser.add_argument('--dispositivo')
+    parser.add_argument('--config-db', help=f'base con la configuración de umbrales (por defecto --db o {RUTA_DB})')
+    parser.add_argument('--periodo', type=float, default=PERIODO_LOG_S, help='segundos entre líneas del log')
+    parser.add_argument('--temp', default='30:70:0.5', help='umbrales de temperatura inicio:fin:paso')
+    parser.add_argument('--humo', default='200:1000:5', help='umbrales de humo inicio:fin:paso')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--csv', help='guarda el barrido completo')
+    parser.add_argument('--verificar', type=int, default=0, metavar='PARES',
+                        help='contrasta PARES pares al azar con la reproducción muestra a muestra')
+    parser.add_argument('--etapa', action='store_true',
+                        help='añade a los mejores pares lo que abriría la etapa de detección de producción')
+    args = parser.parse_args()
+
+    if np is None:
+        sys.exit("backtest.py necesita NumPy: pip install numpy")
+
+    inicio = time.perf_counter()
+    if args.log:
+        ts, temp, humo = cargar_log(args.log, args.periodo)
+    else:
+        ts, temp, humo = cargar_db(args.db, args.dispositivo)
+    validas = ~(np.isnan(temp) | np.isnan(humo))
+    ts, temp, humo = ts[validas], temp[validas], humo[validas]
+    dt = duraciones(ts)
+    carga = time.perf_counter() - inicio
+    if not len(temp):
+        sys.exit("Sin lecturas que analizar")
+
+    inicio = time.perf_counter()
+    resultado = barrido(temp, humo, dt, rango(args.temp), rango(args.humo))
+    duracion = time.perf_counter() - inicio
+    ut, uh = resultado['umbrales_temperatura'], resultado['umbrales_humo']
+    print(f"📊 {len(temp)} muestras ({dt.sum() / 3600:.1f} h), {len(ut)}x{len(uh)} = {ut.size * uh.size} pares "
+          f"(carga {carga:.2f}s, barrido {duracion:.2f}s)")
+
+    version, vigentes = cargar_umbrales(args.config_db or args.db or RUTA_DB, args.dispositivo)
+    umbral_t, umbral_h = vigentes.peligro
+    actual = barrido(temp, humo, dt, [umbral_t], [umbral_h])
+    print(f"Umbrales actuales (versión {version}: {umbral_t}°C, {umbral_h} ppm): {actual['alertas'][0, 0]} alertas, "
+          f"{actual['falsos'][0, 0]} falsos, {actual['tiempo_alarma_s'][0, 0]:.0f}s en alarma")
+    config_deteccion = deteccion.configuracion()
+    etapa = reproducir_etapa(ts, temp, humo, dt, umbral_t, umbral_h, config_deteccion)
+    print(f"Con la etapa de detección ({describir_etapa(config_deteccion)}): {etapa[0]} alertas, "
+          f"{etapa[1]} falsos, {etapa[2]:.0f}s en alarma")
+    print(f"Niveles de temperatura: {distribucion_niveles(temp, vigentes.bordes[0])}")
+    print(f"Niveles de humo: {distribucion_niveles(humo, vigentes.bordes[1])}")
+
+    # Pares con menos falsos disparos por alerta (a igualdad, los que más alertan)
+    alertas, falsos = resultado['alertas'].ravel(), resultado['falsos'].ravel()
+    con_alertas = np.flatnonzero(alertas)
+    orden = con_alertas[np.lexsort((-alertas[con_alertas], falsos[con_alertas] / alertas[con_alertas]))]
+    print(f"{'temp':>7} {'humo':>7} {'alertas':>8} {'falsos':>7} {'alarma_s':>9}"
+          + (f" {'etapa_al':>8} {'etapa_fa':>8} {'etapa_s':>8}" if args.etapa else ''))
+    for k in orden[:args.top]:
+        a, b = divmod(int(k), len(uh))
+        fila = f"{ut[a]:>7g} {uh[b]:>7g} {alertas[k]:>8d} {falsos[k]:>7d} {resultado['tiempo_alarma_s'][a, b]:>9.0f}"
+        if args.etapa:
+            al, fa, seg = reproducir_etapa(ts, temp, humo, dt, ut[a], uh[b], config_deteccion)
+            fila += f" {al:>8d} {fa:>8d} {seg:>8.0f}"
+        print(fila)
+
+    if args.csv:
+        guardar_csv(args.csv, resultado)
+        print(f"💾 Barrido guardado en {args.csv}")
+    if args.verificar:
+        errores = verificar(temp, humo, dt, resultado, args.verificar)
+        print("✅ Vectorial = escalar" if not errores else f"❌ {errores} pares no coinciden")
+        if errores:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
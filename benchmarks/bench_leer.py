@@ -0,0 +1,169 @@
+"""Latencia de /leer con N clientes concurrentes: lock compartido (antes) vs instantánea (después).
+
+Modo en proceso (por defecto, sin servidor):
+    python benchmarks/bench_leer.py --clientes 200
+
+Reproduce el patrón de la ruta: el hilo de ingesta actualiza la lectura a
+--hz muestras/s y en cada una retiene el lock durante --retencion-ms (append,
+clasificación y, en las alertas, el registro). "antes" toma ese mismo lock
+y hace jsonify en cada petición; "despues" devuelve los bytes de la
+instantánea publicada y responde 304 si el ETag coincide.
+
+Modo HTTP (contra un servidor arrancado, p. ej. antes y después del cambio):
+    python benchmarks/bench_leer.py --url http://127.0.0.1:5000/leer --clientes 200
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from instantaneas import Instantanea  # noqa: E402
+
+
+def percentiles(latencias):
+    latencias = sorted(latencias)
+    n = len(latencias)
+    def p(q):
+        return latencias[min(n - 1, int(q * n))] * 1000
+    return {'n': n, 'p50_ms': round(p(0.50), 3), 'p99_ms': round(p(0.99), 3),
+            'max_ms': round(latencias[-1] * 1000, 3)}
+
+
+# ============================================
+# MODO EN PROCESO
+# ============================================
+class Estado:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.historico = deque(maxlen=50)
+        self.lectura = {'dispositivo': 'principal', 'temperatura': 0, 'humo': 0,
+                        'nivel_temperatura': 'bajo', 'nivel_humo': 'bajo',
+                        'alerta': False, 'timestamp': '00:00:00'}
+        self.version = 0
+        self.instantanea = Instantanea('principal', 0, dict(self.lectura))
+
+
+def ingesta(estado, hz, retencion, parar):
+    periodo = 1 / hz
+    i = 0
+    while not parar.is_set():
+        with estado.lock:
+            i += 1
+            estado.historico.append({'time': str(i), 'value': 25 + i % 7})
+            fin = time.perf_counter() + retencion
+            while time.perf_counter() < fin:
+                pass
+            estado.lectura.update({'temperatura': 25 + i % 7, 'humo': 50 + i % 11, 'timestamp': str(i)})
+            estado.version += 1
+            estado.instantanea = Instantanea('principal', estado.version, dict(estado.lectura))
+        time.sleep(periodo)
+
+
+def handler_antes(estado, _etag):
+    with estado.lock:
+        return json.dumps(estado.lectura).encode(), None
+
+
+def handler_despues(estado, etag):
+    inst = estado.instantanea
+    if etag == inst.etag:
+        return b'', inst.etag
+    return inst.lectura_json, inst.etag
+
+
+def cliente(estado, handler, peticiones, pausa, latencias):
+    etag = None
+    locales = []
+    for _ in range(peticiones):
+        t0 = time.perf_counter()
+        _, etag = handler(estado, etag)
+        locales.append(time.perf_counter() - t0)
+        time.sleep(pausa)
+    latencias.extend(locales)
+
+
+def en_proceso(args):
+    resultados = {}
+    for nombre, handler in (('antes', handler_antes), ('despues', handler_despues)):
+        estado = Estado()
+        parar = threading.Event()
+        hilo = threading.Thread(target=ingesta, args=(estado, args.hz, args.retencion_ms / 1000, parar), daemon=True)
+        hilo.start()
+        latencias = []
+        hilos = [threading.Thread(target=cliente, args=(estado, handler, args.peticiones, args.pausa_ms / 1000, latencias))
+                 for _ in range(args.clientes)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        parar.set()
+        hilo.join()
+        resultados[nombre] = percentiles(latencias)
+    return resultados
+
+
+# ============================================
+# MODO HTTP
+# ============================================
+def cliente_http(url, peticiones, pausa, latencias, errores):
+    partes = urlsplit(url)
+    conn = http.client.HTTPConnection(partes.hostname, partes.port or 80, timeout=30)
+    ruta = partes.path + (f'?{partes.query}' if partes.query else '')
+    etag = None
+    locales = []
+    for _ in range(peticiones):
+        cabeceras = {'If-None-Match': etag} if etag else {}
+        t0 = time.perf_counter()
+        try:
+            conn.request('GET', ruta, headers=cabeceras)
+            resp = conn.getresponse()
+            resp.read()
+            etag = resp.getheader('ETag') or etag
+        except (OSError, http.client.HTTPException):
+            errores.append(1)
+            conn.close()
+            continue
+        locales.append(time.perf_counter() - t0)
+        time.sleep(pausa)
+    conn.close()
+    latencias.extend(locales)
+
+
+def http_remoto(args):
+    latencias, errores = [], []
+    hilos = [threading.Thread(target=cliente_http, args=(args.url, args.peticiones, args.pausa_ms / 1000, latencias, errores))
+             for _ in range(args.clientes)]
+    inicio = time.perf_counter()
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    duracion = time.perf_counter() - inicio
+    resultado = percentiles(latencias) if latencias else {'n': 0}
+    resultado.update({'errores': len(errores), 'peticiones_s': round(len(latencias) / duracion, 1)})
+    return {args.url: resultado}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clientes', type=int, default=200)
+    parser.add_argument('--peticiones', type=int, default=200, help='peticiones por cliente')
+    parser.add_argument('--pausa-ms', type=float, default=1.0, help='pausa entre peticiones de un cliente')
+    parser.add_argument('--hz', type=float, default=100, help='muestras/s de la ingesta simulada')
+    parser.add_argument('--retencion-ms', type=float, default=0.5, help='tiempo que la ingesta retiene el lock')
+    parser.add_argument('--url', help='mide un servidor real en lugar del modo en proceso')
+    args = parser.parse_args()
+
+    resultados = http_remoto(args) if args.url else en_proceso(args)
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Líneas/s del parser serie: el antiguo (`split` + `except`), el decodificador de texto y la trama binaria.
+
+    python benchmarks/bench_parser.py --muestras 200000
+
+Cada variante trocea y decodifica el mismo flujo en bloques de --bloque bytes,
+como hace LectorSerial con `read(in_waiting)`.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from protocolo import DecodificadorBinario, DecodificadorTexto, codificar_trama  # noqa: E402
+
+
+def parsear_datos(data_str):
+    # Parser anterior, tal cual estaba en app.py
+    try:
+        if 'T:' in data_str and 'H:' in data_str:
+            partes = data_str.split(',')
+            temp = float(partes[0].split(':')[1])
+            humo = float(partes[1].split(':')[1])
+            return temp, humo
+        elif 'Temp:' in data_str and 'Humo:' in data_str:
+            temp = float(data_str.split('Temp:')[1].split('°')[0].strip())
+            humo = float(data_str.split('Humo:')[1].split('|')[0].strip())
+            return temp, humo
+    except: pass
+    return None, None
+
+
+class DecodificadorAntiguo:
+    """Troceado de LectorSerial + decode + parsear_datos (camino anterior)"""
+
+    binario = False
+
+    def extraer(self, pendiente):
+        *lineas, resto = pendiente.split(b'\n')
+        muestras = []
+        for linea in lineas:
+            linea = linea.strip()
+            if not linea:
+                continue
+            temp, humo = parsear_datos(linea.decode('utf-8', errors='ignore'))
+            if temp is not None and humo is not None:
+                muestras.append((temp, humo, None))
+        return muestras, resto, len(lineas), 0
+
+
+def generar(n):
+    valores = [(random.uniform(15, 80), random.uniform(0, 900), random.uniform(20, 90)) for _ in range(n)]
+    texto = b''.join(f'T:{t:.1f},H:{h:.1f},RH:{rh:.1f}\r\n'.encode() for t, h, rh in valores)
+    binario = b''.join(codificar_trama(i, t, h, rh) for i, (t, h, rh) in enumerate(valores))
+    return texto, binario
+
+
+def medir(decodificador, flujo, bloque, repeticiones):
+    mejor = None
+    for _ in range(repeticiones):
+        pendiente = bytearray()
+        total = 0
+        inicio = time.perf_counter()
+        for i in range(0, len(flujo), bloque):
+            pendiente += flujo[i:i + bloque]
+            muestras, resto, _, _ = decodificador.extraer(pendiente)
+            pendiente = bytearray(resto)
+            total += len(muestras)
+        duracion = time.perf_counter() - inicio
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    return total, mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--muestras', type=int, default=200000)
+    parser.add_argument('--bloque', type=int, default=512, help='bytes por read(in_waiting)')
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+
+    texto, binario = generar(args.muestras)
+    resultados = {}
+    for nombre, decodificador, flujo in (('antiguo', DecodificadorAntiguo(), texto),
+                                         ('texto', DecodificadorTexto(), texto),
+                                         ('binario', DecodificadorBinario(), binario)):
+        total, duracion = medir(decodificador, flujo, args.bloque, args.repeticiones)
+        resultados[nombre] = {'muestras': total, 'bytes_por_muestra': round(len(flujo) / args.muestras, 1),
+                              'lineas_s': round(total / duracion)}
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == '__main__':
+    main()
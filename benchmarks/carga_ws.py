@@ -0,0 +1,213 @@
+"""Prueba de carga de /ws: N dashboards WebSocket simultáneos contra un servidor arrancado.
+
+    GUNICORN_WORKERS=1 gunicorn -c gunicorn.conf.py &
+    python benchmarks/carga_ws.py --url http://127.0.0.1:5000 --email admin@x --password secreto
+
+Abre --clientes conexiones (con la cookie de sesión de --email/--password),
+cuenta los eventos que recibe cada una durante --duracion segundos y mide el
+tiempo de ida y vuelta de una orden ["canal", id, "*"] por cliente (no mueve
+ningún actuador). Un cliente más no lee nunca (buffer de recepción mínimo):
+con suficientes eventos el servidor debe cortarlo en vez de acumular memoria.
+Todo corre en un hilo con selectors; el resultado sale en JSON.
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import selectors
+import socket
+import struct
+import sys
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_leer import percentiles  # noqa: E402
+
+
+def iniciar_sesion(host, puerto, email, password):
+    """Cookie de sesión tras POST /login (None sin credenciales)"""
+    if not email:
+        return None
+    conn = http.client.HTTPConnection(host, puerto, timeout=10)
+    conn.request('POST', '/login', json.dumps({'email': email, 'password': password}),
+                 {'Content-Type': 'application/json'})
+    respuesta = conn.getresponse()
+    respuesta.read()
+    if respuesta.status != 200:
+        raise SystemExit(f"Login fallido ({respuesta.status})")
+    return respuesta.getheader('Set-Cookie').split(';', 1)[0]
+
+
+def trama_cliente(payload, opcode=0x1):
+    """Trama enmascarada (obligatorio del cliente al servidor)"""
+    mascara = os.urandom(4)
+    n = len(payload)
+    cabecera = struct.pack('!BB', 0x80 | opcode, 0x80 | n) if n < 126 else struct.pack('!BBH', 0x80 | opcode, 0xFE, n)
+    enmascarado = bytes(b ^ mascara[i % 4] for i, b in enumerate(payload))
+    return cabecera + mascara + enmascarado
+
+
+def extraer_tramas(buf):
+    """Tramas completas del servidor (sin máscara) al principio de `buf`: ([(opcode, payload)], consumidos)"""
+    tramas = []
+    pos = 0
+    while len(buf) - pos >= 2:
+        opcode, n = buf[pos] & 0x0F, buf[pos + 1] & 0x7F
+        cabecera = 2
+        if n == 126:
+            if len(buf) - pos < 4:
+                break
+            n = struct.unpack_from('!H', buf, pos + 2)[0]
+            cabecera = 4
+        elif n == 127:
+            if len(buf) - pos < 10:
+                break
+            n = struct.unpack_from('!Q', buf, pos + 2)[0]
+            cabecera = 10
+        if len(buf) - pos < cabecera + n:
+            break
+        tramas.append((opcode, bytes(buf[pos + cabecera:pos + cabecera + n])))
+        pos += cabecera + n
+    return tramas, pos
+
+
+def conectar(host, puerto, ruta, cookie, rcvbuf=None):
+    """Socket con el handshake hecho (bloqueante); lanza si el servidor no responde 101"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if rcvbuf:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    s.settimeout(10)
+    s.connect((host, puerto))
+    clave = base64.b64encode(os.urandom(16)).decode()
+    cabeceras = [f'GET {ruta} HTTP/1.1', f'Host: {host}:{puerto}', 'Upgrade: websocket', 'Connection: Upgrade',
+                 f'Sec-WebSocket-Key: {clave}', 'Sec-WebSocket-Version: 13', f'Origin: http://{host}:{puerto}']
+    if cookie:
+        cabeceras.append(f'Cookie: {cookie}')
+    s.sendall(('\r\n'.join(cabeceras) + '\r\n\r\n').encode())
+    respuesta = b''
+    while b'\r\n\r\n' not in respuesta:
+        trozo = s.recv(4096)
+        if not trozo:
+            raise ConnectionError('Conexión cerrada durante el handshake')
+        respuesta += trozo
+    cabecera, _, resto = respuesta.partition(b'\r\n\r\n')
+    if not cabecera.startswith(b'HTTP/1.1 101'):
+        raise ConnectionError(cabecera.split(b'\r\n', 1)[0].decode())
+    return s, bytearray(resto)
+
+
+class Cliente:
+    def __init__(self, sock, buf):
+        self.sock = sock
+        self.buf = buf
+        self.eventos = 0
+        self.enviada = None
+        self.rtt = None
+        self.cerrado = False
+
+
+def ejecutar(args):
+    partes = urlsplit(args.url)
+    host, puerto = partes.hostname, partes.port or 80
+    cookie = iniciar_sesion(host, puerto, args.email, args.password)
+
+    inicio = time.perf_counter()
+    clientes, fallos = [], []
+    for _ in range(args.clientes):
+        try:
+            clientes.append(Cliente(*conectar(host, puerto, '/ws', cookie)))
+        except OSError as e:
+            fallos.append(str(e))
+    handshakes_s = time.perf_counter() - inicio
+    lento, _ = conectar(host, puerto, '/ws', cookie, rcvbuf=4096)
+
+    selector = selectors.DefaultSelector()
+    for c in clientes:
+        c.sock.setblocking(False)
+        selector.register(c.sock, selectors.EVENT_READ, c)
+    # Una orden por cliente, repartidas a lo largo del primer segundo
+    pendientes = list(clientes)
+    fin = time.perf_counter() + args.duracion
+    while time.perf_counter() < fin:
+        if pendientes:
+            for c in pendientes[:max(1, len(clientes) // 20)]:
+                c.enviada = time.perf_counter()
+                c.sock.sendall(trama_cliente(b'["canal",1,"*"]'))
+            del pendientes[:max(1, len(clientes) // 20)]
+        for clave, _ in selector.select(0.05):
+            c = clave.data
+            try:
+                datos = c.sock.recv(65536)
+            except BlockingIOError:
+                continue
+            except OSError:
+                datos = b''
+            if not datos:
+                c.cerrado = True
+                selector.unregister(c.sock)
+                continue
+            c.buf += datos
+            tramas, consumidos = extraer_tramas(c.buf)
+            del c.buf[:consumidos]
+            for opcode, payload in tramas:
+                if opcode == 0x9:
+                    c.sock.sendall(trama_cliente(payload, 0xA))
+                elif opcode == 0x8:
+                    c.cerrado = True
+                elif payload.startswith(b'["r"'):
+                    c.rtt = time.perf_counter() - c.enviada
+                else:
+                    c.eventos += 1
+
+    # El cliente lento: si el servidor lo cortó, tras lo pendiente llega el EOF; si no, siguen llegando eventos
+    lento.settimeout(1)
+    limite = time.perf_counter() + 3
+    lento_cortado = False
+    try:
+        while time.perf_counter() < limite:
+            if not lento.recv(1 << 20):
+                lento_cortado = True
+                break
+    except ConnectionResetError:
+        lento_cortado = True
+    except OSError:
+        pass
+
+    rtts = [c.rtt for c in clientes if c.rtt is not None]
+    eventos = [c.eventos for c in clientes]
+    resultado = {
+        'clientes': args.clientes,
+        'conectados': len(clientes),
+        'fallos_handshake': len(fallos),
+        'primer_fallo': fallos[0] if fallos else None,
+        'handshakes_por_s': round(len(clientes) / handshakes_s, 1) if handshakes_s else None,
+        'cerrados_por_el_servidor': sum(c.cerrado for c in clientes),
+        'eventos_por_cliente_min': min(eventos, default=0),
+        'eventos_por_cliente_max': max(eventos, default=0),
+        'eventos_por_s_total': round(sum(eventos) / args.duracion, 1),
+        'ordenes_respondidas': len(rtts),
+        'orden_rtt': percentiles(rtts) if rtts else None,
+        'lento_cortado': lento_cortado,
+    }
+    for c in clientes:
+        c.sock.close()
+    lento.close()
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clientes', type=int, default=500)
+    parser.add_argument('--duracion', type=float, default=10.0)
+    parser.add_argument('--email', help='usuario para la cookie de sesión (/ws la exige)')
+    parser.add_argument('--password')
+    args = parser.parse_args()
+    print(json.dumps(ejecutar(args), indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
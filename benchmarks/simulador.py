@@ -0,0 +1,238 @@
+"""Placa simulada configurable: ritmo, ruido, deriva y escenarios de incendio guionizados.
+
+A diferencia de DummyArduino (una línea aleatoria por readline() a ~10 Hz),
+genera el flujo de bytes que enviaría el firmware a cualquier ritmo y en
+texto o binario, y puede servirlo por un puerto serie virtual (pty) para que
+la app lo lea con `serial.Serial`, igual que una placa real:
+
+    python benchmarks/simulador.py --placas 2 --hz 200 --escenario incendio
+    DISPOSITIVOS="bench1=/dev/pts/5,bench2=/dev/pts/6" python app.py
+
+Escenarios (ESCENARIOS): 'estable', 'incendio' (ignición rápida y extinción,
+en bucle), 'lento' (humo que sube poco a poco) y 'picos' (lecturas espurias
+aisladas, para medir falsas alarmas).
+"""
+import argparse
+import os
+import random
+import select
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from protocolo import codificar_trama  # noqa: E402
+
+# Umbrales de peligro de la app (para marcar cuándo el simulador cruza a peligro)
+UMBRAL_TEMPERATURA = 45
+UMBRAL_HUMO = 600
+
+TEMP_BASE = 25.0
+HUMO_BASE = 50.0
+HUMEDAD_BASE = 60.0
+
+# Fases de cada escenario: (nombre, duración en s, temperatura final, humo final).
+# Entre fases los valores se interpolan linealmente; el guion se repite en bucle.
+ESCENARIOS = {
+    'estable': [('normal', 60, TEMP_BASE, HUMO_BASE)],
+    'incendio': [
+        ('normal', 2.0, TEMP_BASE, HUMO_BASE),
+        ('ignicion', 1.5, 75.0, 850.0),
+        ('llamas', 1.0, 80.0, 900.0),
+        ('extincion', 2.5, TEMP_BASE, HUMO_BASE),
+    ],
+    'lento': [
+        ('normal', 10, TEMP_BASE, HUMO_BASE),
+        ('combustion_lenta', 60, 38.0, 700.0),
+        ('ventilacion', 20, TEMP_BASE, HUMO_BASE),
+    ],
+    'picos': [('normal', 60, TEMP_BASE, HUMO_BASE)],
+}
+# Probabilidad de una lectura espuria aislada por muestra en el escenario 'picos'
+PROBABILIDAD_PICO = 0.01
+
+
+class SimuladorPlaca:
+    """Valores de una placa en función del tiempo (segundos desde el inicio del guion)"""
+
+    def __init__(self, escenario='estable', hz=10, ruido_temp=0.5, ruido_humo=5.0, deriva_temp_min=0.0,
+                 protocolo='texto', semilla=None):
+        if escenario not in ESCENARIOS:
+            raise ValueError(f"Escenario desconocido: {escenario} (opciones: {', '.join(ESCENARIOS)})")
+        self.escenario = escenario
+        self.fases = ESCENARIOS[escenario]
+        self.ciclo_s = sum(f[1] for f in self.fases)
+        self.hz = hz
+        self.ruido_temp = ruido_temp
+        self.ruido_humo = ruido_humo
+        # Deriva del sensor: °C que se suman por minuto de funcionamiento
+        self.deriva_temp_min = deriva_temp_min
+        self.protocolo = protocolo
+        self.azar = random.Random(semilla)
+        self.secuencia = 0
+        self.en_peligro = False
+        # Instantes (perf_counter) en que se emitió la primera muestra de cada peligro
+        self.cruces = []
+
+    def fase(self, t):
+        """(nombre de la fase, temperatura, humo) del guion sin ruido en el instante t"""
+        t %= self.ciclo_s
+        temp, humo = self.fases[-1][2], self.fases[-1][3]
+        for nombre, duracion, temp_fin, humo_fin in self.fases:
+            if t < duracion:
+                f = t / duracion
+                return nombre, temp + (temp_fin - temp) * f, humo + (humo_fin - humo) * f
+            t -= duracion
+            temp, humo = temp_fin, humo_fin
+        return self.fases[-1][0], temp, humo
+
+    def muestra(self, t):
+        _, temp, humo = self.fase(t)
+        azar = self.azar
+        temp += azar.gauss(0, self.ruido_temp) + self.deriva_temp_min * t / 60
+        humo = max(0.0, humo + azar.gauss(0, self.ruido_humo))
+        if self.escenario == 'picos' and azar.random() < PROBABILIDAD_PICO:
+            temp += azar.uniform(25, 35)
+            humo += azar.uniform(550, 650)
+        return temp, humo, HUMEDAD_BASE + azar.gauss(0, 1.0)
+
+    def trama(self, t, emitido=None):
+        """Bytes de la muestra del instante t; `emitido` (perf_counter) marca los cruces a peligro"""
+        temp, humo, humedad = self.muestra(t)
+        peligro = temp >= UMBRAL_TEMPERATURA or humo >= UMBRAL_HUMO
+        if peligro and not self.en_peligro:
+            self.cruces.append(time.perf_counter() if emitido is None else emitido)
+        self.en_peligro = peligro
+        self.secuencia += 1
+        if self.protocolo == 'binario':
+            return codificar_trama(self.secuencia, temp, humo, humedad)
+        return f'T:{temp:.1f},H:{humo:.1f},RH:{humedad:.1f}\r\n'.encode()
+
+    def flujo(self, n):
+        """n muestras consecutivas a self.hz (para medir el parser sin tiempo real)"""
+        return b''.join(self.trama(i / self.hz, 0.0) for i in range(n))
+
+
+class PuertoMemoria:
+    """Puerto con la interfaz que usa LectorSerial (in_waiting/read) sobre un flujo pregenerado"""
+
+    def __init__(self, datos, bloque=4096):
+        self.datos = memoryview(datos)
+        self.pos = 0
+        self.bloque = bloque
+
+    @property
+    def in_waiting(self):
+        return min(self.bloque, len(self.datos) - self.pos)
+
+    def read(self, n):
+        fin = min(self.pos + n, len(self.datos))
+        datos = bytes(self.datos[self.pos:fin])
+        self.pos = fin
+        return datos
+
+    def agotado(self):
+        return self.pos >= len(self.datos)
+
+
+class PuertoVirtual:
+    """Pseudo-terminal: el simulador escribe en el maestro y la app abre `nombre` con pyserial.
+
+    Lo que la app escribe (comandos) se lee del maestro y, con eco_ack, se
+    responde 'ACK:<byte>' como el firmware.
+    """
+
+    def __init__(self, simulador, eco_ack=True):
+        import pty
+        import tty
+        self.simulador = simulador
+        self.eco_ack = eco_ack
+        self.maestro, self._esclavo = pty.openpty()
+        # Modo raw: sin eco ni conversión de fin de línea en el terminal
+        tty.setraw(self._esclavo)
+        self.nombre = os.ttyname(self._esclavo)
+        self.comandos_recibidos = 0
+        self.muestras = 0
+        self._parar = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._bucle, name=f'sim-{self.nombre}', daemon=True)
+        self._hilo.start()
+        return self
+
+    def parar(self):
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join(2)
+        for fd in (self.maestro, self._esclavo):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _bucle(self):
+        periodo = 1 / self.simulador.hz
+        # Se despierta como mucho cada 10 ms y escribe de una vez todas las muestras que tocan
+        paso = max(periodo, 0.01)
+        inicio = time.perf_counter()
+        while not self._parar.is_set():
+            ahora = time.perf_counter()
+            debidas = int((ahora - inicio) * self.simulador.hz)
+            if debidas > self.muestras:
+                bloque = b''.join(self.simulador.trama(i * periodo, ahora)
+                                  for i in range(self.muestras, debidas))
+                self.muestras = debidas
+                try:
+                    os.write(self.maestro, bloque)
+                except OSError:
+                    return
+            self._atender_comandos(paso)
+
+    def _atender_comandos(self, espera):
+        try:
+            legibles, _, _ = select.select([self.maestro], [], [], espera)
+        except (OSError, ValueError):
+            return
+        if not legibles:
+            return
+        try:
+            datos = os.read(self.maestro, 1024)
+        except OSError:
+            return
+        self.comandos_recibidos += len(datos)
+        if self.eco_ack and self.simulador.protocolo == 'texto':
+            os.write(self.maestro, b''.join(b'ACK:' + datos[i:i + 1] + b'\r\n' for i in range(len(datos))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--placas', type=int, default=1)
+    parser.add_argument('--hz', type=float, default=10)
+    parser.add_argument('--escenario', choices=sorted(ESCENARIOS), default='incendio')
+    parser.add_argument('--protocolo', choices=('texto', 'binario'), default='texto')
+    parser.add_argument('--ruido-temp', type=float, default=0.5)
+    parser.add_argument('--ruido-humo', type=float, default=5.0)
+    parser.add_argument('--deriva', type=float, default=0.0, help='°C por minuto')
+    args = parser.parse_args()
+
+    puertos = [PuertoVirtual(SimuladorPlaca(args.escenario, args.hz, args.ruido_temp, args.ruido_humo,
+                                            args.deriva, args.protocolo, semilla=i)).iniciar()
+               for i in range(args.placas)]
+    sufijo = ':binario' if args.protocolo == 'binario' else ''
+    config = ','.join(f'bench{i + 1}={p.nombre}{sufijo}' for i, p in enumerate(puertos))
+    print(f"🧪 {args.placas} placa(s) '{args.escenario}' a {args.hz:g} Hz. Arranca la app con:")
+    print(f'DISPOSITIVOS="{config}" python app.py')
+    try:
+        while True:
+            time.sleep(5)
+            print(f"   muestras: {sum(p.muestras for p in puertos)}, "
+                  f"peligros: {sum(len(p.simulador.cruces) for p in puertos)}")
+    except KeyboardInterrupt:
+        for p in puertos:
+            p.parar()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,554 @@
+"""Batería de benchmarks con resultados en JSON, para comparar versiones entre sí.
+
+    python benchmarks/suite.py --salida base.json
+    python benchmarks/suite.py --escenarios ingesta,db,smtp --salida nuevo.json
+    python benchmarks/suite.py --comparar base.json nuevo.json
+
+Escenarios (en este orden):
+- ingesta: muestras/s de LectorSerial + decodificador sobre un flujo en memoria
+  (texto y binario) y, con pyserial, por un puerto virtual (pty) a ritmo máximo.
+- deteccion: coste por muestra de cada detector de deteccion.py y alertas que
+  abre en cada escenario del simulador, frente al umbral sin debounce (picos
+  espurios que ya no alertan, segundos de adelanto en la subida lenta).
+- db: lecturas/s del escritor por lotes, operaciones de la outbox y el fan-out
+  de notificaciones (consulta de destinatarios + registro) a --usuarios usuarios.
+- smtp: un aviso a --destinatarios destinatarios contra un servidor SMTP local
+  de pega que tarda --smtp-retardo-ms por mensaje.
+- render: mensajes listos para sendmail por segundo para --destinatarios-render
+  destinatarios (un 20 % con idioma o formato propios): plantilla renderizada
+  una vez por variante más la cabecera To, frente a un MIME por destinatario.
+- alerta: la app completa leyendo --placas placas simuladas por pty con el
+  escenario 'incendio'; latencia desde la muestra que cruza a peligro hasta el
+  evento 'alerta' del bus, muestras/s procesadas y latencia del email.
+- http: peticiones/s y p50/p99 por ruta con --clientes dashboards concurrentes
+  (contra la app del escenario anterior o contra --url).
+
+Todo corre en un directorio temporal con su propia base de datos; un escenario
+que falla queda como {"error": ...} y los demás siguen.
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import platform
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.join(DIRECTORIO, '..')
+sys.path.insert(0, RAIZ)
+
+from bench_leer import percentiles  # noqa: E402
+from simulador import PuertoMemoria, PuertoVirtual, SimuladorPlaca, UMBRAL_HUMO, UMBRAL_TEMPERATURA  # noqa: E402
+
+ESCENARIOS = ('ingesta', 'deteccion', 'db', 'smtp', 'render', 'alerta', 'http')
+RUTAS_HTTP = ('/leer', '/historico', '/estadisticas', '/dispositivos', '/alertas', '/health', '/ready')
+
+
+def hay_pyserial():
+    try:
+        import serial  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+# ============================================
+# SERVIDOR SMTP DE PEGA
+# ============================================
+class SumideroSMTP:
+    """SMTP mínimo que acepta y descarta mensajes (sin AUTH ni TLS), con retardo por mensaje"""
+
+    def __init__(self, retardo_s=0.0):
+        self.retardo_s = retardo_s
+        self.recibidos = 0
+        self._lock = threading.Lock()
+        sumidero = self
+
+        class Manejador(socketserver.StreamRequestHandler):
+            def responder(self, linea):
+                self.wfile.write(linea.encode() + b'\r\n')
+
+            def handle(self):
+                self.responder('220 sumidero ESMTP')
+                while True:
+                    linea = self.rfile.readline()
+                    if not linea:
+                        return
+                    orden = linea[:4].upper()
+                    if orden == b'EHLO':
+                        self.responder('250-sumidero')
+                        self.responder('250 8BITMIME')
+                    elif orden == b'DATA':
+                        self.responder('354 fin con <CRLF>.<CRLF>')
+                        while self.rfile.readline() not in (b'.\r\n', b''):
+                            pass
+                        if sumidero.retardo_s:
+                            time.sleep(sumidero.retardo_s)
+                        with sumidero._lock:
+                            sumidero.recibidos += 1
+                        self.responder('250 aceptado')
+                    elif orden == b'QUIT':
+                        self.responder('221 adios')
+                        return
+                    else:
+                        self.responder('250 OK')
+
+        self.servidor = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Manejador)
+        self.servidor.daemon_threads = True
+        self.puerto = self.servidor.server_address[1]
+
+    def iniciar(self):
+        threading.Thread(target=self.servidor.serve_forever, name='sumidero-smtp', daemon=True).start()
+        return self
+
+
+# ============================================
+# ESCENARIOS
+# ============================================
+def escenario_ingesta(args):
+    from ingesta import LectorSerial
+    from protocolo import crear_decodificador
+
+    resultado = {}
+    for protocolo in ('texto', 'binario'):
+        flujo = SimuladorPlaca('incendio', hz=1000, protocolo=protocolo, semilla=1).flujo(args.muestras)
+        puerto = PuertoMemoria(flujo)
+        lector = LectorSerial(puerto, crear_decodificador(protocolo), 'bench')
+        total = 0
+        inicio = time.perf_counter()
+        while not puerto.agotado():
+            total += len(lector.leer_muestras())
+        duracion = time.perf_counter() - inicio
+        resultado[f'memoria_{protocolo}'] = {'muestras': total, 'muestras_s': round(total / duracion)}
+
+    if not hay_pyserial():
+        resultado['pty'] = {'omitido': 'pyserial no está instalado'}
+        return resultado
+    import serial
+    virtual = PuertoVirtual(SimuladorPlaca('estable', hz=args.hz_pty, semilla=2), eco_ack=False).iniciar()
+    try:
+        lector = LectorSerial(serial.Serial(virtual.nombre, 115200, timeout=0.1), crear_decodificador(), 'bench')
+        total = 0
+        inicio = time.perf_counter()
+        while time.perf_counter() - inicio < args.duracion_pty:
+            total += len(lector.leer_muestras())
+        duracion = time.perf_counter() - inicio
+        lector.puerto.close()
+    finally:
+        virtual.parar()
+    resultado['pty'] = {'hz_objetivo': args.hz_pty, 'muestras': total, 'muestras_s': round(total / duracion),
+                        'emitidas': virtual.muestras}
+    return resultado
+
+
+def escenario_deteccion(args):
+    import deteccion
+
+    umbrales = (UMBRAL_TEMPERATURA, UMBRAL_HUMO)
+    resultado = {}
+    for escenario in ('estable', 'picos', 'lento', 'incendio'):
+        simulador = SimuladorPlaca(escenario, hz=args.hz_deteccion, semilla=3)
+        # Configuración por defecto, sin depender de las variables de entorno
+        etapa = deteccion.crear_etapa(deteccion.configuracion('', ''))
+        enganchado = peligro_anterior = False
+        alertas, originales = {}, 0
+        primer_aviso = primer_cruce = None
+        for i in range(args.muestras_deteccion):
+            t = i / simulador.hz
+            temp, humo, _ = simulador.muestra(t)
+            disparos, mantiene = etapa.evaluar(t, (temp, humo), umbrales)
+            if disparos and not enganchado:
+                enganchado = True
+                motivo = deteccion.tipos_y_motivo(disparos)[1]
+                alertas[motivo] = alertas.get(motivo, 0) + 1
+                if primer_aviso is None:
+                    primer_aviso = t
+            elif enganchado and not disparos and not mantiene:
+                enganchado = False
+            # Latch original: cada cruce del umbral era una alerta
+            peligro = temp >= UMBRAL_TEMPERATURA or humo >= UMBRAL_HUMO
+            if peligro and not peligro_anterior:
+                originales += 1
+                if primer_cruce is None:
+                    primer_cruce = t
+            peligro_anterior = peligro
+        coste = sum(d.coste_s for d in etapa.detectores)
+        resultado[escenario] = {
+            'alertas': sum(alertas.values()), 'por_motivo': alertas, 'alertas_umbral_original': originales,
+            'primer_aviso_s': primer_aviso, 'primer_cruce_umbral_s': primer_cruce,
+            'us_por_muestra': round(coste / args.muestras_deteccion * 1e6, 3),
+            'detectores': etapa.resumen(),
+        }
+    return resultado
+
+
+def escenario_db(args):
+    import repositorio
+    import serie_temporal
+    from outbox import Outbox, nuevo_id_alerta
+    from registro_alertas import RegistroAlertas
+
+    repositorio.inicializar_db()
+    pool = repositorio.pool
+    resultado = {}
+
+    escritor = serie_temporal.EscritorLecturas(pool)
+    escritor.iniciar()
+    ahora = time.time()
+    inicio = time.perf_counter()
+    for i in range(args.lecturas):
+        escritor.registrar(ahora + i / 100, f'bench{i % 4}', 25.0 + i % 10, 50.0 + i % 30)
+    while escritor.escritas + escritor.descartadas < args.lecturas:
+        time.sleep(0.01)
+    duracion = time.perf_counter() - inicio
+    resultado['escritor_lecturas'] = {'lecturas': args.lecturas, 'lecturas_s': round(escritor.escritas / duracion),
+                                      'descartadas': escritor.descartadas}
+
+    outbox = Outbox(pool)
+    n = args.avisos
+    inicio = time.perf_counter()
+    for _ in range(n):
+        outbox.enqueue(nuevo_id_alerta(), {'tipo': ['temperatura'], 'temperatura': 50, 'humo': 0})
+    encolar_s = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    procesados = 0
+    while procesados < n:
+        avisos = outbox.claim()
+        if not avisos:
+            break
+        for aviso in avisos:
+            outbox.completar(aviso['id'])
+        procesados += len(avisos)
+    resultado['outbox'] = {'avisos': n, 'enqueue_ms': round(encolar_s / n * 1000, 3),
+                           'claim_completar_ms': round((time.perf_counter() - inicio) / max(procesados, 1) * 1000, 3)}
+
+    # Fan-out: destinatarios de un aviso y una fila de notificación por cada uno
+    with pool.conexion() as conn:
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO usuarios (nombre, email, password_hash) VALUES (?, ?, 'x')",
+                             [(f'bench{i}', f'bench{i}@bench.local') for i in range(args.usuarios)])
+    inicio = time.perf_counter()
+    usuarios = repositorio.obtener_usuarios_notificables()
+    consulta_s = time.perf_counter() - inicio
+    alerta_id = nuevo_id_alerta()
+    RegistroAlertas(pool).abrir(alerta_id, 'bench', ['temperatura'], 50.0, 0.0)
+    inicio = time.perf_counter()
+    repositorio.registrar_notificaciones_lote(alerta_id, 'bench', [(u['id'], 1) for u in usuarios],
+                                              'temperatura', 50.0, 0.0)
+    registro_s = time.perf_counter() - inicio
+    # Que los escenarios siguientes no avisen a estos usuarios
+    with pool.conexion() as conn:
+        with conn:
+            conn.execute("UPDATE usuarios SET notificaciones_activas = 0 WHERE email LIKE '%@bench.local'")
+    resultado['fanout_notificaciones'] = {'usuarios': len(usuarios), 'consulta_ms': round(consulta_s * 1000, 3),
+                                          'registro_ms': round(registro_s * 1000, 3)}
+    return resultado
+
+
+# Valores de un aviso de prueba (plantilla 'incendio')
+AVISO_PRUEBA = {'temp': 52.3, 'humo': 710, 'umbral_temp': 45, 'umbral_humo': 600, 'dispositivo': 'bench1'}
+
+
+def escenario_smtp(args, sumidero):
+    from notificaciones import MotorEnvio
+    from plantillas import AvisoRenderizado
+
+    motor = MotorEnvio('127.0.0.1', sumidero.puerto, 'bench@bench.local', '', starttls=False)
+    destinatarios = [{'id': i, 'email': f'u{i}@bench.local'} for i in range(args.destinatarios)]
+    aviso = AvisoRenderizado('bench@bench.local', ['temperatura', 'humo'], None,
+                             dict(AVISO_PRUEBA, detectado=time.time()))
+    antes = sumidero.recibidos
+    inicio = time.perf_counter()
+    resultados = motor.enviar_lote(destinatarios, aviso)
+    duracion = time.perf_counter() - inicio
+    return {'destinatarios': len(destinatarios), 'retardo_servidor_ms': args.smtp_retardo_ms,
+            'enviados': sum(1 for _, ok in resultados if ok), 'recibidos': sumidero.recibidos - antes,
+            'total_s': round(duracion, 3), 'mensajes_s': round(len(destinatarios) / duracion, 1)}
+
+
+def escenario_render(args):
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from plantillas import AvisoRenderizado
+
+    remitente = 'bench@bench.local'
+    # 8 de cada 10 con las preferencias por defecto; el resto en inglés o en HTML
+    preferencias = [{}] * 8 + [{'idioma': 'en'}, {'formato': 'html'}]
+    destinatarios = [dict(preferencias[i % 10], id=i, email=f'u{i}@bench.local')
+                     for i in range(args.destinatarios_render)]
+    valores = dict(AVISO_PRUEBA, detectado=time.time())
+
+    # Antes: el texto una vez y un MIMEMultipart + as_string() por destinatario (sin preferencias)
+    referencia = AvisoRenderizado(remitente, ['temperatura', 'humo'], None, valores).variante()
+    inicio = time.perf_counter()
+    bytes_antes = 0
+    for u in destinatarios:
+        msg = MIMEMultipart()
+        msg['From'] = remitente
+        msg['To'] = u['email']
+        msg['Subject'] = referencia.asunto
+        msg.attach(MIMEText(referencia.cuerpo, 'plain', 'utf-8'))
+        bytes_antes += len(msg.as_string())
+    antes_s = time.perf_counter() - inicio
+
+    # Ahora: una variante por (idioma, formato) y por destinatario solo la cabecera To
+    inicio = time.perf_counter()
+    aviso = AvisoRenderizado(remitente, ['temperatura', 'humo'], None, valores)
+    bytes_ahora = 0
+    for u in destinatarios:
+        bytes_ahora += len(aviso.para(u).para(u['email']))
+    ahora_s = time.perf_counter() - inicio
+
+    n = len(destinatarios)
+    return {'destinatarios': n, 'variantes': aviso.variantes,
+            'antes_mensajes_s': round(n / antes_s, 1), 'ahora_mensajes_s': round(n / ahora_s, 1),
+            'aceleracion': round(antes_s / ahora_s, 1),
+            'antes_total_s': round(antes_s, 4), 'ahora_total_s': round(ahora_s, 4),
+            'bytes_medios_antes': bytes_antes // n, 'bytes_medios_ahora': bytes_ahora // n}
+
+
+def escenario_alerta(args, app, puertos):
+    """La app ya está arrancada leyendo los pty; se escucha el bus de cada placa"""
+    llegadas = {d.device_id: [] for d in app.registro_dispositivos.todos()}
+
+    def escuchar(device_id):
+        for evento in app.bus_eventos.escuchar(device_id, latido=1):
+            if evento.startswith(b'event: alerta\n'):
+                llegadas[device_id].append(time.perf_counter())
+
+    for device_id in llegadas:
+        threading.Thread(target=escuchar, args=(device_id,), daemon=True).start()
+    parseadas_antes = sum(d.lector.contadores.totales['parseadas']
+                          for d in app.registro_dispositivos.todos() if d.lector)
+    inicio = time.perf_counter()
+    time.sleep(args.duracion)
+    duracion = time.perf_counter() - inicio
+    parseadas = sum(d.lector.contadores.totales['parseadas']
+                    for d in app.registro_dispositivos.todos() if d.lector) - parseadas_antes
+
+    latencias = []
+    perdidas = 0
+    for device_id, puerto in puertos.items():
+        recibidas = llegadas[device_id]
+        for cruce in puerto.simulador.cruces:
+            if cruce < inicio:
+                continue
+            siguiente = next((t for t in recibidas if t >= cruce), None)
+            if siguiente is None:
+                perdidas += 1
+            else:
+                latencias.append(siguiente - cruce)
+    resultado = {'placas': len(puertos), 'hz': args.hz, 'muestras_s': round(parseadas / duracion),
+                 'alertas_sin_evento': perdidas}
+    if latencias:
+        resultado['latencia_alerta'] = percentiles(latencias)
+    resultado['avisos_email'] = list(app.motor_envio.ultimas_latencias)
+    return resultado
+
+
+def cliente_http(base, rutas, fin, latencias, errores):
+    partes = urlsplit(base)
+    conexion = http.client.HTTPConnection(partes.hostname, partes.port, timeout=10)
+    etags = {}
+    i = 0
+    while time.perf_counter() < fin:
+        ruta = rutas[i % len(rutas)]
+        i += 1
+        cabeceras = {'If-None-Match': etags[ruta]} if ruta in etags else {}
+        inicio = time.perf_counter()
+        try:
+            conexion.request('GET', partes.path.rstrip('/') + ruta, headers=cabeceras)
+            respuesta = conexion.getresponse()
+            respuesta.read()
+        except (OSError, http.client.HTTPException):
+            errores[ruta] = errores.get(ruta, 0) + 1
+            conexion.close()
+            conexion = http.client.HTTPConnection(partes.hostname, partes.port, timeout=10)
+            continue
+        latencias[ruta].append(time.perf_counter() - inicio)
+        if respuesta.getheader('ETag'):
+            etags[ruta] = respuesta.getheader('ETag')
+    conexion.close()
+
+
+def escenario_http(args, base):
+    latencias = {ruta: [] for ruta in RUTAS_HTTP}
+    errores = {}
+    fin = time.perf_counter() + args.duracion
+    hilos = [threading.Thread(target=cliente_http, args=(base, RUTAS_HTTP, fin, latencias, errores), daemon=True)
+             for _ in range(args.clientes)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    total = sum(len(v) for v in latencias.values())
+    resultado = {'clientes': args.clientes, 'peticiones_s': round(total / args.duracion, 1), 'errores': errores}
+    for ruta, valores in latencias.items():
+        if valores:
+            resultado[ruta] = percentiles(valores)
+    return resultado
+
+
+def servir_app(app):
+    from werkzeug.serving import make_server
+    servidor = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, name='bench-http', daemon=True).start()
+    return f'http://127.0.0.1:{servidor.server_port}'
+
+
+# ============================================
+# EJECUCIÓN Y COMPARACIÓN
+# ============================================
+def metadatos(args):
+    try:
+        version = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=RAIZ, capture_output=True,
+                                 text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        version = None
+    return {'version': version, 'fecha': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'plataforma': platform.platform(),
+            'cpus': os.cpu_count(), 'parametros': vars(args)}
+
+
+def ejecutar(nombre, funcion, *argumentos):
+    print(f"⏱️ {nombre}...", file=sys.stderr)
+    try:
+        return funcion(*argumentos)
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}'}
+
+
+def correr(args):
+    escenarios = [e.strip() for e in args.escenarios.split(',') if e.strip()]
+    desconocidos = set(escenarios) - set(ESCENARIOS)
+    if desconocidos:
+        sys.exit(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+
+    # Base de datos y secret key propias: nada toca los ficheros del proyecto
+    os.chdir(tempfile.mkdtemp(prefix='bench-alertas-'))
+    sumidero = SumideroSMTP(args.smtp_retardo_ms / 1000).iniciar()
+    os.environ.update({'SMTP_HOST': '127.0.0.1', 'SMTP_PORT': str(sumidero.puerto), 'SMTP_STARTTLS': '0',
+                       'MODO_DESPLIEGUE': 'unico'})
+
+    resultados = {}
+    if 'ingesta' in escenarios:
+        resultados['ingesta'] = ejecutar('ingesta', escenario_ingesta, args)
+    if 'deteccion' in escenarios:
+        resultados['deteccion'] = ejecutar('deteccion', escenario_deteccion, args)
+    if 'db' in escenarios:
+        resultados['db'] = ejecutar('db', escenario_db, args)
+    if 'smtp' in escenarios:
+        resultados['smtp'] = ejecutar('smtp', escenario_smtp, args, sumidero)
+    if 'render' in escenarios:
+        resultados['render'] = ejecutar('render', escenario_render, args)
+
+    base = args.url
+    app = None
+    if 'alerta' in escenarios or ('http' in escenarios and base is None):
+        puertos = {}
+        if hay_pyserial():
+            puertos = {f'bench{i + 1}': PuertoVirtual(SimuladorPlaca('incendio', hz=args.hz, semilla=10 + i)).iniciar()
+                       for i in range(args.placas)}
+            os.environ['DISPOSITIVOS'] = ','.join(f'{d}={p.nombre}' for d, p in puertos.items())
+        else:
+            os.environ['DISPOSITIVOS'] = ','.join(f'bench{i + 1}=dummy' for i in range(args.placas))
+        import app as modulo_app
+        app = modulo_app
+        app.crear_app()
+        # Primera conexión de cada placa (el Arduino "se reinicia" 2 s al abrir el puerto)
+        limite = time.monotonic() + 10
+        while time.monotonic() < limite and not all(d.lector for d in app.registro_dispositivos.todos()):
+            time.sleep(0.1)
+        resultados['arranque'] = app.ciclo.informe()
+        if 'alerta' in escenarios:
+            if puertos:
+                resultados['alerta'] = ejecutar('alerta', escenario_alerta, args, app, puertos)
+            else:
+                resultados['alerta'] = {'omitido': 'pyserial no está instalado (sin pty)'}
+    if 'http' in escenarios:
+        if base is None:
+            base = ejecutar('servidor http', servir_app, app.app)
+        if isinstance(base, dict):
+            resultados['http'] = base
+        else:
+            resultados['http'] = ejecutar('http', escenario_http, args, base)
+    return {'metadatos': metadatos(args), 'resultados': resultados}
+
+
+def aplanar(datos, prefijo=''):
+    """{'a': {'b': 1}} -> {'a.b': 1} (solo valores numéricos)"""
+    planos = {}
+    for clave, valor in datos.items():
+        ruta = f'{prefijo}{clave}'
+        if isinstance(valor, dict):
+            planos.update(aplanar(valor, ruta + '.'))
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            planos[ruta] = valor
+    return planos
+
+
+def comparar(ruta_base, ruta_nueva):
+    with open(ruta_base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(ruta_nueva, encoding='utf-8') as f:
+        nueva = json.load(f)
+    print(f"{base['metadatos'].get('version')} -> {nueva['metadatos'].get('version')}")
+    a, b = aplanar(base['resultados']), aplanar(nueva['resultados'])
+    for clave in sorted(a.keys() & b.keys()):
+        cambio = f'{(b[clave] - a[clave]) / a[clave] * 100:+.1f}%' if a[clave] else ''
+        print(f'{clave:<55} {a[clave]:>12} {b[clave]:>12} {cambio:>9}')
+    for clave in sorted(a.keys() ^ b.keys()):
+        print(f'{clave:<55} {"solo en " + ("base" if clave in a else "nueva"):>34}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--escenarios', default=','.join(ESCENARIOS))
+    parser.add_argument('--salida', help='fichero JSON de resultados (por defecto, stdout)')
+    parser.add_argument('--comparar', nargs=2, metavar=('BASE', 'NUEVO'), help='diferencias entre dos resultados')
+    parser.add_argument('--muestras', type=int, default=200000, help='ingesta en memoria')
+    parser.add_argument('--hz-pty', type=int, default=20000, help='ritmo del pty en el escenario ingesta')
+    parser.add_argument('--duracion-pty', type=float, default=3.0)
+    parser.add_argument('--muestras-deteccion', type=int, default=36000, help='muestras por escenario de detección')
+    parser.add_argument('--hz-deteccion', type=float, default=10)
+    parser.add_argument('--lecturas', type=int, default=20000, help='lecturas del escritor por lotes')
+    parser.add_argument('--avisos', type=int, default=500, help='avisos de la outbox')
+    parser.add_argument('--usuarios', type=int, default=10000, help='fan-out de notificaciones en la DB')
+    parser.add_argument('--destinatarios', type=int, default=200, help='fan-out SMTP')
+    parser.add_argument('--smtp-retardo-ms', type=float, default=20.0)
+    parser.add_argument('--destinatarios-render', type=int, default=10000, help='mensajes del escenario render')
+    parser.add_argument('--placas', type=int, default=2)
+    parser.add_argument('--hz', type=float, default=50, help='ritmo de cada placa en los escenarios alerta/http')
+    parser.add_argument('--duracion', type=float, default=20.0, help='segundos de los escenarios alerta y http')
+    parser.add_argument('--clientes', type=int, default=50, help='dashboards concurrentes')
+    parser.add_argument('--url', help='servidor ya arrancado para el escenario http (p. ej. http://127.0.0.1:5000)')
+    args = parser.parse_args()
+
+    if args.comparar:
+        comparar(*args.comparar)
+        return
+    if args.salida:
+        # correr() se cambia al directorio temporal
+        args.salida = os.path.abspath(args.salida)
+    # Lo que imprime la app va a stderr: stdout queda para el JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        resultados = correr(args)
+    informe = json.dumps(resultados, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(informe + '\n')
+        print(f"📄 Resultados en {args.salida}", file=sys.stderr)
+    else:
+        print(informe)
+
+
+if __name__ == '__main__':
+    main()
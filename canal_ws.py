@@ -0,0 +1,424 @@
+"""Canal WebSocket de los dashboards: eventos en vivo hacia el navegador y órdenes a los actuadores de vuelta.
+
+Una conexión por dashboard (/ws) sustituye al SSE más un POST por cada clic.
+Cada mensaje es un array JSON compacto en una trama de texto:
+
+    servidor -> cliente   ["lectura", {...}]  ["alerta", {...}]  ["comando", {...}]
+                          ["r", id, código, {...}]          resultado de la orden `id`
+    cliente -> servidor   ["ventilador", id, "on"]  ["servomotor", id, "abrir", "piso1"]
+                          ["led", id, "off"]  ["emergencia", id]  ["canal", id, "piso1"]
+
+(el último elemento opcional de una orden de actuador es la placa; `id` lo
+elige el cliente para casar el resultado). Los eventos se serializan una vez
+por publicación para todos los clientes (formato 'ws' del BusEventos).
+
+Cada conexión tiene dos lados:
+- escritura: el hilo de la petición HTTP (que el servidor WSGI ya tiene
+  ocupado) vacía la cola acotada de su suscripción al bus. Si la cola se
+  llena, o un envío se bloquea más de TIMEOUT_ENVIO_S, el cliente es lento y
+  se le corta: nunca se acumula memoria por él.
+- lectura: un único hilo `CentralWS` vigila todos los sockets con selectors y
+  pasa las órdenes a un pool pequeño; los resultados vuelven por la cola.
+
+Implementa de RFC 6455 lo que usan los navegadores (texto, ping/pong, cierre,
+fragmentación) sin dependencias nuevas, sobre el socket crudo que exponen el
+servidor de desarrollo de Werkzeug y Gunicorn. El handshake exige la cookie
+de sesión y un Origin del propio host (o de WS_ORIGENES).
+"""
+import base64
+import collections
+import hashlib
+import json
+import os
+import queue
+import selectors
+import socket
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from eventos import INTERVALO_LATIDO
+
+GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+CONTINUACION, TEXTO, BINARIO, CIERRE, PING, PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+# Nombre del formato de las suscripciones al BusEventos
+FORMATO = 'ws'
+# Tamaño máximo de un mensaje del cliente (una orden ocupa unas decenas de bytes)
+MAX_MENSAJE = 4096
+# Un envío bloqueado más que esto (ventana TCP del cliente llena) lo desconecta
+TIMEOUT_ENVIO_S = 5.0
+MAX_CONEXIONES = int(os.environ.get('WS_MAX_CONEXIONES', '1000'))
+# Orígenes aceptados además del propio Host (p. ej. tras un proxy que reescribe Host):
+# WS_ORIGENES="https://panel.ejemplo.org,https://otro.ejemplo.org"
+ORIGENES_PERMITIDOS = frozenset(o.strip().rstrip('/').lower()
+                                for o in os.environ.get('WS_ORIGENES', '').split(',') if o.strip())
+# Hilos que ejecutan las órdenes (encolar un comando es rápido; la emergencia escribe en la base)
+HILOS_ORDENES = 4
+
+
+def _json(datos):
+    return json.dumps(datos, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+# ============================================
+# TRAMAS
+# ============================================
+def trama(payload, opcode=TEXTO):
+    """Trama del servidor (sin máscara) con el mensaje completo"""
+    n = len(payload)
+    if n < 126:
+        cabecera = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < 65536:
+        cabecera = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        cabecera = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    return cabecera + payload
+
+
+def trama_evento(tipo, datos):
+    """Serializador 'ws' del BusEventos: una trama compartida por todos los clientes"""
+    return trama(_json([tipo, datos]))
+
+
+def trama_resultado(orden_id, codigo, cuerpo):
+    return trama(_json(['r', orden_id, codigo, cuerpo]))
+
+
+def trama_cierre(codigo=1000, motivo=''):
+    return trama(struct.pack('!H', codigo) + motivo.encode('utf-8')[:120], CIERRE)
+
+
+TRAMA_PING = trama(b'', PING)
+
+
+class ErrorProtocolo(Exception):
+    """Trama inválida del cliente; lleva el código de cierre"""
+
+    def __init__(self, codigo, mensaje):
+        super().__init__(mensaje)
+        self.codigo = codigo
+
+
+def _desenmascarar(datos, mascara):
+    # XOR con la máscara repetida, de una vez sobre enteros grandes
+    n = len(datos)
+    clave = (bytes(mascara) * (n // 4 + 1))[:n]
+    return (int.from_bytes(datos, 'big') ^ int.from_bytes(clave, 'big')).to_bytes(n, 'big')
+
+
+class DecodificadorTramas:
+    """Mensajes del cliente (tramas enmascaradas) a partir de los bytes según llegan"""
+
+    def __init__(self, max_mensaje=MAX_MENSAJE):
+        self.max_mensaje = max_mensaje
+        self._pendiente = bytearray()
+        # (opcode, bytearray) de un mensaje fragmentado a medias
+        self._fragmentos = None
+
+    def extraer(self, datos):
+        """Añade `datos` y devuelve los mensajes completos [(opcode, payload)]"""
+        buf = self._pendiente
+        buf += datos
+        mensajes = []
+        pos = 0
+        while len(buf) - pos >= 2:
+            b0, b1 = buf[pos], buf[pos + 1]
+            fin, opcode = b0 & 0x80, b0 & 0x0F
+            if not b1 & 0x80:
+                raise ErrorProtocolo(1002, 'Trama del cliente sin máscara')
+            n = b1 & 0x7F
+            cabecera = 2
+            if n == 126:
+                if len(buf) - pos < 4:
+                    break
+                n = struct.unpack_from('!H', buf, pos + 2)[0]
+                cabecera = 4
+            elif n == 127:
+                if len(buf) - pos < 10:
+                    break
+                n = struct.unpack_from('!Q', buf, pos + 2)[0]
+                cabecera = 10
+            if n > self.max_mensaje:
+                raise ErrorProtocolo(1009, 'Mensaje demasiado grande')
+            inicio = pos + cabecera + 4
+            if len(buf) < inicio + n:
+                break
+            payload = _desenmascarar(buf[inicio:inicio + n], buf[inicio - 4:inicio])
+            pos = inicio + n
+
+            if opcode >= CIERRE:
+                # Control: nunca fragmentadas, pueden llegar entre fragmentos
+                mensajes.append((opcode, payload))
+            elif opcode == CONTINUACION:
+                if self._fragmentos is None:
+                    raise ErrorProtocolo(1002, 'Continuación sin mensaje')
+                self._fragmentos[1].extend(payload)
+                if len(self._fragmentos[1]) > self.max_mensaje:
+                    raise ErrorProtocolo(1009, 'Mensaje demasiado grande')
+                if fin:
+                    mensajes.append((self._fragmentos[0], bytes(self._fragmentos[1])))
+                    self._fragmentos = None
+            elif self._fragmentos is not None:
+                raise ErrorProtocolo(1002, 'Mensaje nuevo sin terminar el fragmentado')
+            elif fin:
+                mensajes.append((opcode, payload))
+            else:
+                self._fragmentos = (opcode, bytearray(payload))
+        del buf[:pos]
+        return mensajes
+
+
+# ============================================
+# HANDSHAKE
+# ============================================
+def es_handshake(environ):
+    return (environ.get('HTTP_UPGRADE', '').lower() == 'websocket'
+            and 'upgrade' in environ.get('HTTP_CONNECTION', '').lower()
+            and environ.get('HTTP_SEC_WEBSOCKET_VERSION') == '13'
+            and bool(environ.get('HTTP_SEC_WEBSOCKET_KEY')))
+
+
+def origen_permitido(environ, permitidos=ORIGENES_PERMITIDOS):
+    """El navegador siempre envía Origin en un handshake: debe ser este mismo host o estar en la lista.
+
+    La cookie de sesión viaja también en los handshakes que abre cualquier otra
+    página (los WebSocket no pasan por CORS); sin esta comprobación una web
+    ajena podría mover los actuadores con la sesión del usuario.
+    """
+    origen = environ.get('HTTP_ORIGIN', '').strip().rstrip('/').lower()
+    if not origen or origen == 'null':
+        return False
+    if origen in permitidos:
+        return True
+    host = environ.get('HTTP_HOST', '').strip().lower()
+    return bool(host) and origen.partition('://')[2] == host
+
+
+def socket_crudo(environ):
+    """Socket TCP de la petición (Werkzeug o Gunicorn); None si el servidor no lo expone"""
+    return environ.get('werkzeug.socket') or environ.get('gunicorn.socket')
+
+
+def respuesta_handshake(clave):
+    aceptar = base64.b64encode(hashlib.sha1(clave.encode('latin-1') + GUID).digest())
+    return (b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + aceptar + b'\r\n\r\n')
+
+
+def terminar_peticion(environ):
+    """Tras cerrar el WebSocket, evita que el servidor escriba una respuesta HTTP en el socket.
+
+    Gunicorn (gthread) da la conexión por terminada con StopIteration y el
+    servidor de Werkzeug con ConnectionError (la trata como cliente caído).
+    """
+    if 'gunicorn.socket' in environ:
+        raise StopIteration()
+    raise ConnectionError('WebSocket cerrado')
+
+
+# ============================================
+# CONEXIONES
+# ============================================
+class ConexionWS:
+    """Un dashboard conectado: su socket, su suscripción al bus y la sesión con la que entró"""
+
+    def __init__(self, central, sock, cola, sid):
+        self.central = central
+        self.sock = sock
+        self.cola = cola
+        self.sid = sid
+        self.decodificador = DecodificadorTramas()
+        # False cuando el cliente cerró o se fue (lo decide el hilo lector)
+        self.abierta = True
+
+    def encolar(self, datos):
+        """Trama para el cliente desde otro hilo; si su cola está llena, se le corta"""
+        try:
+            self.cola.put_nowait(datos)
+        except queue.Full:
+            self.central.bus.cortar(self.cola)
+
+    def servir(self, latido=INTERVALO_LATIDO):
+        """Bucle de escritura en el hilo de la petición, hasta que el cliente se va o se le corta"""
+        sock = self.sock
+        sock.settimeout(TIMEOUT_ENVIO_S)
+        codigo = None
+        try:
+            while True:
+                try:
+                    datos = self.cola.get(timeout=latido)
+                except queue.Empty:
+                    datos = TRAMA_PING
+                if datos is None:
+                    if self.abierta:
+                        # El corte lo hizo el bus (cola llena): cliente lento
+                        self.central.cortadas += 1
+                        codigo = 1013
+                    break
+                sock.sendall(datos)
+        except socket.timeout:
+            # Envío bloqueado TIMEOUT_ENVIO_S: el cliente no lee
+            self.central.cortadas += 1
+        except OSError:
+            pass
+        finally:
+            self.central.cerrar(self, codigo)
+
+
+class CentralWS:
+    """Hilo único que lee de todos los WebSocket y despacha sus mensajes.
+
+    `al_mensaje(conexion, mensaje)` atiende una orden ya decodificada (lista
+    JSON) y devuelve (cuerpo, código) del resultado, como las rutas HTTP.
+    """
+
+    def __init__(self, bus, al_mensaje, max_conexiones=MAX_CONEXIONES, hilos=HILOS_ORDENES):
+        self.bus = bus
+        self.al_mensaje = al_mensaje
+        self.max_conexiones = max_conexiones
+        self.hilos = hilos
+        self.conexiones = 0
+        # Cortadas por lentas desde el arranque (cola llena o envío bloqueado)
+        self.cortadas = 0
+        self.mensajes = 0
+        self._lock = threading.Lock()
+        # Altas y bajas para el hilo lector (es el único que toca el selector)
+        self._cambios = collections.deque()
+        self._selector = None
+        self._despertador = None
+        self._pool = None
+
+    def iniciar(self):
+        self._selector = selectors.DefaultSelector()
+        leer, self._despertador = socket.socketpair()
+        leer.setblocking(False)
+        self._despertador.setblocking(False)
+        self._selector.register(leer, selectors.EVENT_READ, None)
+        self._pool = ThreadPoolExecutor(self.hilos, thread_name_prefix='ws-ordenes')
+        threading.Thread(target=self._bucle, name='ws-central', daemon=True).start()
+
+    def aceptar(self, sock, clave, canal, sid, inicial=None):
+        """Completa el handshake y da de alta la conexión; None si ya no caben más.
+
+        `inicial()` (tramas del estado actual) se llama ya suscrito, como en BusEventos.escuchar.
+        """
+        with self._lock:
+            if self.conexiones >= self.max_conexiones:
+                return None
+            self.conexiones += 1
+        cola = self.bus.suscribir(canal, FORMATO)
+        conexion = ConexionWS(self, sock, cola, sid)
+        for datos in (inicial() if inicial is not None else ()):
+            cola.put_nowait(datos)
+        try:
+            sock.sendall(respuesta_handshake(clave))
+        except OSError:
+            self.cerrar(conexion, None)
+            return None
+        self._cambio('alta', conexion)
+        return conexion
+
+    def cerrar(self, conexion, codigo=1000):
+        """Fin del hilo de escritura: trama de cierre si procede, baja y socket cerrado"""
+        self.bus.desuscribir(conexion.cola)
+        if codigo is not None:
+            try:
+                conexion.sock.settimeout(0.5)
+                conexion.sock.sendall(trama_cierre(codigo))
+            except OSError:
+                pass
+        self._cambio('baja', conexion)
+        conexion.sock.close()
+        with self._lock:
+            self.conexiones -= 1
+
+    def _cambio(self, tipo, conexion):
+        self._cambios.append((tipo, conexion))
+        try:
+            self._despertador.send(b'\0')
+        except BlockingIOError:
+            # El buffer ya tiene avisos pendientes: el hilo lector despertará igual
+            pass
+
+    def _aplicar_cambios(self, despertador):
+        try:
+            despertador.recv(4096)
+        except BlockingIOError:
+            pass
+        while self._cambios:
+            tipo, conexion = self._cambios.popleft()
+            if tipo == 'alta':
+                if conexion.abierta and conexion.sock.fileno() >= 0:
+                    self._selector.register(conexion.sock, selectors.EVENT_READ, conexion)
+            else:
+                self._quitar(conexion)
+
+    def _quitar(self, conexion):
+        # Por identidad: el descriptor puede pertenecer ya a otra conexión
+        conexion.abierta = False
+        for clave in list(self._selector.get_map().values()):
+            if clave.data is conexion:
+                self._selector.unregister(clave.fileobj)
+                break
+
+    def _bucle(self):
+        while True:
+            for clave, _ in self._selector.select():
+                if clave.data is None:
+                    self._aplicar_cambios(clave.fileobj)
+                else:
+                    self._leer(clave.data)
+
+    def _leer(self, conexion):
+        try:
+            # Sin bloquear: el socket tiene el timeout de envío del hilo de escritura
+            datos = conexion.sock.recv(65536, socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            datos = b''
+        if not datos:
+            self._soltar(conexion)
+            return
+        try:
+            mensajes = conexion.decodificador.extraer(datos)
+        except ErrorProtocolo as e:
+            conexion.encolar(trama_cierre(e.codigo, str(e)))
+            self._soltar(conexion)
+            return
+        for opcode, payload in mensajes:
+            if opcode == TEXTO:
+                self.mensajes += 1
+                self._pool.submit(self._despachar, conexion, payload)
+            elif opcode == PING:
+                conexion.encolar(trama(payload, PONG))
+            elif opcode == CIERRE:
+                conexion.encolar(trama_cierre())
+                self._soltar(conexion)
+                return
+            # PONG y binario se ignoran
+
+    def _soltar(self, conexion):
+        """El cliente cerró o se fue: fuera del selector y fin del hilo de escritura"""
+        self._quitar(conexion)
+        self.bus.desuscribir(conexion.cola)
+        try:
+            conexion.cola.put_nowait(None)
+        except queue.Full:
+            self.bus.cortar(conexion.cola)
+
+    def _despachar(self, conexion, payload):
+        try:
+            mensaje = json.loads(payload)
+        except ValueError:
+            mensaje = None
+        if not (isinstance(mensaje, list) and len(mensaje) >= 2 and isinstance(mensaje[0], str)):
+            conexion.encolar(trama_resultado(None, 400, {'success': False, 'mensaje': 'Se esperaba [tipo, id, ...]'}))
+            return
+        try:
+            cuerpo, codigo = self.al_mensaje(conexion, mensaje)
+        except Exception as e:
+            print(f"❌ Error en orden WebSocket {mensaje[0]}: {e}")
+            codigo, cuerpo = 500, {'success': False, 'error': str(e)}
+        if conexion.abierta:
+            conexion.encolar(trama_resultado(mensaje[1], codigo, cuerpo))
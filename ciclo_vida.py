@@ -0,0 +1,83 @@
+"""Arranque y parada del proceso en pasos con nombre, cronometrados para el informe de arranque.
+
+Importar los módulos no debe tener efectos: lo que abre la base, arranca hilos
+o toca puertos se registra como paso con `@ciclo.al_arrancar('nombre')` y se
+ejecuta en orden al llamar a `arrancar()` (desde la fábrica de la app).
+Para el detalle por módulo del tiempo de importación: `python -X importtime app.py`.
+"""
+import threading
+import time
+
+
+class CicloVida:
+    """Pasos de arranque/parada en orden de registro, con la duración de cada uno"""
+
+    def __init__(self, inicio=None):
+        # Instante (perf_counter) desde el que se mide: el comienzo de las importaciones
+        self.inicio = time.perf_counter() if inicio is None else inicio
+        self.importacion_s = None
+        self.arranque_s = None
+        self.listo_en = None
+        self.tiempos = []
+        self.iniciado = False
+        self._arranque = []
+        self._parada = []
+        self._lock = threading.Lock()
+
+    def al_arrancar(self, nombre):
+        def registrar(funcion):
+            self._arranque.append((nombre, funcion))
+            return funcion
+        return registrar
+
+    def al_parar(self, nombre):
+        def registrar(funcion):
+            self._parada.append((nombre, funcion))
+            return funcion
+        return registrar
+
+    def importado(self):
+        """Marca el fin de las importaciones del módulo principal"""
+        self.importacion_s = time.perf_counter() - self.inicio
+
+    def arrancar(self):
+        """Ejecuta los pasos de arranque una sola vez; False si ya se había hecho"""
+        with self._lock:
+            if self.iniciado:
+                return False
+            comienzo = time.perf_counter()
+            for nombre, funcion in self._arranque:
+                inicio = time.perf_counter()
+                funcion()
+                self.tiempos.append((nombre, time.perf_counter() - inicio))
+            self.listo_en = time.perf_counter()
+            self.arranque_s = self.listo_en - comienzo
+            self.iniciado = True
+            return True
+
+    def parar(self):
+        """Pasos de parada en orden inverso; un fallo no impide los siguientes"""
+        for nombre, funcion in reversed(self._parada):
+            try:
+                funcion()
+            except Exception as e:
+                print(f"⚠️ Parada '{nombre}' falló: {e}")
+
+    def desde_inicio(self, instante):
+        """Segundos entre el comienzo de las importaciones y `instante` (perf_counter)"""
+        return None if instante is None else round(instante - self.inicio, 4)
+
+    def informe(self):
+        return {
+            'importacion_s': round(self.importacion_s or 0.0, 4),
+            'pasos_s': {nombre: round(segundos, 4) for nombre, segundos in self.tiempos},
+            'arranque_s': round(self.arranque_s or 0.0, 4),
+            'listo_desde_inicio_s': self.desde_inicio(self.listo_en),
+        }
+
+    def imprimir_informe(self):
+        informe = self.informe()
+        print(f"⏱️ Arranque listo en {informe['listo_desde_inicio_s']}s "
+              f"(importación {informe['importacion_s']}s, pasos {informe['arranque_s']}s)")
+        for nombre, segundos in sorted(informe['pasos_s'].items(), key=lambda p: -p[1]):
+            print(f"   {nombre:<24} {segundos * 1000:8.1f} ms")
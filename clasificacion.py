@@ -0,0 +1,36 @@
+"""Clasificación de lecturas por niveles, compartida por la ruta en vivo y el backtest.
+
+Los umbrales se compilan en una tabla de bordes ordenados (normal, alto, peligro).
+El nivel de un valor es el número de bordes que alcanza: `bisect_right` para una
+muestra y `numpy.searchsorted(..., side='right')` para un array, con idéntica
+semántica (`valor >= borde`), de modo que ambos caminos no pueden divergir.
+"""
+from bisect import bisect_right
+
+NIVELES = ('bajo', 'normal', 'alto', 'peligro')
+PELIGRO = NIVELES.index('peligro')
+
+
+def bordes(normal, alto, peligro):
+    """Tabla de bordes a partir de los umbrales (por debajo de `normal` todo es 'bajo').
+
+    Un umbral inferior por encima de uno superior se recorta a este: así se
+    reproduce la cadena de `if` original, que comprobaba primero 'peligro'.
+    """
+    alto = min(alto, peligro)
+    return (min(normal, alto), alto, peligro)
+
+
+def indice_nivel(valor, tabla):
+    return bisect_right(tabla, valor)
+
+
+def nivel(valor, tabla):
+    """Nivel ('bajo'..'peligro') de una muestra"""
+    return NIVELES[bisect_right(tabla, valor)]
+
+
+def indices_nivel(valores, tabla):
+    """Índice de nivel de cada elemento de un array de NumPy (misma regla que `nivel`)"""
+    import numpy as np
+    return np.searchsorted(np.asarray(tabla, dtype=float), valores, side='right')
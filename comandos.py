@@ -0,0 +1,283 @@
+"""Canal de comandos hacia los actuadores: un único escritor por placa con cola de prioridad.
+
+Las rutas HTTP solo encolan y devuelven el id del comando; el hilo escritor de la
+placa es el único que toca `write()` del puerto. Orden: emergencia > manual > cosmético.
+
+- Coalescencia: un comando pendiente para el mismo actuador se reemplaza por el
+  nuevo (o se reutiliza si es idéntico), y repetir lo último que se envió hace
+  menos de VENTANA_COALESCER_S no vuelve a mandar bytes (doble clic).
+- Confirmaciones: si el firmware responde 'ACK:<byte>' (COMANDOS_ACK=1), cada
+  comando espera su eco hasta TIMEOUT_ACK_S y se reintenta hasta REINTENTOS_ACK
+  veces. La espera no bloquea la cola: una emergencia se escribe mientras tanto.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metricas
+
+EMERGENCIA = 0
+MANUAL = 1
+COSMETICO = 2
+NOMBRES_PRIORIDAD = {EMERGENCIA: 'emergencia', MANUAL: 'manual', COSMETICO: 'cosmetico'}
+
+# Byte de comando -> actuador al que afecta (los comandos de un mismo actuador se coalescen)
+ACTUADORES = {
+    b'L': 'led', b'l': 'led',
+    b'V': 'ventilador', b'v': 'ventilador',
+    b'A': 'servomotor', b'C': 'servomotor',
+}
+
+# Repetir el último comando de un actuador dentro de esta ventana no reenvía nada
+VENTANA_COALESCER_S = 2.0
+# Esperar el eco 'ACK:<byte>' del firmware (las placas sin eco dejan el comando en 'enviado')
+ESPERAR_ACK = os.environ.get('COMANDOS_ACK', '0') == '1'
+TIMEOUT_ACK_S = 1.0
+REINTENTOS_ACK = 2
+# Comandos terminados que se conservan para GET /comandos/<id>
+MAX_HISTORIAL = 1000
+
+COMANDOS = metricas.contador('comandos_total', 'Comandos a actuadores por resultado', ('dispositivo', 'resultado'))
+ESPERA_COMANDO = metricas.histograma('comando_espera_segundos', 'Desde que se encola hasta que se escribe en el puerto',
+                                     ('prioridad',), metricas.BUCKETS_LENTOS)
+
+_ids = itertools.count(1)
+
+
+class Comando:
+    """Un comando a un actuador y su ciclo de vida:
+    pendiente -> enviado -> (confirmado | sin_ack), o reemplazado / fallido"""
+
+    __slots__ = ('id', 'device_id', 'actuador', 'datos', 'prioridad', 'estado', 'intentos',
+                 'creado', 'enviado', 'confirmado', 'reemplazado_por', 'error', '_limite_ack')
+
+    def __init__(self, device_id, datos, prioridad):
+        self.id = next(_ids)
+        self.device_id = device_id
+        self.actuador = ACTUADORES.get(datos, datos.decode('latin-1'))
+        self.datos = datos
+        self.prioridad = prioridad
+        self.estado = 'pendiente'
+        self.intentos = 0
+        self.creado = time.time()
+        self.enviado = self.confirmado = None
+        self.reemplazado_por = None
+        self.error = None
+        self._limite_ack = 0.0
+
+    def resumen(self):
+        return {
+            'id': self.id,
+            'dispositivo': self.device_id,
+            'actuador': self.actuador,
+            'comando': self.datos.decode('latin-1'),
+            'prioridad': NOMBRES_PRIORIDAD.get(self.prioridad, self.prioridad),
+            'estado': self.estado,
+            'intentos': self.intentos,
+            'creado': self.creado,
+            'enviado': self.enviado,
+            'confirmado': self.confirmado,
+            'reemplazado_por': self.reemplazado_por,
+            'error': self.error,
+        }
+
+
+class CanalComandos:
+    """Cola de prioridad y hilo escritor de una placa"""
+
+    def __init__(self, dispositivo, al_cambiar=None, esperar_ack=ESPERAR_ACK):
+        self.dispositivo = dispositivo
+        self.al_cambiar = al_cambiar
+        self.esperar_ack = esperar_ack
+        self._cola = []
+        self._orden = itertools.count()
+        # Actuador -> comando aún sin escribir / último escrito
+        self._pendientes = {}
+        self._ultimos = {}
+        # Byte -> comando escrito que espera su eco
+        self._sin_ack = {}
+        self._cond = threading.Condition()
+        self._m_resultado = {r: COMANDOS.con(dispositivo.device_id, r)
+                             for r in ('enviado', 'confirmado', 'sin_ack', 'fallido', 'coalescido')}
+        self.hilo = None
+
+    def iniciar(self):
+        self.hilo = threading.Thread(target=self._bucle, name=f'escritor-{self.dispositivo.device_id}', daemon=True)
+        self.hilo.start()
+        return self
+
+    def encolar(self, datos, prioridad=MANUAL):
+        """Encola `datos` y devuelve el Comando (puede ser uno ya existente si se coalesció)"""
+        nuevo = Comando(self.dispositivo.device_id, datos, prioridad)
+        reemplazado = None
+        with self._cond:
+            pendiente = self._pendientes.get(nuevo.actuador)
+            if pendiente is not None and pendiente.datos == datos:
+                # Mismo comando aún en cola: se reutiliza (subiéndole la prioridad si hace falta)
+                if prioridad < pendiente.prioridad:
+                    pendiente.prioridad = prioridad
+                    heapq.heappush(self._cola, (prioridad, next(self._orden), pendiente))
+                self._m_resultado['coalescido'].sumar()
+                return pendiente
+            ultimo = self._ultimos.get(nuevo.actuador)
+            if (pendiente is None and prioridad != EMERGENCIA and ultimo is not None and ultimo.datos == datos
+                    and ultimo.estado in ('enviado', 'confirmado')
+                    and time.time() - ultimo.enviado < VENTANA_COALESCER_S):
+                # Doble clic: el actuador ya recibió este comando
+                self._m_resultado['coalescido'].sumar()
+                return ultimo
+            if pendiente is not None:
+                # Orden contraria aún sin enviar: solo cuenta la última
+                pendiente.estado = 'reemplazado'
+                pendiente.reemplazado_por = nuevo.id
+                nuevo.prioridad = min(prioridad, pendiente.prioridad)
+                reemplazado = pendiente
+            self._pendientes[nuevo.actuador] = nuevo
+            heapq.heappush(self._cola, (nuevo.prioridad, next(self._orden), nuevo))
+            self._cond.notify()
+        if reemplazado is not None:
+            self._notificar(reemplazado)
+        return nuevo
+
+    def confirmar(self, datos):
+        """Eco 'ACK:<byte>' recibido por el hilo lector"""
+        with self._cond:
+            comando = self._sin_ack.pop(datos, None)
+            if comando is None:
+                return
+            comando.estado = 'confirmado'
+            comando.confirmado = time.time()
+            comando._limite_ack = 0.0
+        self._m_resultado['confirmado'].sumar()
+        self._notificar(comando)
+
+    def profundidad(self):
+        with self._cond:
+            return len(self._pendientes)
+
+    # ---------- hilo escritor ----------
+    def _siguiente(self):
+        while self._cola:
+            prioridad, _, comando = heapq.heappop(self._cola)
+            # Entradas obsoletas: reemplazadas, ya escritas o duplicadas al subir la prioridad
+            if comando.estado == 'pendiente' and prioridad == comando.prioridad:
+                if self._pendientes.get(comando.actuador) is comando:
+                    del self._pendientes[comando.actuador]
+                return comando
+        return None
+
+    def _vencidos(self):
+        """Saca los comandos cuyo eco no llegó a tiempo; devuelve (vencidos, segundos hasta el próximo límite)"""
+        ahora = time.monotonic()
+        vencidos = []
+        proximo = None
+        for datos, comando in list(self._sin_ack.items()):
+            if comando._limite_ack <= ahora:
+                del self._sin_ack[datos]
+                vencidos.append(comando)
+            elif proximo is None or comando._limite_ack - ahora < proximo:
+                proximo = comando._limite_ack - ahora
+        return vencidos, proximo
+
+    def _reintentar_o_abandonar(self, comando):
+        # Se reintenta solo si nadie ha pedido después otra cosa para ese actuador
+        if (comando.intentos <= REINTENTOS_ACK and comando.actuador not in self._pendientes
+                and self._ultimos.get(comando.actuador) is comando):
+            comando.estado = 'pendiente'
+            self._pendientes[comando.actuador] = comando
+            heapq.heappush(self._cola, (comando.prioridad, next(self._orden), comando))
+            return False
+        comando.estado = 'sin_ack'
+        comando._limite_ack = 0.0
+        return True
+
+    def _bucle(self):
+        while True:
+            abandonados = []
+            with self._cond:
+                while True:
+                    vencidos, espera = self._vencidos()
+                    abandonados.extend(c for c in vencidos if self._reintentar_o_abandonar(c))
+                    comando = self._siguiente()
+                    if comando is not None or abandonados:
+                        break
+                    self._cond.wait(espera)
+            for c in abandonados:
+                self._m_resultado['sin_ack'].sumar()
+                self._notificar(c)
+            if comando is not None:
+                self._escribir(comando)
+
+    def _escribir(self, comando):
+        comando.intentos += 1
+        try:
+            self.dispositivo.escribir(comando.datos)
+        except Exception as e:
+            print(f"❌ Comando {comando.datos!r} a '{comando.device_id}' falló: {e}")
+            comando.estado = 'fallido'
+            comando.error = str(e)
+            self._m_resultado['fallido'].sumar()
+            self._notificar(comando)
+            return
+        if comando.intentos == 1:
+            ESPERA_COMANDO.con(NOMBRES_PRIORIDAD[comando.prioridad]).observar(time.time() - comando.creado)
+        comando.enviado = time.time()
+        with self._cond:
+            comando.estado = 'enviado'
+            self._ultimos[comando.actuador] = comando
+            if self.esperar_ack:
+                comando._limite_ack = time.monotonic() + TIMEOUT_ACK_S
+                self._sin_ack[comando.datos] = comando
+        if comando.intentos == 1:
+            self._m_resultado['enviado'].sumar()
+        self._notificar(comando)
+
+    def _notificar(self, comando):
+        if self.al_cambiar is not None:
+            try:
+                self.al_cambiar(comando)
+            except Exception as e:
+                print(f"⚠️ Aviso de comando falló: {e}")
+
+
+class GestorComandos:
+    """Un CanalComandos por placa más el historial de comandos consultable por id"""
+
+    def __init__(self, registro, al_cambiar=None, esperar_ack=ESPERAR_ACK):
+        self.al_cambiar = al_cambiar
+        self.canales = {d.device_id: CanalComandos(d, self._cambio, esperar_ack) for d in registro.todos()}
+        self._historial = OrderedDict()
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        for canal in self.canales.values():
+            canal.iniciar()
+        return self
+
+    def enviar(self, dispositivo, datos, prioridad=MANUAL):
+        comando = self.canales[dispositivo.device_id].encolar(datos, prioridad)
+        self._guardar(comando)
+        return comando
+
+    def confirmar(self, device_id, datos):
+        canal = self.canales.get(device_id)
+        if canal is not None:
+            canal.confirmar(datos)
+
+    def obtener(self, comando_id):
+        with self._lock:
+            return self._historial.get(comando_id)
+
+    def _guardar(self, comando):
+        with self._lock:
+            self._historial[comando.id] = comando
+            self._historial.move_to_end(comando.id)
+            while len(self._historial) > MAX_HISTORIAL:
+                self._historial.popitem(last=False)
+
+    def _cambio(self, comando):
+        if self.al_cambiar is not None:
+            self.al_cambiar(comando)
@@ -0,0 +1,517 @@
+"""Modo multiproceso: un proceso de ingesta dueño de las placas y N procesos web sin estado propio.
+
+MODO_DESPLIEGUE elige el papel de cada proceso:
+
+- 'unico' (por defecto): como siempre, un solo proceso lee las placas y sirve HTTP.
+- 'ingesta': abre los puertos, clasifica, persiste y avisa; no sirve HTTP. Publica
+  lo que leen las rutas en un segmento de memoria compartida y atiende por un
+  socket Unix lo que modifica estado (comandos, emergencia, umbrales).
+- 'web': workers de Gunicorn (ver gunicorn.conf.py). Reflejan el segmento en sus
+  propios Dispositivo/instantáneas y reenvían las operaciones por el socket.
+
+Cada ranura del segmento va protegida por un seqlock: el único escritor pone el
+contador en impar, copia y lo deja en par; el lector reintenta si lo vio impar
+o si cambió mientras copiaba. Leer nunca toma locks ni espera al escritor.
+"""
+import atexit
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+import instantaneas
+from dispositivos import Dispositivo
+from estadisticas import Resumen
+from instantaneas import Instantanea
+
+MODOS = ('unico', 'ingesta', 'web')
+MODO = os.environ.get('MODO_DESPLIEGUE', 'unico')
+if MODO not in MODOS:
+    raise ValueError(f"MODO_DESPLIEGUE desconocido: {MODO!r} (opciones: {', '.join(MODOS)})")
+
+NOMBRE_SEGMENTO = os.environ.get('SEGMENTO_COMPARTIDO', 'sistema_multisensorial')
+RUTA_SOCKET = os.environ.get('SOCKET_INGESTA', '/tmp/sistema_multisensorial.sock')
+
+# Bytes por ranura (una placa con 2x50 puntos de histórico y estadísticas ocupa ~6 KB)
+TAM_SLOT = 64 * 1024
+TAM_CABECERA = 4096
+MAGICO = b'SMS1'
+# mágico, ranuras, tamaño de ranura, arranque (ETags), longitud del directorio de ranuras
+_CABECERA = struct.Struct('<4sII8sI')
+# secuencia del seqlock, longitud del contenido
+_SLOT = struct.Struct('<QI4x')
+_SECUENCIA = struct.Struct('<Q')
+_LONGITUD = struct.Struct('<I')
+REINTENTOS_LECTURA = 100
+
+# Cada cuánto el proceso de ingesta vuelca cambios y los procesos web los recogen
+INTERVALO_REPLICA_S = 0.02
+INTERVALO_ESPEJO_S = 0.02
+# Las ranuras se reescriben al menos con esta frecuencia (contadores de /enlace)
+REFRESCO_S = 1.0
+# Sin cambios en este tiempo, el proceso web comprueba si la ingesta se reinició
+PLAZO_REENGANCHE_S = 3.0
+# Eventos (alertas, comandos) que se conservan para los SSE de los procesos web
+MAX_EVENTOS = 64
+
+TIMEOUT_SOCKET_S = 5
+MAX_PETICION = 64 * 1024
+
+
+def ranura_dispositivo(device_id):
+    return f'dispositivo:{device_id}'
+
+
+def _json(datos):
+    return json.dumps(datos, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+# ============================================
+# SEGMENTO DE MEMORIA COMPARTIDA
+# ============================================
+class Segmento:
+    """Ranuras de tamaño fijo con seqlock. Un único escritor (el proceso de ingesta)"""
+
+    def __init__(self, shm, nombres, arranque, tam_slot, propietario):
+        self._shm = shm
+        self.nombres = nombres
+        self.arranque = arranque
+        self.tam_slot = tam_slot
+        self.propietario = propietario
+        self._desplazamientos = {n: TAM_CABECERA + i * (_SLOT.size + tam_slot) for i, n in enumerate(nombres)}
+
+    @classmethod
+    def crear(cls, nombres, arranque, nombre=NOMBRE_SEGMENTO, tam_slot=TAM_SLOT):
+        # multiprocessing solo se carga en los modos que lo usan
+        from multiprocessing import shared_memory
+        directorio = _json(list(nombres))
+        if _CABECERA.size + len(directorio) > TAM_CABECERA:
+            raise ValueError("Demasiadas ranuras para la cabecera del segmento")
+        try:
+            # Segmento huérfano de un arranque anterior que no pudo limpiarse
+            viejo = shared_memory.SharedMemory(nombre)
+            viejo.close()
+            viejo.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(nombre, create=True, size=TAM_CABECERA + len(nombres) * (_SLOT.size + tam_slot))
+        shm.buf[_CABECERA.size:_CABECERA.size + len(directorio)] = directorio
+        _CABECERA.pack_into(shm.buf, 0, MAGICO, len(nombres), tam_slot, arranque.encode('ascii'), len(directorio))
+        segmento = cls(shm, list(nombres), arranque, tam_slot, propietario=True)
+        atexit.register(segmento.cerrar)
+        return segmento
+
+    @classmethod
+    def adjuntar(cls, nombre=NOMBRE_SEGMENTO):
+        from multiprocessing import resource_tracker, shared_memory
+        shm = shared_memory.SharedMemory(nombre)
+        # Python < 3.13 registra también los segmentos adjuntados y los borraría al salir este proceso
+        try:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        magico, _, tam_slot, arranque, largo = _CABECERA.unpack_from(shm.buf, 0)
+        if magico != MAGICO:
+            shm.close()
+            raise ValueError("Segmento aún sin inicializar")
+        nombres = json.loads(bytes(shm.buf[_CABECERA.size:_CABECERA.size + largo]))
+        return cls(shm, nombres, arranque.decode('ascii'), tam_slot, propietario=False)
+
+    def escribir(self, nombre, datos):
+        if len(datos) > self.tam_slot:
+            raise ValueError(f"Ranura '{nombre}': {len(datos)} bytes no caben en {self.tam_slot}")
+        inicio = self._desplazamientos[nombre]
+        buf = self._shm.buf
+        secuencia = _SECUENCIA.unpack_from(buf, inicio)[0]
+        # Impar: escritura en curso
+        _SECUENCIA.pack_into(buf, inicio, secuencia + 1)
+        buf[inicio + _SLOT.size:inicio + _SLOT.size + len(datos)] = datos
+        _LONGITUD.pack_into(buf, inicio + _SECUENCIA.size, len(datos))
+        _SECUENCIA.pack_into(buf, inicio, secuencia + 2)
+
+    def leer(self, nombre, visto=None):
+        """(secuencia, bytes) de la ranura; None si no cambió desde `visto` o nunca se escribió"""
+        inicio = self._desplazamientos.get(nombre)
+        if inicio is None:
+            return None
+        buf = self._shm.buf
+        for _ in range(REINTENTOS_LECTURA):
+            secuencia, largo = _SLOT.unpack_from(buf, inicio)
+            if secuencia == visto or secuencia == 0:
+                return None
+            if secuencia & 1:
+                # El escritor está a mitad de copia: se cede el GIL y se reintenta
+                time.sleep(0)
+                continue
+            datos = bytes(buf[inicio + _SLOT.size:inicio + _SLOT.size + min(largo, self.tam_slot)])
+            if _SECUENCIA.unpack_from(buf, inicio)[0] == secuencia:
+                return secuencia, datos
+        return None
+
+    def cerrar(self):
+        if self._shm is None:
+            return
+        self._shm.close()
+        if self.propietario:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+        self._shm = None
+
+
+# ============================================
+# SERIALIZACIÓN DE INSTANTÁNEAS Y RESÚMENES
+# ============================================
+def _instantanea_a_dict(inst):
+    return {'clave': inst.clave, 'version': inst.version, 'lectura': inst.lectura,
+            'historico_temperatura': inst.historico_temperatura, 'historico_humo': inst.historico_humo}
+
+
+def _instantanea_desde(datos):
+    return Instantanea(datos['clave'], datos['version'], datos['lectura'],
+                       tuple(datos['historico_temperatura']), tuple(datos['historico_humo']))
+
+
+def _resumen_a_dict(resumen):
+    return {'clave': resumen.clave, 'version': resumen.version,
+            'ventanas': list(resumen.ventanas.items()), 'ewma': resumen.ewma}
+
+
+def _resumen_desde(datos):
+    ventanas = {longitud: {var: tuple(acumulado) for var, acumulado in por_variable.items()}
+                for longitud, por_variable in datos['ventanas']}
+    return Resumen(datos['clave'], datos['version'], ventanas, datos['ewma'])
+
+
+# ============================================
+# PROCESO DE INGESTA: RÉPLICA AL SEGMENTO
+# ============================================
+class Replicador:
+    """Vuelca al segmento lo que cambió: cada placa, la vista agregada y los eventos"""
+
+    def __init__(self, segmento, registro, agregado, estadisticas_agregadas, supervisor=None):
+        self.segmento = segmento
+        self.registro = registro
+        self.agregado = agregado
+        self.estadisticas_agregadas = estadisticas_agregadas
+        # Su cuerpo de /health y /ready (supervisor.py) se sirve tal cual desde los procesos web
+        self.supervisor = supervisor
+        self._eventos = deque(maxlen=MAX_EVENTOS)
+        self._secuencia_eventos = 0
+        self._lock = threading.Lock()
+        self._vistos = {}
+        self._ultimo_refresco = 0.0
+
+    @staticmethod
+    def ranuras(registro):
+        return [ranura_dispositivo(i) for i in registro.ids()] + ['agregado', 'eventos', 'salud']
+
+    def registrar_evento(self, tipo, datos, canales):
+        """Observador de BusEventos: las lecturas viajan en las ranuras, el resto como eventos"""
+        if tipo == 'lectura':
+            return
+        with self._lock:
+            self._secuencia_eventos += 1
+            self._eventos.append((self._secuencia_eventos, tipo, datos, list(canales)))
+
+    def iniciar(self):
+        threading.Thread(target=self._bucle, name='replicador', daemon=True).start()
+        return self
+
+    def _bucle(self):
+        while True:
+            try:
+                self.replicar()
+            except Exception as e:
+                print(f"⚠️ Error replicando al segmento compartido: {e}")
+            time.sleep(INTERVALO_REPLICA_S)
+
+    def _si_cambio(self, nombre, clave, refrescar):
+        if refrescar or self._vistos.get(nombre) != clave:
+            self._vistos[nombre] = clave
+            return True
+        return False
+
+    def replicar(self):
+        ahora = time.monotonic()
+        refrescar = ahora - self._ultimo_refresco >= REFRESCO_S
+        dispositivos = self.registro.todos()
+        for d in dispositivos:
+            inst, resumen = d.instantanea, d.estadisticas.resumen
+            nombre = ranura_dispositivo(d.device_id)
+            if self._si_cambio(nombre, (inst.version, resumen.version), refrescar):
+                self.segmento.escribir(nombre, _json({
+                    'instantanea': _instantanea_a_dict(inst), 'estadisticas': _resumen_a_dict(resumen),
+                    'estado': d.estado(), 'enlace': d.estado_enlace()}))
+
+        inst = self.agregado.instantanea
+        resumen = self.estadisticas_agregadas.obtener([d.estadisticas for d in dispositivos])
+        if self._si_cambio('agregado', (inst.clave, inst.version, resumen.clave, resumen.version), refrescar):
+            self.segmento.escribir('agregado', _json({'instantanea': _instantanea_a_dict(inst),
+                                                      'estadisticas': _resumen_a_dict(resumen)}))
+
+        with self._lock:
+            secuencia, eventos = self._secuencia_eventos, list(self._eventos)
+        if self._si_cambio('eventos', secuencia, refrescar):
+            # El histórico de alertas no viaja aquí: los procesos web lo leen de la base
+            self.segmento.escribir('eventos', _json(eventos))
+        if self.supervisor is not None and self._si_cambio('salud', self.supervisor.version, refrescar):
+            self.segmento.escribir('salud', self.supervisor.actual[0])
+        if refrescar:
+            self._ultimo_refresco = ahora
+
+
+# ============================================
+# PROCESOS WEB: ESPEJO DEL SEGMENTO
+# ============================================
+class DispositivoEspejo(Dispositivo):
+    """Placa vista desde un proceso web: su estado llega por el segmento, nunca abre el puerto"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.remoto = {'estado': Dispositivo.estado(self), 'enlace': {'totales': {}, 'por_segundo': {}}}
+
+    def estado(self):
+        return self.remoto['estado']
+
+    def estado_enlace(self):
+        return self.remoto['enlace']
+
+    def conectar(self):
+        raise RuntimeError("En modo web solo el proceso de ingesta abre los puertos")
+
+    def escribir(self, datos):
+        raise RuntimeError("En modo web los comandos van por el socket de ingesta")
+
+
+class EstadisticasEspejo:
+    """Sustituto de EstadisticasAgregadas: el resumen '*' ya viene fusionado del proceso de ingesta"""
+
+    def __init__(self):
+        self.resumen = Resumen('*', 0, {}, {})
+
+    def obtener(self, motores):
+        return motores[0].resumen if len(motores) == 1 else self.resumen
+
+
+class Espejo:
+    """Hilo de cada proceso web: copia los cambios del segmento y los empuja a sus SSE"""
+
+    def __init__(self, registro, agregado, estadisticas, bus, nombre=NOMBRE_SEGMENTO):
+        self.registro = registro
+        self.agregado = agregado
+        self.estadisticas = estadisticas
+        self.bus = bus
+        self.nombre = nombre
+        self.segmento = None
+        # Secuencia leída por ranura y (versión de instantánea, versión de resumen) ya reconstruidas
+        self._vistos = {}
+        self._construidas = {}
+        self._visto_eventos = None
+        self._ultimo_cambio = 0.0
+        # Último dato recibido del proceso de ingesta (monotónico) y su estado de salud
+        self._ultimo_dato = None
+        self.salud = None
+
+    def iniciar(self):
+        threading.Thread(target=self._bucle, name='espejo', daemon=True).start()
+        return self
+
+    def _bucle(self):
+        while True:
+            try:
+                if self.segmento is None or time.monotonic() - self._ultimo_cambio > PLAZO_REENGANCHE_S:
+                    self._adjuntar()
+                if self.segmento is not None:
+                    self.sincronizar()
+            except Exception as e:
+                print(f"⚠️ Error leyendo el segmento compartido: {e}")
+            time.sleep(INTERVALO_ESPEJO_S)
+
+    def _adjuntar(self):
+        self._ultimo_cambio = time.monotonic()
+        try:
+            nuevo = Segmento.adjuntar(self.nombre)
+        except (FileNotFoundError, ValueError):
+            return
+        if self.segmento is not None and nuevo.arranque == self.segmento.arranque:
+            # Mismo proceso de ingesta, solo sin cambios recientes
+            nuevo.cerrar()
+            return
+        if self.segmento is not None:
+            self.segmento.cerrar()
+        # ETags iguales en todos los procesos web: las del proceso de ingesta
+        instantaneas.fijar_arranque(nuevo.arranque)
+        self.segmento = nuevo
+        self._vistos = {}
+        self._construidas = {}
+        self._visto_eventos = None
+        self.salud = None
+        print(f"🔗 Conectado al proceso de ingesta (segmento '{self.nombre}', arranque {nuevo.arranque})")
+
+    def _leer(self, nombre):
+        leido = self.segmento.leer(nombre, self._vistos.get(nombre))
+        if leido is None:
+            return None
+        self._vistos[nombre] = leido[0]
+        self._ultimo_cambio = self._ultimo_dato = time.monotonic()
+        return json.loads(leido[1])
+
+    def edad_datos(self):
+        """Segundos desde el último cambio leído del segmento (None si nunca llegó nada)"""
+        return None if self._ultimo_dato is None else time.monotonic() - self._ultimo_dato
+
+    def _reconstruir(self, nombre, datos):
+        """(instantánea, resumen) nuevos si cambiaron de versión; None en lo que sigue igual"""
+        anterior = self._construidas.get(nombre, (None, None))
+        version = (datos['instantanea']['version'], datos['estadisticas']['version'])
+        self._construidas[nombre] = version
+        return (_instantanea_desde(datos['instantanea']) if version[0] != anterior[0] else None,
+                _resumen_desde(datos['estadisticas']) if version[1] != anterior[1] else None)
+
+    def sincronizar(self):
+        for d in self.registro.todos():
+            nombre = ranura_dispositivo(d.device_id)
+            datos = self._leer(nombre)
+            if datos is None:
+                continue
+            d.remoto = {'estado': datos['estado'], 'enlace': datos['enlace']}
+            d.estado_peligro_anterior = datos['estado']['alerta']
+            inst, resumen = self._reconstruir(nombre, datos)
+            if resumen is not None:
+                d.estadisticas.resumen = resumen
+            if inst is not None:
+                d.version = inst.version
+                d.instantanea = inst
+                self.bus.publicar('lectura', inst.lectura, (d.device_id,))
+
+        datos = self._leer('agregado')
+        if datos is not None:
+            inst, resumen = self._reconstruir('agregado', datos)
+            if resumen is not None:
+                self.estadisticas.resumen = resumen
+            if inst is not None:
+                self.agregado.instantanea = inst
+                self.bus.publicar('lectura', inst.lectura)
+
+        salud = self._leer('salud')
+        if salud is not None:
+            self.salud = salud
+
+        eventos = self._leer('eventos')
+        if eventos is not None:
+            if self._visto_eventos is None:
+                # Recién adjuntado: no se repiten eventos anteriores a la conexión
+                self._visto_eventos = max((e[0] for e in eventos), default=0)
+                return
+            for secuencia, tipo, datos, canales in eventos:
+                if secuencia > self._visto_eventos:
+                    self.bus.publicar(tipo, datos, canales)
+                    self._visto_eventos = secuencia
+
+
+# ============================================
+# SOCKET UNIX: OPERACIONES QUE MODIFICAN ESTADO
+# ============================================
+class IngestaNoDisponible(ConnectionError):
+    """El proceso de ingesta no responde (arrancando, caído o socket inexistente)"""
+
+
+class ErrorRemoto(Exception):
+    """La operación llegó al proceso de ingesta pero falló allí"""
+
+
+class ServidorIngesta:
+    """Atiende en el proceso de ingesta peticiones de una línea JSON: {'op': ..., 'args': {...}}"""
+
+    def __init__(self, operaciones, ruta=RUTA_SOCKET):
+        self.operaciones = operaciones
+        self.ruta = ruta
+
+    def iniciar(self):
+        import socketserver
+        operaciones = self.operaciones
+
+        class Manejador(socketserver.StreamRequestHandler):
+            def handle(self):
+                linea = self.rfile.readline(MAX_PETICION)
+                if not linea:
+                    return
+                try:
+                    peticion = json.loads(linea)
+                    operacion = operaciones[peticion['op']]
+                    respuesta = {'ok': True, 'resultado': operacion(**peticion.get('args', {}))}
+                except Exception as e:
+                    respuesta = {'ok': False, 'error': str(e)}
+                self.wfile.write(_json(respuesta) + b'\n')
+
+        if os.path.exists(self.ruta):
+            # Socket huérfano de un arranque anterior
+            os.unlink(self.ruta)
+        servidor = socketserver.ThreadingUnixStreamServer(self.ruta, Manejador)
+        servidor.daemon_threads = True
+        os.chmod(self.ruta, 0o600)
+        atexit.register(lambda: os.path.exists(self.ruta) and os.unlink(self.ruta))
+        threading.Thread(target=servidor.serve_forever, name='servidor-ingesta', daemon=True).start()
+        print(f"🔌 Operaciones de los procesos web en {self.ruta}")
+        return servidor
+
+
+class ClienteIngesta:
+    """Lado web del socket: una conexión por operación (local, del orden de decenas de µs)"""
+
+    def __init__(self, ruta=RUTA_SOCKET, timeout=TIMEOUT_SOCKET_S):
+        self.ruta = ruta
+        self.timeout = timeout
+
+    def llamar(self, op, **args):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.settimeout(self.timeout)
+                s.connect(self.ruta)
+                s.sendall(_json({'op': op, 'args': args}) + b'\n')
+                with s.makefile('rb') as f:
+                    linea = f.readline()
+        except OSError as e:
+            raise IngestaNoDisponible(f"Proceso de ingesta no disponible: {e}") from e
+        if not linea:
+            raise IngestaNoDisponible("El proceso de ingesta cerró la conexión")
+        respuesta = json.loads(linea)
+        if not respuesta['ok']:
+            raise ErrorRemoto(respuesta['error'])
+        return respuesta['resultado']
+
+
+class ComandoRemoto:
+    """Vista de un comando encolado en el proceso de ingesta (misma interfaz que comandos.Comando)"""
+
+    __slots__ = ('id', '_resumen')
+
+    def __init__(self, resumen):
+        self.id = resumen['id']
+        self._resumen = resumen
+
+    def resumen(self):
+        return self._resumen
+
+
+class ClienteComandos:
+    """Sustituto de GestorComandos en los procesos web: encola en el proceso de ingesta"""
+
+    # Sin colas locales (el colector de métricas no tiene nada que medir aquí)
+    canales = {}
+
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def enviar(self, dispositivo, datos, prioridad):
+        return ComandoRemoto(self.cliente.llamar('comando', dispositivo=dispositivo.device_id,
+                                                 datos=datos.decode('latin-1'), prioridad=prioridad))
+
+    def obtener(self, comando_id):
+        resumen = self.cliente.llamar('estado_comando', comando_id=comando_id)
+        return ComandoRemoto(resumen) if resumen else None
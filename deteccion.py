@@ -0,0 +1,273 @@
+"""Etapa de detección entre la clasificación por umbrales y el latch de peligro.
+
+Cada placa tiene su `EtapaDeteccion`: una lista de detectores que, con cada
+muestra, responden DISPARA (abrir alerta), MANTIENE (no soltar la que hay) o
+INACTIVO. El latch de `procesar_muestra` se engancha con el primer DISPARA y
+se suelta cuando ningún detector dispara ni mantiene.
+
+- DetectorUmbral: el valor alcanza el umbral de peligro en N de las últimas M
+  muestras (un pico aislado no abre alerta) y mantiene la alerta hasta que M
+  muestras seguidas quedan por debajo de `umbral - banda` (histéresis: un
+  valor que oscila sobre el umbral no abre y cierra alertas sin parar).
+- DetectorSubida: CUSUM sobre la subida de una media móvil robusta (cada
+  muestra se recorta a `recorte` desviaciones de la media). Alerta por una
+  subida sostenida más rápida que `deriva` por segundo aunque el valor aún
+  esté lejos del umbral.
+
+Todos son O(1) por muestra con memoria fija (la ventana N de M es un entero
+usado como registro de bits) y cada detector acumula sus evaluaciones y el
+tiempo que ha costado evaluarlo (/metrics, por dispositivo y detector).
+
+DETECTORES="umbral,subida" elige los detectores (ver FABRICAS para añadir
+otros), DETECCION_N_DE_M="3/5" el debounce y DETECCION_BANDAS="temperatura=3,humo=50"
+la histéresis. `transicion` es el latch: lo usan procesar_muestra y backtest.py,
+que reproduce esta misma etapa (con la misma configuración) para los umbrales
+vigentes. Con DETECTORES=umbral, DETECCION_N_DE_M=1/1 y DETECCION_BANDAS a 0
+la etapa equivale al cruce de umbral simple que barre backtest.py en bloque.
+"""
+import os
+import time
+
+# Respuestas de un detector para una muestra
+INACTIVO, MANTIENE, DISPARA = 0, 1, 2
+# Variables que evalúan los detectores, en el orden de `valores` y `umbrales`
+CAMPOS = ('temperatura', 'humo')
+
+DETECTORES_POR_DEFECTO = ('umbral', 'subida')
+# Debounce: muestras en peligro (N) de las últimas M para abrir la alerta
+N_DE_M_POR_DEFECTO = (3, 5)
+# Histéresis: para soltar la alerta el valor debe bajar de `umbral - banda`
+BANDAS_POR_DEFECTO = {'temperatura': 3.0, 'humo': 50.0}
+# Subida: deriva permitida por segundo (6 °C/min, 300 ppm/min), subida acumulada
+# que dispara y desviación mínima del ruido del sensor
+SUBIDA = {
+    'temperatura': {'deriva': 0.1, 'limite': 3.0, 'desviacion_min': 0.5},
+    'humo': {'deriva': 5.0, 'limite': 150.0, 'desviacion_min': 10.0},
+}
+# Constante de tiempo de la media robusta, desviaciones a las que se recorta una muestra
+# y tope de la subida acumulada (en múltiplos del límite)
+TAU_SUBIDA_S = 5.0
+RECORTE_DESVIACIONES = 3.0
+TOPE_LIMITES = 2.0
+# Periodo supuesto hasta medir el real (Arduino a ~10 Hz) y tope por muestra (huecos, reconexiones)
+PERIODO_INICIAL_S = 0.1
+PERIODO_MAX_S = 1.0
+
+
+class VentanaNdeM:
+    """Cuántas de las últimas `m` muestras cumplen la condición (bits de un entero)"""
+
+    __slots__ = ('cuenta', '_bits', '_mascara', '_salida')
+
+    def __init__(self, m):
+        self.cuenta = 0
+        self._bits = 0
+        self._mascara = (1 << m) - 1
+        # Bit de la muestra que sale de la ventana al entrar la siguiente
+        self._salida = 1 << (m - 1)
+
+    def agregar(self, cumple):
+        if self._bits & self._salida:
+            self.cuenta -= 1
+        self._bits = ((self._bits << 1) & self._mascara) | cumple
+        self.cuenta += cumple
+        return self.cuenta
+
+
+# ============================================
+# DETECTORES
+# ============================================
+class Detector:
+    """Base: `evaluar(dt, valor, umbral)` -> INACTIVO, MANTIENE o DISPARA.
+
+    `dt` son los segundos que representa la muestra y `umbral` el de peligro
+    vigente de su variable. `motivo` se guarda con la alerta que abre.
+    """
+
+    motivo = 'detector'
+
+    def __init__(self, tipo):
+        self.tipo = tipo
+        self.indice = CAMPOS.index(tipo)
+        self.nombre = f'{self.motivo}_{tipo}'
+        self.evaluaciones = 0
+        self.coste_s = 0.0
+
+    def evaluar(self, dt, valor, umbral):
+        raise NotImplementedError
+
+
+class DetectorUmbral(Detector):
+    motivo = 'umbral'
+
+    def __init__(self, tipo, n, m, banda):
+        super().__init__(tipo)
+        self.n = n
+        self.banda = banda
+        self.sobre = VentanaNdeM(m)
+        self.retenido = VentanaNdeM(m)
+
+    def evaluar(self, dt, valor, umbral):
+        sobre = self.sobre.agregar(valor >= umbral)
+        retenido = self.retenido.agregar(valor >= umbral - self.banda)
+        if sobre >= self.n:
+            return DISPARA
+        return MANTIENE if retenido else INACTIVO
+
+
+class DetectorSubida(Detector):
+    motivo = 'subida'
+
+    def __init__(self, tipo, deriva, limite, desviacion_min, tau=TAU_SUBIDA_S, recorte=RECORTE_DESVIACIONES):
+        super().__init__(tipo)
+        self.deriva = deriva
+        self.limite = limite
+        self.desviacion_min = desviacion_min
+        self.tau = tau
+        self.recorte = recorte
+        self.media = None
+        self.desviacion = desviacion_min
+        # Subida acumulada por encima de la deriva permitida (CUSUM unilateral)
+        self.acumulado = 0.0
+
+    def evaluar(self, dt, valor, umbral):
+        if self.media is None:
+            self.media = valor
+            return INACTIVO
+        alfa = dt / (self.tau + dt)
+        diferencia = valor - self.media
+        # Un pico aislado mueve la media como mucho `recorte` desviaciones
+        tope = self.recorte * max(self.desviacion, self.desviacion_min)
+        subida = alfa * max(-tope, min(diferencia, tope))
+        self.media += subida
+        self.desviacion += alfa * (abs(diferencia) - self.desviacion)
+        # Con tope: cuando la subida se detiene, la alerta se suelta en pocas decenas de segundos
+        self.acumulado = min(max(0.0, self.acumulado + subida - self.deriva * dt), TOPE_LIMITES * self.limite)
+        if self.acumulado >= self.limite:
+            return DISPARA
+        return MANTIENE if self.acumulado >= self.limite / 2 else INACTIVO
+
+
+def _umbral(tipo, config):
+    n, m = config['n_de_m']
+    return DetectorUmbral(tipo, n, m, config['bandas'][tipo])
+
+
+def _subida(tipo, config):
+    return DetectorSubida(tipo, **SUBIDA[tipo])
+
+
+# Nombre en DETECTORES -> fábrica (tipo, configuración) de un detector por variable
+FABRICAS = {'umbral': _umbral, 'subida': _subida}
+
+
+# ============================================
+# ETAPA POR PLACA
+# ============================================
+class EtapaDeteccion:
+    """Detectores de una placa; solo la usa su hilo lector (sin lock propio)"""
+
+    def __init__(self, detectores):
+        self.detectores = list(detectores)
+        self.periodo = PERIODO_INICIAL_S
+        self._ts = None
+        self._ts_anterior = None
+        self._en_bloque = 0
+
+    def _paso(self, ts):
+        """Segundos que representa una muestra.
+
+        Las muestras de un mismo bloque de read() comparten ts: se reparte el
+        hueco entre los dos bloques anteriores por las muestras del último.
+        """
+        if ts != self._ts:
+            if self._ts_anterior is not None and self._en_bloque:
+                self.periodo = min((self._ts - self._ts_anterior) / self._en_bloque, PERIODO_MAX_S)
+            self._ts_anterior, self._ts, self._en_bloque = self._ts, ts, 0
+        self._en_bloque += 1
+        return self.periodo
+
+    def evaluar(self, ts, valores, umbrales):
+        """(detectores que disparan, si alguno mantiene la alerta) para la muestra `valores`"""
+        dt = self._paso(ts)
+        disparos = []
+        mantiene = False
+        reloj = time.perf_counter
+        inicio = reloj()
+        for detector in self.detectores:
+            estado = detector.evaluar(dt, valores[detector.indice], umbrales[detector.indice])
+            fin = reloj()
+            detector.coste_s += fin - inicio
+            detector.evaluaciones += 1
+            inicio = fin
+            if estado == DISPARA:
+                disparos.append(detector)
+            elif estado == MANTIENE:
+                mantiene = True
+        return disparos, mantiene
+
+    def resumen(self):
+        """Evaluaciones y coste medio por detector (µs)"""
+        return {d.nombre: {'evaluaciones': d.evaluaciones,
+                           'coste_medio_us': round(d.coste_s / d.evaluaciones * 1e6, 3) if d.evaluaciones else None}
+                for d in self.detectores}
+
+
+# Transiciones del latch de peligro
+ABRE, SUELTA = 'abre', 'suelta'
+
+
+def transicion(enganchado, disparos, mantiene):
+    """Latch de procesar_muestra (y de backtest.py): ABRE, SUELTA o None si no cambia"""
+    if disparos and not enganchado:
+        return ABRE
+    if enganchado and not disparos and not mantiene:
+        return SUELTA
+    return None
+
+
+def tipos_y_motivo(disparos):
+    """Tipos y motivo de la alerta que abren `disparos`: si alguno es de umbral, mandan esos"""
+    principales = [d for d in disparos if d.motivo == 'umbral'] or disparos
+    tipos = [t for t in CAMPOS if any(d.tipo == t for d in principales)]
+    return tipos, principales[0].motivo
+
+
+def _bandas(texto):
+    """'temperatura=3,humo=50' -> bandas por variable (las que falten, por defecto)"""
+    bandas = dict(BANDAS_POR_DEFECTO)
+    for entrada in filter(None, (e.strip() for e in texto.split(','))):
+        campo, _, valor = entrada.partition('=')
+        campo = campo.strip()
+        if campo not in CAMPOS:
+            raise ValueError(f"Banda de variable desconocida: {campo!r} (opciones: {', '.join(CAMPOS)})")
+        bandas[campo] = float(valor)
+        if bandas[campo] < 0:
+            raise ValueError(f"Banda negativa para {campo}: {valor}")
+    return bandas
+
+
+def configuracion(detectores=None, n_de_m=None, bandas=None):
+    """Detectores, debounce e histéresis desde DETECTORES="umbral,subida", DETECCION_N_DE_M="3/5"
+    y DETECCION_BANDAS="temperatura=3,humo=50" """
+    detectores = os.environ.get('DETECTORES', '') if detectores is None else detectores
+    nombres = tuple(n.strip() for n in detectores.split(',') if n.strip()) or DETECTORES_POR_DEFECTO
+    desconocidos = [n for n in nombres if n not in FABRICAS]
+    if desconocidos:
+        raise ValueError(f"Detectores desconocidos: {', '.join(desconocidos)} (opciones: {', '.join(FABRICAS)})")
+
+    n_de_m = os.environ.get('DETECCION_N_DE_M', '') if n_de_m is None else n_de_m
+    if n_de_m.strip():
+        n, _, m = n_de_m.partition('/')
+        n, m = int(n), int(m)
+        if not 1 <= n <= m:
+            raise ValueError(f"Debounce inválido: {n_de_m!r} (N/M con 1 <= N <= M)")
+    else:
+        n, m = N_DE_M_POR_DEFECTO
+    bandas = os.environ.get('DETECCION_BANDAS', '') if bandas is None else bandas
+    return {'detectores': nombres, 'n_de_m': (n, m), 'bandas': _bandas(bandas)}
+
+
+def crear_etapa(config=None):
+    config = configuracion() if config is None else config
+    return EtapaDeteccion(FABRICAS[nombre](tipo, config) for nombre in config['detectores'] for tipo in CAMPOS)
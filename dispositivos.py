@@ -0,0 +1,337 @@
+"""Registro de dispositivos: cada placa/nodo tiene su propio estado, latch, buffer y lock."""
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import deteccion
+import metricas
+from estadisticas import EstadisticasDispositivo, VENTANAS_POR_DEFECTO, ventanas_configuradas
+from ingesta import BufferCircular
+from protocolo import crear_decodificador, PROTOCOLOS
+from instantaneas import Instantanea, historico_combinado
+
+BAUDIOS_POR_DEFECTO = 9600
+# Puerto especial que fuerza el simulador en lugar de un Arduino real
+PUERTO_SIMULADO = 'dummy'
+# Formato del flujo serie ('texto' o 'binario', ver protocolo.py)
+PROTOCOLO_POR_DEFECTO = 'texto'
+# Reconexión: espera tras el primer fallo y tope del backoff exponencial (segundos)
+ESPERA_RECONEXION_S = 1.0
+ESPERA_RECONEXION_MAX_S = 30.0
+# El Arduino se reinicia al abrir el puerto: pausa antes de empezar a leer
+ESPERA_REINICIO_ARDUINO_S = 2.0
+
+ESPERA_LOCK = metricas.histograma('dispositivo_lock_espera_segundos', 'Espera para tomar el lock del dispositivo',
+                                  ('dispositivo',))
+RETENCION_LOCK = metricas.histograma('dispositivo_lock_retencion_segundos', 'Tiempo con el lock del dispositivo tomado',
+                                     ('dispositivo',))
+LATENCIA_MUESTRA = metricas.histograma('muestra_latencia_segundos',
+                                       'Desde que el bloque sale de read() hasta que la lectura se publica',
+                                       ('dispositivo',))
+
+
+class DummyArduino:
+    def __init__(self, device_id=''):
+        self.device_id = device_id
+        self.counter = 0
+        # Valores base normales
+        self.base_temp = 25
+        self.base_humo = 50
+        # Ecos de comandos pendientes de devolver (como hace el firmware con ACK)
+        self.ecos = deque()
+    def readline(self):
+        # Ritmo de un Arduino real (~10 Hz)
+        time.sleep(0.1)
+        if self.ecos:
+            return b'ACK:' + self.ecos.popleft()
+        self.counter += 1
+        temp = self.base_temp + random.uniform(-3, 8)
+        humo = self.base_humo + random.uniform(-20, 40)
+
+        # 1% de probabilidad de generar un pico de peligro
+        if random.random() < 0.01:
+            print("***********************************")
+            print(f"Dummy {self.device_id}: Simulando pico de peligro...")
+            print("***********************************")
+            temp += random.uniform(30, 40) # Supera 45
+            humo += random.uniform(550, 650) # Supera 600
+
+        return f"T:{temp:.1f},H:{humo:.1f},RH:60.0".encode('utf-8')
+    def write(self, data):
+        print(f"Dummy.write ({self.device_id}): {data}")
+        self.ecos.extend(data[i:i + 1] for i in range(len(data)))
+        return len(data)
+
+
+class Dispositivo:
+    """Estado de una placa: última lectura, históricos y latch de peligro propios"""
+
+    def __init__(self, device_id, puerto, baudios=BAUDIOS_POR_DEFECTO, ventanas=VENTANAS_POR_DEFECTO,
+                 protocolo=PROTOCOLO_POR_DEFECTO, config_deteccion=None, respaldo_simulado=False):
+        self.device_id = device_id
+        self.puerto = puerto
+        # Si el puerto real no abre, usar DummyArduino en lugar de reintentar
+        self.respaldo_simulado = respaldo_simulado
+        self.baudios = baudios
+        self.protocolo = protocolo
+        self.conexion = None
+        self.usar_dummy = False
+        self.lector = None
+        self.hilo = None
+        # Historial de conexión: para /dispositivos y el informe de arranque
+        self.conexiones = 0
+        self.intentos_fallidos = 0
+        self.ultimo_error = None
+        self.conectado_en = None
+        # Vigilancia del hilo lector: la escribe el lector, la lee supervisor.py (reloj monotónico)
+        self.generacion = 0
+        self.muestras = 0
+        self.ultima_muestra = None
+        self.ultima_conexion = None
+        self.errores_lectura = 0
+        self.errores_seguidos = 0
+        self.reinicios = {}
+        # Cada dispositivo tiene su propio lock: las placas no se serializan entre sí
+        self.lock = metricas.LockMedido(ESPERA_LOCK.con(device_id), RETENCION_LOCK.con(device_id))
+        self.m_latencia_muestra = LATENCIA_MUESTRA.con(device_id)
+        self.historico_temperatura = deque(maxlen=50)
+        self.historico_humo = deque(maxlen=50)
+        self.buffer = BufferCircular()
+        # Estadísticas en streaming (solo las actualiza el hilo lector de esta placa)
+        self.estadisticas = EstadisticasDispositivo(device_id, ventanas)
+        # Detectores que deciden cuándo se engancha y se suelta el latch (solo el hilo lector)
+        self.deteccion = deteccion.crear_etapa(config_deteccion)
+        # Estado maestro de peligro (para "enganchar" la alerta)
+        self.estado_peligro_anterior = False
+        # Alerta en curso en registro_alertas (picos y cierre al volver a seguro)
+        self.alerta_abierta = None
+        self.ultima_lectura = {
+            'dispositivo': device_id,
+            'temperatura': 0, 'humo': 0, 'humedad': None,
+            'nivel_temperatura': 'bajo', 'nivel_humo': 'bajo',
+            'alerta': False, 'timestamp': datetime.now().strftime('%H:%M:%S'),
+            # Aún sin muestras: los ceros de arriba no son una lectura
+            'ts': None, 'obsoleta': True
+        }
+        # Estado publicado para las rutas HTTP (se reemplaza entero, nunca se modifica)
+        self.version = 0
+        self.instantanea = None
+        self.publicar_instantanea()
+
+    def publicar_instantanea(self):
+        """Congela el estado actual y lo publica por intercambio atómico de referencia.
+
+        Debe llamarse con `self.lock` tomado, tras modificar la lectura o los históricos.
+        """
+        self.version += 1
+        self.instantanea = Instantanea(self.device_id, self.version, self.ultima_lectura,
+                                       tuple(self.historico_temperatura), tuple(self.historico_humo))
+
+    def conectar(self):
+        """Un intento de abrir el puerto; True si quedó conectado.
+
+        El simulador se usa si el puerto es 'dummy', si pyserial no está
+        instalado (nunca podría conectar) o si el puerto falla y la placa tiene
+        `respaldo_simulado`; en otro caso un puerto real que falla se reintenta.
+        """
+        if self.puerto != PUERTO_SIMULADO:
+            try:
+                import serial
+            except ImportError:
+                print(f"pyserial no está instalado: '{self.device_id}' usa DummyArduino.")
+            else:
+                try:
+                    conexion = serial.Serial(self.puerto, self.baudios, timeout=0.1)
+                except (serial.SerialException, OSError, ValueError) as e:
+                    self.ultimo_error = str(e)
+                    if not self.respaldo_simulado:
+                        return False
+                    print(f"No se pudo conectar '{self.device_id}' en {self.puerto}: {e}. Usando DummyArduino.")
+                    conexion = None
+                if conexion is not None:
+                    time.sleep(ESPERA_REINICIO_ARDUINO_S)
+                    print(f"Arduino '{self.device_id}' conectado en {self.puerto}")
+                    self.usar_dummy = False
+                    self.conexion = conexion
+                    return True
+        self.conexion = DummyArduino(self.device_id)
+        self.usar_dummy = True
+        return True
+
+    def conectar_con_reintentos(self):
+        """Bloquea (en el hilo lector) hasta conectar, con backoff exponencial y jitter entre intentos"""
+        espera = ESPERA_RECONEXION_S
+        while not self.conectar():
+            self.intentos_fallidos += 1
+            print(f"No se pudo conectar '{self.device_id}' en {self.puerto}: {self.ultimo_error}. "
+                  f"Reintento en {espera:.0f}s")
+            time.sleep(espera * random.uniform(0.8, 1.2))
+            espera = min(espera * 2, ESPERA_RECONEXION_MAX_S)
+        self.conexiones += 1
+        self.ultima_conexion = time.monotonic()
+        if self.conectado_en is None:
+            self.conectado_en = time.perf_counter()
+
+    def marcar_muestra(self, ts_mono):
+        """Anota una muestra procesada (solo el hilo lector)"""
+        self.muestras += 1
+        self.ultima_muestra = ts_mono
+        self.errores_seguidos = 0
+
+    def desconectar(self):
+        """Cierra el puerto (placa desenchufada o parada); el hilo lector volverá a conectar"""
+        conexion, self.conexion = self.conexion, None
+        if conexion is not None and hasattr(conexion, 'close'):
+            try:
+                conexion.close()
+            except Exception:
+                pass
+
+    def crear_decodificador(self):
+        # El simulador siempre habla el protocolo de texto
+        return crear_decodificador('texto' if self.usar_dummy else self.protocolo)
+
+    def estado(self):
+        """Resumen para /dispositivos"""
+        return {'id': self.device_id, 'puerto': self.puerto, 'simulado': self.usar_dummy,
+                'conectado': self.conexion is not None, 'alerta': self.estado_peligro_anterior,
+                'obsoleta': self.instantanea.lectura.get('obsoleta', False),
+                'reconexiones': max(self.conexiones - 1, 0), 'ultimo_error': self.ultimo_error}
+
+    def estado_enlace(self):
+        """Salud del enlace serie para /enlace: líneas por segundo, totales y buffer"""
+        resumen = self.lector.contadores.resumen() if self.lector else {'totales': {}, 'por_segundo': {}}
+        resumen['muestras_en_buffer'] = len(self.buffer)
+        if self.lector and self.lector.decodificador.binario:
+            # Huecos en el número de secuencia de las tramas
+            resumen['tramas_perdidas'] = self.lector.decodificador.perdidas
+        return resumen
+
+    def escribir(self, datos):
+        """Escribe en el puerto; solo lo llama el hilo escritor de comandos (ver comandos.py)"""
+        if self.conexion is None:
+            raise RuntimeError(f"Dispositivo '{self.device_id}' sin conexión")
+        return self.conexion.write(datos)
+
+
+class RegistroDispositivos:
+    """Dispositivos configurados indexados por device_id (orden de configuración)"""
+
+    def __init__(self, dispositivos=()):
+        self._dispositivos = {d.device_id: d for d in dispositivos}
+
+    def agregar(self, dispositivo):
+        self._dispositivos[dispositivo.device_id] = dispositivo
+
+    def obtener(self, device_id):
+        return self._dispositivos.get(device_id)
+
+    def todos(self):
+        return list(self._dispositivos.values())
+
+    def ids(self):
+        return list(self._dispositivos)
+
+    def principal(self):
+        """Primer dispositivo configurado (destino por defecto de los actuadores)"""
+        return next(iter(self._dispositivos.values()))
+
+    def __len__(self):
+        return len(self._dispositivos)
+
+
+def cargar_registro(config=None, simulados=None, clase=None):
+    """Construye el registro a partir de la configuración.
+
+    DISPOSITIVOS="piso1=COM7,piso2=COM8@115200:binario,lab=dummy" define las placas
+    (id=PUERTO[@baudios][:protocolo]);
+    DUMMY_DISPOSITIVOS=N añade N simuladores extra (sim01, sim02, ...).
+    SERIAL_FALLBACK_DUMMY=1 hace que una placa cuyo puerto no abre use el simulador
+    en lugar de reintentar (=0 lo desactiva también para la placa por defecto).
+    ESTADISTICAS_VENTANAS="60,900,3600" fija las ventanas de estadísticas (segundos).
+    DETECTORES y DETECCION_N_DE_M eligen la etapa de detección (ver deteccion.py).
+    Sin configuración: un único dispositivo 'principal' en COM7, con el simulador
+    de respaldo salvo SERIAL_FALLBACK_DUMMY=0.
+    `clase` permite construir otra variante de Dispositivo (p. ej. los espejos de compartido.py).
+    """
+    clase = clase or Dispositivo
+    config = os.environ.get('DISPOSITIVOS', '') if config is None else config
+    simulados = int(os.environ.get('DUMMY_DISPOSITIVOS', '0')) if simulados is None else simulados
+    respaldo = os.environ.get('SERIAL_FALLBACK_DUMMY')
+
+    ventanas = ventanas_configuradas()
+    config_deteccion = deteccion.configuracion()
+    registro = RegistroDispositivos()
+    for entrada in filter(None, (e.strip() for e in config.split(','))):
+        device_id, _, puerto = entrada.partition('=')
+        if puerto.rpartition(':')[2].strip() in PROTOCOLOS:
+            puerto, _, protocolo = puerto.rpartition(':')
+        else:
+            protocolo = PROTOCOLO_POR_DEFECTO
+        puerto, _, baudios = puerto.partition('@')
+        registro.agregar(clase(device_id.strip(), puerto.strip() or PUERTO_SIMULADO,
+                               int(baudios) if baudios else BAUDIOS_POR_DEFECTO, ventanas,
+                               protocolo.strip(), config_deteccion, respaldo == '1'))
+    for i in range(1, simulados + 1):
+        registro.agregar(clase(f'sim{i:02d}', PUERTO_SIMULADO, ventanas=ventanas, config_deteccion=config_deteccion))
+    if not len(registro):
+        registro.agregar(clase('principal', 'COM7', ventanas=ventanas, config_deteccion=config_deteccion,
+                               respaldo_simulado=respaldo != '0'))
+    return registro
+
+
+# ============================================
+# VISTA AGREGADA (peor caso de todas las placas)
+# ============================================
+ORDEN_NIVELES = {'bajo': 0, 'normal': 1, 'alto': 2, 'peligro': 3}
+
+
+def lectura_agregada(dispositivos):
+    """Peor caso de todas las placas: máximos, nivel más alto y alerta si alguna la tiene"""
+    lecturas = [d.instantanea.lectura for d in dispositivos]
+    if len(lecturas) == 1:
+        return dict(lecturas[0])
+    # La hora 'HH:MM:SS' no se compara tras medianoche: manda la lectura con el ts más reciente
+    reciente = max(lecturas, key=lambda l: float('-inf') if l.get('ts') is None else l['ts'])
+    return {
+        'dispositivo': '*',
+        'temperatura': max(l['temperatura'] for l in lecturas),
+        'humo': max(l['humo'] for l in lecturas),
+        'humedad': max((l['humedad'] for l in lecturas if l.get('humedad') is not None), default=None),
+        'nivel_temperatura': max((l['nivel_temperatura'] for l in lecturas), key=ORDEN_NIVELES.__getitem__),
+        'nivel_humo': max((l['nivel_humo'] for l in lecturas), key=ORDEN_NIVELES.__getitem__),
+        'alerta': any(l['alerta'] for l in lecturas),
+        'timestamp': reciente['timestamp'],
+        'ts': reciente.get('ts'),
+        # Basta una placa sin muestras recientes para que el peor caso no esté al día
+        'obsoleta': any(l.get('obsoleta', False) for l in lecturas),
+        'dispositivos_en_alerta': [l['dispositivo'] for l in lecturas if l['alerta']],
+        'dispositivos_obsoletos': [l['dispositivo'] for l in lecturas if l.get('obsoleta', False)],
+    }
+
+
+class PublicadorAgregado:
+    """Instantánea de la vista agregada ('*'), reconstruida a partir de las de cada placa"""
+
+    def __init__(self, registro):
+        self.registro = registro
+        self.version = 0
+        self.instantanea = None
+        self._lock = threading.Lock()
+        self.publicar()
+
+    def publicar(self):
+        dispositivos = self.registro.todos()
+        if len(dispositivos) == 1:
+            # Con una sola placa la vista agregada es la de esa placa
+            self.instantanea = dispositivos[0].instantanea
+            return self.instantanea
+        temperatura, humo = historico_combinado(d.instantanea for d in dispositivos)
+        lectura = lectura_agregada(dispositivos)
+        with self._lock:
+            self.version += 1
+            self.instantanea = Instantanea('*', self.version, lectura, temperatura, humo)
+        return self.instantanea
@@ -0,0 +1,357 @@
+"""Estadísticas en streaming por placa: media/varianza (Welford), mín/máx deslizantes, EWMA y tasa de cambio.
+
+El hilo lector llama a `agregar()` con cada muestra (O(1) amortizado). Las muestras
+se agrupan en cubetas de un segundo guardadas en un anillo de arrays; cuando se
+cierra un segundo se actualizan todas las ventanas y se publica un `Resumen`
+inmutable. /estadisticas solo lee esa referencia: su coste no depende ni del
+número ni de la longitud de las ventanas.
+"""
+import json
+import math
+import os
+import threading
+from array import array
+from collections import deque
+
+import instantaneas
+
+# Ventanas deslizantes en segundos (1 min, 15 min, 1 h)
+VENTANAS_POR_DEFECTO = (60, 900, 3600)
+# Constante de tiempo de la media móvil exponencial
+TAU_EWMA_S = 30.0
+VARIABLES = ('temperatura', 'humo')
+CLAVES_LEGADO = ('temp_promedio', 'temp_max', 'temp_min', 'humo_promedio', 'humo_max', 'humo_min',
+                 'total_alertas', 'lecturas_realizadas')
+
+
+def ventanas_configuradas(valor=None):
+    """Longitudes de ventana desde ESTADISTICAS_VENTANAS="60,900,3600" (segundos)"""
+    valor = os.environ.get('ESTADISTICAS_VENTANAS', '') if valor is None else valor
+    ventanas = sorted({int(v) for v in valor.split(',') if v.strip()})
+    if any(v <= 0 for v in ventanas):
+        raise ValueError(f"Ventanas de estadísticas inválidas: {valor!r}")
+    return tuple(ventanas) or VENTANAS_POR_DEFECTO
+
+
+def etiqueta(segundos):
+    """60 -> '1m', 3600 -> '1h', 90 -> '90s'"""
+    if segundos % 3600 == 0:
+        return f'{segundos // 3600}h'
+    if segundos % 60 == 0:
+        return f'{segundos // 60}m'
+    return f'{segundos}s'
+
+
+def _combinar(n_a, media_a, m2_a, n_b, media_b, m2_b):
+    """Fusión de dos acumuladores de Welford (Chan et al.)"""
+    n = n_a + n_b
+    if not n:
+        return 0, 0.0, 0.0
+    delta = media_b - media_a
+    media = media_a + delta * n_b / n
+    return n, media, m2_a + m2_b + delta * delta * n_a * n_b / n
+
+
+def _separar(n, media, m2, n_b, media_b, m2_b):
+    """Inversa de `_combinar`: retira la parte b del total"""
+    n_a = n - n_b
+    if n_a <= 0:
+        return 0, 0.0, 0.0
+    media_a = (n * media - n_b * media_b) / n_a
+    delta = media_b - media_a
+    return n_a, media_a, max(0.0, m2 - m2_b - delta * delta * n_a * n_b / n)
+
+
+# ============================================
+# VENTANA DESLIZANTE SOBRE CUBETAS DE 1 s
+# ============================================
+class Ventana:
+    """Acumulados de las cubetas de los últimos `longitud` segundos.
+
+    Media/varianza por fusión de Welford, mín/máx con colas monótonas y tasa de
+    cambio por mínimos cuadrados (sumas ponderadas por muestras, t relativo a
+    `origen`). Cada `longitud` cubetas retiradas se recalcula todo desde el
+    anillo para no arrastrar error de redondeo (sigue siendo O(1) amortizado).
+    """
+
+    __slots__ = ('longitud', 'inicio', 'n', 'media', 'm2', 'origen', 'st', 'stt', 'sy', 'sty',
+                 'minimos', 'maximos', '_retiradas')
+
+    def __init__(self, longitud):
+        self.longitud = longitud
+        self.inicio = 0  # índice global de la cubeta más antigua incluida
+        self.n, self.media, self.m2 = 0, 0.0, 0.0
+        self.origen = None
+        self.st = self.stt = self.sy = self.sty = 0.0
+        self.minimos = deque()
+        self.maximos = deque()
+        self._retiradas = 0
+
+    def _sumar_regresion(self, serie, k, signo):
+        n = serie.n[k] * signo
+        t = serie.segundo[k] - self.origen
+        y = serie.media[k]
+        self.st += n * t
+        self.stt += n * t * t
+        self.sy += n * y
+        self.sty += n * t * y
+
+    def avanzar(self, serie, j):
+        """Incorpora la cubeta j (recién cerrada) y retira las que salen de la ventana"""
+        cap = serie.capacidad
+        i = j % cap
+        if self.origen is None:
+            self.origen = serie.segundo[i]
+        self.n, self.media, self.m2 = _combinar(self.n, self.media, self.m2,
+                                                serie.n[i], serie.media[i], serie.m2[i])
+        self._sumar_regresion(serie, i, 1)
+
+        # Colas monótonas de índices globales: el frente es el mínimo/máximo de la ventana
+        minimo, maximo = serie.minimo, serie.maximo
+        while self.minimos and minimo[self.minimos[-1] % cap] >= minimo[i]:
+            self.minimos.pop()
+        self.minimos.append(j)
+        while self.maximos and maximo[self.maximos[-1] % cap] <= maximo[i]:
+            self.maximos.pop()
+        self.maximos.append(j)
+
+        limite = serie.segundo[i] - self.longitud
+        while serie.segundo[self.inicio % cap] <= limite:
+            k = self.inicio % cap
+            self.n, self.media, self.m2 = _separar(self.n, self.media, self.m2,
+                                                   serie.n[k], serie.media[k], serie.m2[k])
+            self._sumar_regresion(serie, k, -1)
+            self.inicio += 1
+            self._retiradas += 1
+        while self.minimos[0] < self.inicio:
+            self.minimos.popleft()
+        while self.maximos[0] < self.inicio:
+            self.maximos.popleft()
+
+        if self._retiradas >= self.longitud:
+            self._recalcular(serie, j)
+
+    def _recalcular(self, serie, j):
+        self.n, self.media, self.m2 = 0, 0.0, 0.0
+        self.st = self.stt = self.sy = self.sty = 0.0
+        self.origen = serie.segundo[self.inicio % serie.capacidad]
+        for g in range(self.inicio, j + 1):
+            k = g % serie.capacidad
+            self.n, self.media, self.m2 = _combinar(self.n, self.media, self.m2,
+                                                    serie.n[k], serie.media[k], serie.m2[k])
+            self._sumar_regresion(serie, k, 1)
+        self._retiradas = 0
+
+    def resumen(self, serie):
+        """(n, media, m2, mínimo, máximo, tasa por minuto) de la ventana"""
+        if not self.n:
+            return (0, 0.0, 0.0, 0.0, 0.0, None)
+        denominador = self.n * self.stt - self.st * self.st
+        tasa = None
+        if denominador > 1e-9 * max(1.0, self.n * self.stt):
+            tasa = 60 * (self.n * self.sty - self.st * self.sy) / denominador
+        return (self.n, self.media, self.m2,
+                serie.minimo[self.minimos[0] % serie.capacidad],
+                serie.maximo[self.maximos[0] % serie.capacidad], tasa)
+
+
+class SerieEstadistica:
+    """Una variable de una placa: cubeta del segundo en curso, anillo de cubetas cerradas y ventanas"""
+
+    def __init__(self, ventanas, tau_ewma=TAU_EWMA_S):
+        # A lo sumo una cubeta por segundo: el anillo cubre la ventana más larga
+        self.capacidad = max(ventanas) + 1
+        ceros = bytes(8 * self.capacidad)
+        self.segundo = array('d', ceros)
+        self.n = array('d', ceros)
+        self.media = array('d', ceros)
+        self.m2 = array('d', ceros)
+        self.minimo = array('d', ceros)
+        self.maximo = array('d', ceros)
+        self.total = 0
+        self.ventanas = [Ventana(v) for v in ventanas]
+        self.tau_ewma = tau_ewma
+        self.ewma = None
+        self._t_ewma = None
+        self._segundo_actual = None
+        self._n = 0
+        self._media = self._m2 = 0.0
+        self._min = self._max = 0.0
+
+    def agregar(self, ts, valor):
+        """Añade una muestra; devuelve True si con ello se cerró un segundo"""
+        segundo = int(ts)
+        cerrado = False
+        if segundo != self._segundo_actual:
+            if self._n:
+                self._cerrar()
+                cerrado = True
+            self._segundo_actual = segundo
+            self._n, self._media, self._m2 = 0, 0.0, 0.0
+            self._min = self._max = valor
+        # Welford de la cubeta en curso
+        self._n += 1
+        delta = valor - self._media
+        self._media += delta / self._n
+        self._m2 += delta * (valor - self._media)
+        if valor < self._min:
+            self._min = valor
+        elif valor > self._max:
+            self._max = valor
+        # EWMA con constante de tiempo fija (independiente de la frecuencia de muestreo)
+        if self.ewma is None:
+            self.ewma = valor
+        else:
+            alfa = 1 - math.exp(-max(0.0, ts - self._t_ewma) / self.tau_ewma)
+            self.ewma += alfa * (valor - self.ewma)
+        self._t_ewma = ts
+        return cerrado
+
+    def _cerrar(self):
+        j = self.total
+        k = j % self.capacidad
+        self.segundo[k] = self._segundo_actual
+        self.n[k] = self._n
+        self.media[k] = self._media
+        self.m2[k] = self._m2
+        self.minimo[k] = self._min
+        self.maximo[k] = self._max
+        self.total += 1
+        for ventana in self.ventanas:
+            ventana.avanzar(self, j)
+
+    def resumen(self):
+        return {v.longitud: v.resumen(self) for v in self.ventanas}
+
+
+# ============================================
+# RESUMEN PUBLICADO
+# ============================================
+def _ventana_json(acumulado):
+    n, media, m2, minimo, maximo, tasa = acumulado
+    return {
+        'n': int(n), 'media': media, 'desviacion': math.sqrt(m2 / (n - 1)) if n > 1 else 0.0,
+        'min': minimo, 'max': maximo, 'tasa_por_min': tasa,
+    }
+
+
+class Resumen:
+    """Estadísticas congeladas de una versión; el JSON se codifica una vez por total de alertas"""
+
+    __slots__ = ('clave', 'version', 'ventanas', 'ewma', '_json')
+
+    def __init__(self, clave, version, ventanas, ewma):
+        self.clave = clave
+        self.version = version
+        # {longitud: {'temperatura': acumulado, 'humo': acumulado}}
+        self.ventanas = ventanas
+        self.ewma = ewma
+        self._json = None
+
+    @property
+    def etag(self):
+        return f'{instantaneas.ARRANQUE}-est-{self.clave}-{self.version}'
+
+    def legado(self, total_alertas):
+        """Claves históricas de /estadisticas, calculadas sobre la ventana más corta"""
+        if not self.ventanas:
+            return dict.fromkeys(CLAVES_LEGADO, 0)
+        corta = self.ventanas[min(self.ventanas)]
+        n_t, media_t, _, min_t, max_t, _ = corta['temperatura']
+        n_h, media_h, _, min_h, max_h, _ = corta['humo']
+        if not n_t:
+            return dict.fromkeys(CLAVES_LEGADO, 0)
+        return {
+            'temp_promedio': media_t, 'temp_max': max_t, 'temp_min': min_t,
+            'humo_promedio': media_h, 'humo_max': max_h, 'humo_min': min_h,
+            'total_alertas': total_alertas, 'lecturas_realizadas': int(n_t)
+        }
+
+    def json(self, total_alertas, obsoletos=()):
+        """`obsoletos`: placas del resumen sin muestras recientes (supervisor.py)"""
+        clave = (total_alertas, tuple(obsoletos))
+        cache = self._json
+        if cache is None or cache[0] != clave:
+            cuerpo = self.legado(total_alertas)
+            cuerpo['obsoleta'] = bool(clave[1])
+            cuerpo['dispositivos_obsoletos'] = list(clave[1])
+            cuerpo['ventanas'] = {
+                etiqueta(longitud): {var: _ventana_json(acumulado[var]) for var in VARIABLES}
+                for longitud, acumulado in sorted(self.ventanas.items())
+            }
+            cuerpo['ewma'] = self.ewma
+            cache = (clave, json.dumps(cuerpo, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+            self._json = cache
+        return cache[1]
+
+
+class EstadisticasDispositivo:
+    """Motor de una placa. Un único escritor (su hilo lector); los lectores solo ven `resumen`"""
+
+    def __init__(self, device_id, ventanas=VENTANAS_POR_DEFECTO, tau_ewma=TAU_EWMA_S):
+        self.device_id = device_id
+        self.series = {var: SerieEstadistica(ventanas, tau_ewma) for var in VARIABLES}
+        self.version = 0
+        self.resumen = Resumen(device_id, 0, {v: {var: (0, 0.0, 0.0, 0.0, 0.0, None) for var in VARIABLES}
+                                              for v in ventanas}, dict.fromkeys(VARIABLES))
+
+    def agregar(self, ts, temperatura, humo):
+        """Muestra con ts monotónico en segundos; publica un resumen nuevo al cerrar cada segundo"""
+        cerrado = self.series['temperatura'].agregar(ts, temperatura)
+        cerrado = self.series['humo'].agregar(ts, humo) or cerrado
+        if cerrado:
+            self.publicar()
+
+    def publicar(self):
+        por_variable = {var: serie.resumen() for var, serie in self.series.items()}
+        ventanas = {v: {var: por_variable[var][v] for var in VARIABLES}
+                    for v in por_variable['temperatura']}
+        self.version += 1
+        self.resumen = Resumen(self.device_id, self.version, ventanas,
+                               {var: serie.ewma for var, serie in self.series.items()})
+
+
+# ============================================
+# VISTA AGREGADA
+# ============================================
+def _fusionar(acumulados):
+    n, media, m2 = 0, 0.0, 0.0
+    minimo, maximo, tasa = math.inf, -math.inf, None
+    for a_n, a_media, a_m2, a_min, a_max, a_tasa in acumulados:
+        if not a_n:
+            continue
+        n, media, m2 = _combinar(n, media, m2, a_n, a_media, a_m2)
+        minimo, maximo = min(minimo, a_min), max(maximo, a_max)
+        # La peor subida entre placas (igual que la lectura agregada)
+        if a_tasa is not None and (tasa is None or a_tasa > tasa):
+            tasa = a_tasa
+    if not n:
+        return (0, 0.0, 0.0, 0.0, 0.0, None)
+    return (n, media, m2, minimo, maximo, tasa)
+
+
+class EstadisticasAgregadas:
+    """Resumen '*' fusionado a partir de los de cada placa; se rehace solo si alguno cambió"""
+
+    def __init__(self):
+        self.version = 0
+        # (versiones de las placas, resumen fusionado): se reemplaza de una vez
+        self._cache = (None, None)
+        self._lock = threading.Lock()
+
+    def obtener(self, motores):
+        resumenes = [m.resumen for m in motores]
+        if len(resumenes) == 1:
+            return resumenes[0]
+        clave = tuple(r.version for r in resumenes)
+        if self._cache[0] == clave:
+            return self._cache[1]
+        with self._lock:
+            if self._cache[0] != clave:
+                ventanas = {v: {var: _fusionar(r.ventanas[v][var] for r in resumenes) for var in VARIABLES}
+                            for v in resumenes[0].ventanas}
+                ewma = {var: max((r.ewma[var] for r in resumenes if r.ewma[var] is not None), default=None)
+                        for var in VARIABLES}
+                self.version += 1
+                self._cache = (clave, Resumen('*', self.version, ventanas, ewma))
+        return self._cache[1]
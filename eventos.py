@@ -0,0 +1,126 @@
+"""Bus de eventos en memoria para empujar lecturas y alertas por Server-Sent Events (y WebSocket)."""
+import json
+import queue
+import threading
+
+# Segundos sin eventos tras los que se envía un comentario de latido
+INTERVALO_LATIDO = 15
+# Eventos pendientes por cliente antes de considerarlo lento y desconectarlo
+MAX_PENDIENTES = 256
+
+LATIDO = b': ping\n\n'
+# Canal de la vista agregada (todas las placas)
+CANAL_AGREGADO = '*'
+
+
+def serializar_evento(tipo, datos):
+    """Codifica un evento SSE una única vez (se comparte entre todos los clientes)"""
+    payload = json.dumps(datos, separators=(',', ':'), ensure_ascii=False)
+    return f'event: {tipo}\ndata: {payload}\n\n'.encode('utf-8')
+
+
+class BusEventos:
+    """Reparte eventos ya serializados a los suscriptores de cada canal (device_id o '*')"""
+
+    def __init__(self, max_pendientes=MAX_PENDIENTES, al_publicar=None):
+        self.max_pendientes = max_pendientes
+        # Observador de todo lo publicado (la réplica a otros procesos en modo multiproceso)
+        self.al_publicar = al_publicar
+        # Formato de suscripción -> serializador (tipo, datos) -> bytes
+        self.formatos = {'sse': serializar_evento}
+        # cola -> (canal, formato)
+        self._suscriptores = {}
+        self._lock = threading.Lock()
+
+    def publicar(self, tipo, datos, canales=(CANAL_AGREGADO,)):
+        if self.al_publicar is not None:
+            self.al_publicar(tipo, datos, canales)
+        with self._lock:
+            suscriptores = [(cola, formato) for cola, (canal, formato) in self._suscriptores.items()
+                            if canal in canales]
+        if not suscriptores:
+            return
+        # Una serialización por formato, compartida por todos sus clientes
+        serializados = {}
+        for cola, formato in suscriptores:
+            evento = serializados.get(formato)
+            if evento is None:
+                evento = serializados[formato] = self.formatos[formato](tipo, datos)
+            try:
+                cola.put_nowait(evento)
+            except queue.Full:
+                # Cliente lento: se le corta y el navegador reconecta solo
+                self.cortar(cola)
+
+    def total_suscriptores(self, formato=None):
+        with self._lock:
+            if formato is None:
+                return len(self._suscriptores)
+            return sum(1 for _, f in self._suscriptores.values() if f == formato)
+
+    def suscribir(self, canal, formato='sse'):
+        cola = queue.Queue(maxsize=self.max_pendientes)
+        with self._lock:
+            self._suscriptores[cola] = (canal, formato)
+        return cola
+
+    def cambiar_canal(self, cola, canal):
+        """Mueve una suscripción a otro canal; False si ya no existe"""
+        with self._lock:
+            if cola not in self._suscriptores:
+                return False
+            self._suscriptores[cola] = (canal, self._suscriptores[cola][1])
+            return True
+
+    def desuscribir(self, cola):
+        with self._lock:
+            self._suscriptores.pop(cola, None)
+
+    def cortar(self, cola):
+        """Desuscribe y deja la marca de fin (None) para quien vacía la cola"""
+        self.desuscribir(cola)
+        self._cortar(cola)
+
+    @staticmethod
+    def _cortar(cola):
+        # Hace hueco para la marca de fin aunque la cola esté llena
+        try:
+            cola.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            cola.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def escuchar(self, canal=CANAL_AGREGADO, inicial=None, latido=INTERVALO_LATIDO):
+        """Suscribe en el acto y devuelve el generador de la respuesta HTTP.
+
+        `inicial()` da los eventos ya serializados del estado actual; se llama tras
+        suscribir, así lo publicado mientras se toma ese estado queda en la cola.
+        """
+        cola = self.suscribir(canal)
+        try:
+            eventos = list(inicial()) if inicial is not None else []
+        except BaseException:
+            self.desuscribir(cola)
+            raise
+        return self._emitir(cola, eventos, latido)
+
+    def _emitir(self, cola, inicial, latido):
+        """Eventos iniciales, deltas y latidos (si nunca se itera, el primer desborde la corta)"""
+        try:
+            yield b'retry: 3000\n\n'
+            for evento in inicial:
+                yield evento
+            while True:
+                try:
+                    evento = cola.get(timeout=latido)
+                except queue.Empty:
+                    yield LATIDO
+                    continue
+                if evento is None:
+                    return
+                yield evento
+        finally:
+            self.desuscribir(cola)
@@ -0,0 +1,383 @@
+"""Exportación en streaming (CSV o Parquet, con gzip opcional) y archivado de datos antiguos.
+
+Exportar: las filas salen de SQLite con fetchmany y se codifican por lotes;
+la memoria no depende del rango pedido y la respuesta va troceada (chunked).
+
+Archivar: las lecturas y notificaciones con más de DIAS_RETENCION días se
+mueven a ficheros CSV comprimidos, uno por tabla y día:
+
+    archivo/lecturas/2025/03/2025-03-14.csv.gz
+
+El catálogo `archivos` dice qué día de qué tabla está en qué fichero; la
+exportación lo usa para seguir sirviendo rangos que ya no están en la base.
+Los agregados por minuto/hora y el histórico de alertas no se archivan.
+"""
+import csv
+import gzip
+import io
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import metricas
+
+# Filas por fetchmany / lote codificado
+TAM_LOTE = 5000
+# Días que se conservan en la base (0 desactiva el archivado)
+DIAS_RETENCION = int(os.environ.get('RETENCION_DIAS', '90'))
+DIRECTORIO_ARCHIVO = os.environ.get('DIRECTORIO_ARCHIVO', 'archivo')
+# Cada cuánto busca el archivador días vencidos (segundos)
+INTERVALO_ARCHIVADO_S = 3600
+# Rango por defecto de /export/lecturas sin ?desde= (segundos)
+RANGO_POR_DEFECTO_S = 24 * 3600
+
+FORMATOS = ('csv', 'parquet')
+TIPOS_CONTENIDO = {'csv': 'text/csv; charset=utf-8', 'parquet': 'application/vnd.apache.parquet'}
+
+FILAS_ARCHIVADAS = metricas.contador('archivo_filas_total', 'Filas movidas de la base a ficheros de archivo',
+                                     ('tabla',))
+
+# Columnas exportadas (y de los ficheros de archivo) por tabla
+COLUMNAS = {
+    'lecturas': ('ts', 'dispositivo', 'temperatura', 'humo'),
+    'notificaciones': ('id', 'fecha', 'usuario_id', 'email', 'alerta_id', 'tipo', 'temperatura', 'humo', 'enviado'),
+}
+# Tipos Parquet (nombres de pyarrow) en el mismo orden
+TIPOS_PARQUET = {
+    'lecturas': ('float64', 'string', 'float64', 'float64'),
+    'notificaciones': ('int64', 'string', 'int64', 'string', 'string', 'string', 'float64', 'float64', 'int64'),
+}
+
+_SQL_LECTURAS = 'SELECT ts, dispositivo, temperatura, humo FROM lecturas WHERE ts >= ? AND ts < ?'
+# La fecha de notificaciones es CURRENT_TIMESTAMP de SQLite: texto UTC 'AAAA-MM-DD HH:MM:SS'
+_SQL_NOTIFICACIONES = '''SELECT n.id, n.fecha, n.usuario_id, u.email, n.alerta_id,
+                                COALESCE(a.tipo, n.tipo), COALESCE(a.temperatura, n.temperatura),
+                                COALESCE(a.humo, n.humo), n.enviado
+                         FROM notificaciones n
+                         LEFT JOIN alertas a ON a.alerta_id = n.alerta_id
+                         LEFT JOIN usuarios u ON u.id = n.usuario_id
+                         WHERE n.fecha >= ? AND n.fecha < ?'''
+
+
+class FormatoNoDisponible(Exception):
+    pass
+
+
+def crear_tablas(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS archivos
+              (id INTEGER PRIMARY KEY AUTOINCREMENT,
+               tabla TEXT NOT NULL,
+               dia TEXT NOT NULL,
+               ruta TEXT NOT NULL,
+               filas INTEGER NOT NULL,
+               creado REAL NOT NULL)''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_archivos_tabla_dia ON archivos(tabla, dia)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_notificaciones_fecha ON notificaciones(fecha)')
+
+
+def fecha_sql(instante):
+    """Epoch -> texto UTC comparable con las columnas CURRENT_TIMESTAMP"""
+    return datetime.fromtimestamp(instante, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def dia_utc(instante):
+    return datetime.fromtimestamp(instante, timezone.utc).strftime('%Y-%m-%d')
+
+
+def limites_dia(dia):
+    inicio = datetime.strptime(dia, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    return inicio.timestamp(), (inicio + timedelta(days=1)).timestamp()
+
+
+# ============================================
+# LECTURA POR LOTES (BASE + ARCHIVO)
+# ============================================
+def _lotes_sql(pool, sql, parametros):
+    """Lotes de filas de una consulta; la conexión vuelve al pool al terminar o si el cliente corta"""
+    with pool.conexion() as conn:
+        cursor = conn.execute(sql, parametros)
+        while True:
+            filas = cursor.fetchmany(TAM_LOTE)
+            if not filas:
+                return
+            yield filas
+
+
+def _lotes_archivo(ruta, conversiones, filtro):
+    with gzip.open(ruta, 'rt', encoding='utf-8', newline='') as f:
+        lector = csv.reader(f)
+        next(lector, None)
+        lote = []
+        for fila in lector:
+            fila = tuple(None if v == '' else convertir(v) for convertir, v in zip(conversiones, fila))
+            if filtro(fila):
+                lote.append(fila)
+                if len(lote) >= TAM_LOTE:
+                    yield lote
+                    lote = []
+        if lote:
+            yield lote
+
+
+def _archivados(pool, tabla, dia_desde, dia_hasta):
+    with pool.conexion() as conn:
+        return [r[0] for r in conn.execute('''SELECT ruta FROM archivos WHERE tabla = ? AND dia >= ? AND dia <= ?
+                                              ORDER BY dia, id''', (tabla, dia_desde, dia_hasta))]
+
+
+def lotes_lecturas(pool, desde, hasta, dispositivo=None, directorio=DIRECTORIO_ARCHIVO):
+    """Lecturas de [desde, hasta): primero los días archivados, después la base (ya no los contiene)"""
+    def filtro(fila):
+        return desde <= fila[0] < hasta and (dispositivo is None or fila[1] == dispositivo)
+
+    for ruta in _archivados(pool, 'lecturas', dia_utc(desde), dia_utc(hasta)):
+        yield from _lotes_archivo(os.path.join(directorio, ruta), (float, str, float, float), filtro)
+    sql, parametros = _SQL_LECTURAS, [desde, hasta]
+    if dispositivo is not None:
+        sql += ' AND dispositivo = ?'
+        parametros.append(dispositivo)
+    yield from _lotes_sql(pool, sql + ' ORDER BY ts', parametros)
+
+
+def lotes_notificaciones(pool, desde, hasta, directorio=DIRECTORIO_ARCHIVO):
+    desde_sql, hasta_sql = fecha_sql(desde), fecha_sql(hasta)
+
+    def filtro(fila):
+        return desde_sql <= fila[1] < hasta_sql
+
+    for ruta in _archivados(pool, 'notificaciones', dia_utc(desde), dia_utc(hasta)):
+        yield from _lotes_archivo(os.path.join(directorio, ruta),
+                                  (int, str, int, str, str, str, float, float, int), filtro)
+    yield from _lotes_sql(pool, _SQL_NOTIFICACIONES + ' ORDER BY n.fecha, n.id', (desde_sql, hasta_sql))
+
+
+# ============================================
+# CODIFICACIÓN EN STREAMING
+# ============================================
+def codificar_csv(columnas, lotes):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, lineterminator='\n')
+    escritor.writerow(columnas)
+    for lote in lotes:
+        escritor.writerows(lote)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _Sumidero:
+    """Fichero en memoria que se vacía tras cada grupo de filas, para entregarlo mientras se escribe"""
+
+    closed = False
+
+    def __init__(self):
+        self.partes = []
+        self.posicion = 0
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def vaciar(self):
+        datos, self.partes = b''.join(self.partes), []
+        return datos
+
+
+def comprobar_rango(desde, hasta):
+    """Valida el rango antes de empezar a responder: instantes finitos, representables y desde < hasta"""
+    for nombre, instante in (('desde', desde), ('hasta', hasta)):
+        try:
+            dia_utc(instante)
+        except (OverflowError, OSError, ValueError):
+            raise ValueError(f"{nombre} fuera del rango de fechas admitido: {instante}") from None
+    if not desde < hasta:
+        raise ValueError(f"desde ({desde}) debe ser anterior a hasta ({hasta})")
+
+
+def comprobar_formato(formato):
+    """Valida el formato antes de empezar a responder (un error a mitad de stream no se puede devolver)"""
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato desconocido: {formato} (opciones: {', '.join(FORMATOS)})")
+    if formato == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise FormatoNoDisponible("La exportación Parquet necesita pyarrow: pip install pyarrow") from None
+
+
+def codificar_parquet(tabla, lotes):
+    """Un grupo de filas Parquet por lote; cada grupo se entrega en cuanto está escrito"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columnas = COLUMNAS[tabla]
+    esquema = pa.schema([(c, getattr(pa, t)()) for c, t in zip(columnas, TIPOS_PARQUET[tabla])])
+    sumidero = _Sumidero()
+    escritor = pq.ParquetWriter(sumidero, esquema, compression='zstd')
+    try:
+        for lote in lotes:
+            escritor.write_table(pa.Table.from_arrays([pa.array(col, type=esquema.field(i).type)
+                                                       for i, col in enumerate(zip(*lote))], schema=esquema))
+            datos = sumidero.vaciar()
+            if datos:
+                yield datos
+    finally:
+        escritor.close()
+    yield sumidero.vaciar()
+
+
+def comprimir(trozos):
+    """gzip en streaming: un compresor para toda la respuesta, sin acumularla"""
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for trozo in trozos:
+        datos = compresor.compress(trozo)
+        if datos:
+            yield datos
+    yield compresor.flush()
+
+
+def exportar(tabla, lotes, formato='csv', gzip_=False):
+    """Generador de bytes de la respuesta (formato ya validado con comprobar_formato)"""
+    trozos = codificar_parquet(tabla, lotes) if formato == 'parquet' else codificar_csv(COLUMNAS[tabla], lotes)
+    return comprimir(trozos) if gzip_ else trozos
+
+
+# ============================================
+# ARCHIVADO (RETENCIÓN)
+# ============================================
+class Archivador:
+    """Hilo que mueve a ficheros .csv.gz los días completos más antiguos que la retención.
+
+    Cada día se escribe a un .tmp (los días vencidos ya no reciben filas, se leen
+    sin bloquear al escritor); después, en una transacción corta, se borran sus
+    filas y se anota en el catálogo, y por último se renombra el fichero. Un .tmp
+    que sobrevive a una caída se publica si su día quedó en el catálogo y se
+    descarta si no.
+    """
+
+    TABLAS = ('lecturas', 'notificaciones')
+
+    def __init__(self, pool, directorio=DIRECTORIO_ARCHIVO, dias=DIAS_RETENCION, intervalo=INTERVALO_ARCHIVADO_S):
+        self.pool = pool
+        self.directorio = directorio
+        self.dias = dias
+        self.intervalo = intervalo
+        self.archivadas = 0
+
+    def iniciar(self):
+        if self.dias <= 0:
+            return
+        threading.Thread(target=self._bucle, name='archivador', daemon=True).start()
+
+    def _bucle(self):
+        self.recuperar()
+        while True:
+            try:
+                self.archivar()
+            except Exception as e:
+                print(f"❌ Error archivando datos antiguos: {e}")
+            time.sleep(self.intervalo)
+
+    def corte(self):
+        """Primer día que se conserva en la base (medianoche UTC)"""
+        return dia_utc(time.time() - self.dias * 86400)
+
+    def archivar(self):
+        total = 0
+        corte = self.corte()
+        for tabla in self.TABLAS:
+            for dia in self._dias_vencidos(tabla, corte):
+                total += self._archivar_dia(tabla, dia)
+        if total:
+            print(f"🗄️ {total} filas anteriores a {corte} movidas a {self.directorio}/")
+        return total
+
+    def recuperar(self):
+        """Publica o descarta los .tmp que dejó una parada a medias"""
+        with self.pool.conexion() as conn:
+            catalogadas = {r[0] for r in conn.execute('SELECT ruta FROM archivos')}
+        for raiz, _, ficheros in os.walk(self.directorio):
+            for nombre in ficheros:
+                if not nombre.endswith('.tmp'):
+                    continue
+                temporal = os.path.join(raiz, nombre)
+                final = temporal[:-len('.tmp')]
+                if os.path.relpath(final, self.directorio) in catalogadas:
+                    os.replace(temporal, final)
+                else:
+                    os.remove(temporal)
+
+    def _dias_vencidos(self, tabla, corte):
+        with self.pool.conexion() as conn:
+            if tabla == 'lecturas':
+                primero = conn.execute('SELECT MIN(ts) FROM lecturas').fetchone()[0]
+                primero = dia_utc(primero) if primero is not None else None
+            else:
+                primero = conn.execute('SELECT MIN(fecha) FROM notificaciones').fetchone()[0]
+                primero = primero[:10] if primero else None
+        dias = []
+        while primero is not None and primero < corte:
+            dias.append(primero)
+            primero = (datetime.strptime(primero, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        return dias
+
+    def _archivar_dia(self, tabla, dia):
+        inicio, fin = limites_dia(dia)
+        if tabla == 'lecturas':
+            lotes = _lotes_sql(self.pool, _SQL_LECTURAS + ' ORDER BY ts', (inicio, fin))
+            borrar = ('DELETE FROM lecturas WHERE ts >= ? AND ts < ?', (inicio, fin))
+        else:
+            limites = (fecha_sql(inicio), fecha_sql(fin))
+            lotes = _lotes_sql(self.pool, _SQL_NOTIFICACIONES + ' ORDER BY n.fecha, n.id', limites)
+            borrar = ('DELETE FROM notificaciones WHERE fecha >= ? AND fecha < ?', limites)
+
+        ruta = self._ruta_libre(tabla, dia)
+        final = os.path.join(self.directorio, ruta)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        filas = 0
+        with open(final + '.tmp', 'wb') as f:
+            with gzip.open(f, 'wt', encoding='utf-8', newline='') as comprimido:
+                escritor = csv.writer(comprimido, lineterminator='\n')
+                escritor.writerow(COLUMNAS[tabla])
+                for lote in lotes:
+                    filas += len(lote)
+                    escritor.writerows(lote)
+            f.flush()
+            os.fsync(f.fileno())
+        if not filas:
+            os.remove(final + '.tmp')
+            return 0
+
+        with self.pool.conexion() as conn:
+            with conn:
+                conn.execute(*borrar)
+                conn.execute('INSERT INTO archivos (tabla, dia, ruta, filas, creado) VALUES (?, ?, ?, ?, ?)',
+                             (tabla, dia, ruta, filas, time.time()))
+        os.replace(final + '.tmp', final)
+        FILAS_ARCHIVADAS.con(tabla).sumar(filas)
+        self.archivadas += filas
+        return filas
+
+    def _ruta_libre(self, tabla, dia):
+        """archivo/<tabla>/AAAA/MM/AAAA-MM-DD.csv.gz (con sufijo .2, .3... si el día ya tenía fichero)"""
+        carpeta = os.path.join(tabla, dia[:4], dia[5:7])
+        ruta = os.path.join(carpeta, f'{dia}.csv.gz')
+        n = 1
+        while os.path.exists(os.path.join(self.directorio, ruta)):
+            n += 1
+            ruta = os.path.join(carpeta, f'{dia}.{n}.csv.gz')
+        return ruta
@@ -0,0 +1,48 @@
+"""Despliegue multiproceso: gunicorn -c gunicorn.conf.py
+
+Gunicorn arranca además un único proceso de ingesta (`MODO_DESPLIEGUE=ingesta
+python app.py`) dueño de los puertos serie; los workers arrancan en modo 'web'
+y leen su estado por memoria compartida (ver compartido.py).
+Con INGESTA_EMBEBIDA=0 el proceso de ingesta se gestiona aparte (systemd, etc.).
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+
+# Los workers importan app.py en modo web: ni puertos ni hilos lectores
+os.environ['MODO_DESPLIEGUE'] = 'web'
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+# Cada cliente de /stream o /ws ocupa un hilo mientras está conectado (casi siempre
+# dormido en su cola): 600 hilos admiten los 500+ dashboards por proceso que pide /ws
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_HILOS', '600'))
+# Conexiones abiertas por worker (incluidas las keep-alive que esperan sin hilo)
+worker_connections = int(os.environ.get('GUNICORN_CONEXIONES', '1000'))
+# Sin preload: el maestro no importa app.py (no abre la base ni arranca hilos antes del fork)
+preload_app = False
+# La fábrica ejecuta los pasos de arranque de cada worker (ver ciclo_vida.py)
+wsgi_app = 'app:crear_app()'
+
+_DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+_ingesta = None
+
+
+def on_starting(server):
+    global _ingesta
+    if os.environ.get('INGESTA_EMBEBIDA', '1') != '1':
+        return
+    entorno = dict(os.environ, MODO_DESPLIEGUE='ingesta')
+    _ingesta = subprocess.Popen([sys.executable, os.path.join(_DIRECTORIO, 'app.py')], env=entorno, cwd=_DIRECTORIO)
+    server.log.info("Proceso de ingesta iniciado (pid %s)", _ingesta.pid)
+
+
+def on_exit(server):
+    if _ingesta is not None and _ingesta.poll() is None:
+        _ingesta.terminate()
+        try:
+            _ingesta.wait(10)
+        except subprocess.TimeoutExpired:
+            _ingesta.kill()
@@ -0,0 +1,137 @@
+"""Ingesta serie sin pérdidas: lectura por bloques, troceado incremental y buffer circular."""
+import time
+from array import array
+
+import metricas
+
+# Muestras que guarda el buffer circular (a 100 Hz son ~40 s)
+CAPACIDAD_BUFFER = 4096
+
+LATENCIA_LECTURA = metricas.histograma('serie_lectura_segundos', 'Tiempo dentro de read() del puerto serie por bloque',
+                                       ('dispositivo',), metricas.BUCKETS_LENTOS)
+DURACION_DECODIFICACION = metricas.histograma('serie_decodificacion_segundos',
+                                              'Tiempo de troceado y decodificación por bloque leído', ('dispositivo',))
+
+
+class BufferCircular:
+    """Buffer circular preasignado sobre arrays de doubles: nunca reserva memoria al insertar"""
+
+    def __init__(self, capacidad=CAPACIDAD_BUFFER):
+        self.capacidad = capacidad
+        self.ts = array('d', bytes(8 * capacidad))
+        self.temperatura = array('d', bytes(8 * capacidad))
+        self.humo = array('d', bytes(8 * capacidad))
+        self.total = 0
+
+    def agregar(self, ts, temperatura, humo):
+        i = self.total % self.capacidad
+        self.ts[i] = ts
+        self.temperatura[i] = temperatura
+        self.humo[i] = humo
+        self.total += 1
+
+    def __len__(self):
+        return min(self.total, self.capacidad)
+
+    def ultimas(self, n=None):
+        """Copia de las últimas n muestras (ts, temperatura, humo), la más reciente al final"""
+        n = len(self) if n is None else min(n, len(self))
+        inicio = self.total - n
+        return [(self.ts[j], self.temperatura[j], self.humo[j])
+                for j in (k % self.capacidad for k in range(inicio, self.total))]
+
+
+class ContadoresEnlace:
+    """Líneas recibidas/parseadas/malformadas: totales y tasa del último segundo completo"""
+
+    CAMPOS = ('recibidas', 'parseadas', 'malformadas')
+
+    def __init__(self):
+        self.totales = dict.fromkeys(self.CAMPOS, 0)
+        self.por_segundo = dict.fromkeys(self.CAMPOS, 0)
+        self._actual = dict.fromkeys(self.CAMPOS, 0)
+        self._segundo = int(time.monotonic())
+
+    def sumar(self, recibidas, parseadas, malformadas, ahora):
+        segundo = int(ahora)
+        if segundo != self._segundo:
+            # Si pasó más de un segundo sin datos, la tasa del último segundo es 0
+            self.por_segundo = self._actual if segundo == self._segundo + 1 else dict.fromkeys(self.CAMPOS, 0)
+            self._actual = dict.fromkeys(self.CAMPOS, 0)
+            self._segundo = segundo
+        for campo, n in zip(self.CAMPOS, (recibidas, parseadas, malformadas)):
+            self._actual[campo] += n
+            self.totales[campo] += n
+
+    def resumen(self):
+        if int(time.monotonic()) > self._segundo + 1:
+            por_segundo = dict.fromkeys(self.CAMPOS, 0)
+        else:
+            por_segundo = self.por_segundo
+        return {'totales': dict(self.totales), 'por_segundo': dict(por_segundo)}
+
+
+class LectorSerial:
+    """Vacía el puerto en bloques `read(in_waiting)` y trocea el flujo de forma incremental.
+
+    A diferencia de `reset_input_buffer()` + `readline()`, no descarta nada de lo
+    que el Arduino envió entre dos lecturas. El troceado (líneas de texto o
+    tramas binarias) lo hace el decodificador de `protocolo`.
+    """
+
+    def __init__(self, puerto, decodificador, dispositivo=''):
+        self.puerto = puerto
+        self.decodificador = decodificador
+        self.contadores = ContadoresEnlace()
+        self._m_lectura = LATENCIA_LECTURA.con(dispositivo)
+        self._m_decodificacion = DURACION_DECODIFICACION.con(dispositivo)
+        self._pendiente = bytearray()
+        # Callback para los ecos 'ACK:<byte>' del firmware (canal de comandos)
+        self.al_confirmar = None
+        # Los dispositivos simulados solo exponen readline()
+        self._por_bloques = hasattr(puerto, 'in_waiting') and hasattr(puerto, 'read')
+
+    def cambiar_puerto(self, puerto):
+        """Tras una reconexión: sigue con el puerto nuevo conservando contadores y decodificador"""
+        self.puerto = puerto
+        self._pendiente = bytearray()
+        self._por_bloques = hasattr(puerto, 'in_waiting') and hasattr(puerto, 'read')
+
+    def _leer_bloque(self):
+        if not self._por_bloques:
+            return self.puerto.readline()
+        n = self.puerto.in_waiting
+        if n:
+            return self.puerto.read(n)
+        # Nada en espera: read(1) bloquea como mucho el timeout del puerto (sin busy-wait)
+        bloque = self.puerto.read(1)
+        n = self.puerto.in_waiting if bloque else 0
+        return bloque + self.puerto.read(n) if n else bloque
+
+    def leer_muestras(self):
+        """Devuelve la lista de (ts_monotonico, temperatura, humo, humedad) completadas en este bloque"""
+        inicio = time.perf_counter()
+        bloque = self._leer_bloque()
+        self._m_lectura.desde(inicio)
+        ahora = time.monotonic()
+        if not bloque:
+            self.contadores.sumar(0, 0, 0, ahora)
+            return []
+
+        self._pendiente += bloque
+        if not self._por_bloques and not self.decodificador.binario and not self._pendiente.endswith(b'\n'):
+            self._pendiente += b'\n'
+        inicio = time.perf_counter()
+        valores, resto, recibidas, malformadas = self.decodificador.extraer(self._pendiente)
+        self._m_decodificacion.desde(inicio)
+        self._pendiente = bytearray(resto)
+        confirmaciones = self.decodificador.confirmaciones
+        if confirmaciones:
+            if self.al_confirmar is not None:
+                for datos in confirmaciones:
+                    self.al_confirmar(datos)
+            confirmaciones.clear()
+
+        muestras = [(ahora, temp, humo, humedad) for temp, humo, humedad in valores]
+        self.contadores.sumar(recibidas, len(muestras), malformadas, ahora)
+        return muestras
@@ -0,0 +1,77 @@
+"""Instantáneas inmutables del estado de lectura, publicadas por intercambio de referencia.
+
+El hilo lector construye una `Instantanea` nueva tras cada muestra y la asigna
+de una vez (`d.instantanea = ...`). Las rutas HTTP solo leen esa referencia:
+nunca toman el lock del dispositivo ni vuelven a serializar si ya se hizo.
+"""
+import json
+import os
+
+# Distingue ETags de distintos arranques (las versiones vuelven a empezar en 0).
+# Los procesos web del modo multiproceso adoptan el del proceso de ingesta.
+ARRANQUE = os.urandom(4).hex()
+
+
+def fijar_arranque(valor):
+    global ARRANQUE
+    ARRANQUE = valor
+
+
+def _json(datos):
+    return json.dumps(datos, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+class Instantanea:
+    """Estado congelado de una versión: lectura ya codificada y, bajo demanda, histórico"""
+
+    __slots__ = ('clave', 'version', 'lectura', 'lectura_json', 'etag',
+                 'historico_temperatura', 'historico_humo', '_historico_json')
+
+    def __init__(self, clave, version, lectura, historico_temperatura=(), historico_humo=()):
+        self.clave = clave
+        self.version = version
+        self.lectura = lectura
+        self.lectura_json = _json(lectura)
+        self.etag = f'{ARRANQUE}-{clave}-{version}'
+        self.historico_temperatura = historico_temperatura
+        self.historico_humo = historico_humo
+        self._historico_json = None
+
+    def historico_json(self):
+        # Se codifica como mucho una vez por versión (una carrera solo repite el trabajo)
+        if self._historico_json is None:
+            datos = {'temperatura': list(self.historico_temperatura), 'humo': list(self.historico_humo),
+                     'obsoleta': self.lectura.get('obsoleta', False)}
+            if 'dispositivos_obsoletos' in self.lectura:
+                datos['dispositivos_obsoletos'] = self.lectura['dispositivos_obsoletos']
+            self._historico_json = _json(datos)
+        return self._historico_json
+
+
+
+def historico_combinado(instantaneas):
+    """Histórico agregado sin locks: en cada instante (epoch 'ts') en que alguna placa tomó
+    muestra, el máximo de la última muestra de cada placa hasta ese instante"""
+    instantaneas = list(instantaneas)
+    return (_combinar([inst.historico_temperatura for inst in instantaneas]),
+            _combinar([inst.historico_humo for inst in instantaneas]))
+
+
+def _combinar(series):
+    # Se ordena por 'ts' ('time' es solo para mostrar: colapsa el segundo y no cruza la medianoche)
+    puntos = sorted(((p['ts'], i, p) for i, serie in enumerate(series) for p in serie), key=lambda x: x[0])
+    # Tantos puntos como la serie más larga de una placa; los anteriores solo ponen al día `ultimos`
+    limite = max((len(serie) for serie in series), default=0)
+    inicio = len(puntos) - limite
+    ultimos = {}
+    combinados = []
+    for n, (ts, i, p) in enumerate(puntos):
+        ultimos[i] = p['value']
+        if n < inicio:
+            continue
+        valor = max(ultimos.values())
+        if combinados and combinados[-1]['ts'] == ts:
+            combinados[-1]['value'] = valor
+        else:
+            combinados.append({'ts': ts, 'time': p['time'], 'value': valor})
+    return tuple(combinados)
@@ -0,0 +1,275 @@
+"""Métricas internas (contadores, gauges e histogramas) expuestas en formato de texto Prometheus.
+
+Pensadas para dejarlas activas en producción: cada serie con etiquetas se
+resuelve una vez (`.con(...)`) y se guarda en el objeto que la usa, y observar
+un valor solo hace una búsqueda binaria y dos sumas sobre arrays preasignados
+bajo un lock propio de esa serie.
+
+    LATENCIA = metricas.histograma('x_segundos', 'Ayuda', ('dispositivo',))
+    serie = LATENCIA.con('piso1')
+    serie.observar(0.003)
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+# Límites (segundos) para caminos rápidos: parseo, locks, escrituras
+BUCKETS_RAPIDOS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+# Límites (segundos) para operaciones de red o esperas largas: HTTP, SMTP, detección -> email
+BUCKETS_LENTOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _etiquetas(nombres, valores, extra=''):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) and not valor.is_integer() else str(int(valor))
+
+
+# ============================================
+# SERIES
+# ============================================
+class SerieContador:
+    __slots__ = ('valor', '_lock')
+
+    def __init__(self):
+        self.valor = 0
+        self._lock = threading.Lock()
+
+    def sumar(self, n=1):
+        with self._lock:
+            self.valor += n
+
+    def fijar(self, total):
+        """Para colectores cuyo origen ya lleva el total acumulado"""
+        self.valor = total
+
+
+class SerieGauge:
+    __slots__ = ('valor',)
+
+    def __init__(self):
+        self.valor = 0
+
+    def fijar(self, valor):
+        self.valor = valor
+
+
+class SerieHistograma:
+    __slots__ = ('limites', 'cuentas', 'suma', '_lock')
+
+    def __init__(self, limites):
+        self.limites = limites
+        # Una casilla por límite más la de +Inf; no acumuladas (se acumulan al exponer)
+        self.cuentas = array('Q', bytes(8 * (len(limites) + 1)))
+        self.suma = array('d', [0.0])
+        self._lock = threading.Lock()
+
+    def observar(self, valor):
+        i = bisect_left(self.limites, valor)
+        with self._lock:
+            self.cuentas[i] += 1
+            self.suma[0] += valor
+
+    def desde(self, inicio):
+        """Observa el tiempo transcurrido desde `inicio` (time.perf_counter())"""
+        self.observar(time.perf_counter() - inicio)
+
+
+class Metrica:
+    """Familia de series con los mismos nombres de etiqueta"""
+
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._series = {}
+        self._lock = threading.Lock()
+        if not self.etiquetas:
+            self.con()
+
+    def _nueva(self):
+        raise NotImplementedError
+
+    def con(self, *valores):
+        """Serie para esos valores de etiqueta (resolverla una vez y guardarla)"""
+        if len(valores) != len(self.etiquetas):
+            raise ValueError(f"{self.nombre}: se esperaban etiquetas {self.etiquetas}, llegaron {valores}")
+        valores = tuple(str(v) for v in valores)
+        serie = self._series.get(valores)
+        if serie is None:
+            with self._lock:
+                serie = self._series.setdefault(valores, self._nueva())
+        return serie
+
+    def series(self):
+        with self._lock:
+            return list(self._series.items())
+
+
+class Contador(Metrica):
+    tipo = 'counter'
+
+    def _nueva(self):
+        return SerieContador()
+
+    def sumar(self, n=1):
+        self.con().sumar(n)
+
+    def lineas(self):
+        for valores, serie in self.series():
+            yield f'{self.nombre}{_etiquetas(self.etiquetas, valores)} {_numero(serie.valor)}'
+
+
+class Gauge(Metrica):
+    tipo = 'gauge'
+
+    def _nueva(self):
+        return SerieGauge()
+
+    def fijar(self, valor):
+        self.con().fijar(valor)
+
+    def lineas(self):
+        for valores, serie in self.series():
+            yield f'{self.nombre}{_etiquetas(self.etiquetas, valores)} {_numero(serie.valor)}'
+
+
+class Histograma(Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=BUCKETS_RAPIDOS):
+        self.limites = tuple(sorted(limites))
+        super().__init__(nombre, ayuda, etiquetas)
+
+    def _nueva(self):
+        return SerieHistograma(self.limites)
+
+    def observar(self, valor):
+        self.con().observar(valor)
+
+    def lineas(self):
+        for valores, serie in self.series():
+            with serie._lock:
+                cuentas = list(serie.cuentas)
+                suma = serie.suma[0]
+            acumulado = 0
+            for limite, n in zip(self.limites + (float('inf'),), cuentas):
+                acumulado += n
+                le = f'le="{_numero(limite)}"'
+                yield f'{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le)} {acumulado}'
+            etiquetas = _etiquetas(self.etiquetas, valores)
+            yield f'{self.nombre}_sum{etiquetas} {_numero(suma)}'
+            yield f'{self.nombre}_count{etiquetas} {acumulado}'
+
+
+# ============================================
+# REGISTRO
+# ============================================
+class RegistroMetricas:
+    """Todas las métricas del proceso, más colectores que se consultan solo al exponer"""
+
+    def __init__(self):
+        self._metricas = {}
+        self._colectores = []
+        self._lock = threading.Lock()
+
+    def registrar(self, metrica):
+        with self._lock:
+            existente = self._metricas.get(metrica.nombre)
+            if existente is not None:
+                # Reimportar un módulo no duplica la métrica
+                return existente
+            self._metricas[metrica.nombre] = metrica
+        return metrica
+
+    def colector(self, funcion):
+        """`funcion()` se llama en cada /metrics para refrescar gauges (profundidad de colas, etc.)"""
+        self._colectores.append(funcion)
+        return funcion
+
+    def exponer(self, nombres=None):
+        """Texto de exposición; `nombres` limita la salida a esas métricas"""
+        for funcion in self._colectores:
+            try:
+                funcion()
+            except Exception as e:
+                print(f"⚠️ Colector de métricas falló: {e}")
+        with self._lock:
+            metricas = [m for m in self._metricas.values() if nombres is None or m.nombre in nombres]
+        salida = []
+        for m in metricas:
+            salida.append(f'# HELP {m.nombre} {m.ayuda}')
+            salida.append(f'# TYPE {m.nombre} {m.tipo}')
+            salida.extend(m.lineas())
+        salida.append('')
+        return '\n'.join(salida).encode('utf-8')
+
+
+REGISTRO = RegistroMetricas()
+TIPO_CONTENIDO = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def contador(nombre, ayuda, etiquetas=()):
+    return REGISTRO.registrar(Contador(nombre, ayuda, etiquetas))
+
+
+def gauge(nombre, ayuda, etiquetas=()):
+    return REGISTRO.registrar(Gauge(nombre, ayuda, etiquetas))
+
+
+def histograma(nombre, ayuda, etiquetas=(), limites=BUCKETS_RAPIDOS):
+    return REGISTRO.registrar(Histograma(nombre, ayuda, etiquetas, limites))
+
+
+# ============================================
+# LOCK INSTRUMENTADO
+# ============================================
+class LockMedido:
+    """Envuelve un Lock y mide cuánto se espera para tomarlo y cuánto se retiene.
+
+    Mientras se retiene solo hay un dueño, así que el instante de adquisición
+    puede guardarse en el propio objeto sin reservar nada por uso.
+    """
+
+    __slots__ = ('_lock', '_espera', '_retencion', '_tomado')
+
+    def __init__(self, espera, retencion, lock=None):
+        self._lock = lock or threading.Lock()
+        self._espera = espera
+        self._retencion = retencion
+        self._tomado = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        inicio = time.perf_counter()
+        tomado = self._lock.acquire(blocking, timeout)
+        if tomado:
+            self._tomado = time.perf_counter()
+            self._espera.observar(self._tomado - inicio)
+        return tomado
+
+    def release(self):
+        retenido = time.perf_counter() - self._tomado
+        self._lock.release()
+        self._retencion.observar(retenido)
+
+    def locked(self):
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
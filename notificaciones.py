@@ -0,0 +1,185 @@
+"""Motor de envío masivo de alertas: sesiones SMTP reutilizadas, envío paralelo y reintentos."""
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import metricas
+
+# smtplib y email se importan al preparar el primer aviso (no en el arranque)
+
+# Hilos de envío simultáneos (y sesiones SMTP abiertas) por lote
+MAX_WORKERS_SMTP = 4
+# Reintentos por destinatario y espera inicial del backoff exponencial (segundos)
+REINTENTOS_SMTP = 3
+ESPERA_BASE_REINTENTO = 0.5
+TIMEOUT_SMTP = 30
+
+DURACION_SMTP = metricas.histograma('smtp_envio_segundos', 'Tiempo de sendmail por mensaje entregado',
+                                    limites=metricas.BUCKETS_LENTOS)
+MENSAJES_SMTP = metricas.contador('smtp_mensajes_total', 'Mensajes por resultado final', ('resultado',))
+LATENCIA_AVISO = metricas.histograma('alerta_email_latencia_segundos',
+                                     'Desde la detección de la alerta hasta el último email del lote',
+                                     limites=metricas.BUCKETS_LENTOS)
+_ENVIADOS = MENSAJES_SMTP.con('enviado')
+_FALLIDOS = MENSAJES_SMTP.con('fallido')
+_DURACION_SMTP = DURACION_SMTP.con()
+_LATENCIA_AVISO = LATENCIA_AVISO.con()
+
+
+class MensajePreparado:
+    """Email serializado una vez (cabeceras comunes y cuerpo MIME): por destinatario solo se antepone To"""
+
+    __slots__ = ('asunto', 'cuerpo', '_datos')
+
+    def __init__(self, remitente, asunto, cuerpo, html=None):
+        from email import policy
+        from email.message import EmailMessage
+        msg = EmailMessage(policy=policy.SMTP)
+        msg['From'] = remitente
+        msg['Subject'] = asunto
+        msg.set_content(cuerpo, cte='quoted-printable')
+        if html is not None:
+            msg.add_alternative(html, subtype='html', cte='quoted-printable')
+        self.asunto = asunto
+        self.cuerpo = cuerpo
+        self._datos = msg.as_bytes()
+
+    def para(self, destinatario):
+        """Bytes listos para sendmail con la cabecera To del destinatario"""
+        if destinatario.isascii() and destinatario.isprintable():
+            return b'To: ' + destinatario.encode('ascii') + b'\r\n' + self._datos
+        # Direcciones internacionalizadas (el servidor debe admitir SMTPUTF8); sin saltos de línea inyectados
+        from email import policy
+        limpio = destinatario.replace('\r', '').replace('\n', '')
+        return policy.SMTPUTF8.fold_binary('To', limpio) + self._datos
+
+
+class MotorEnvio:
+    """Entrega un mismo aviso a muchos destinatarios reutilizando sesiones autenticadas"""
+
+    def __init__(self, host, puerto, usuario, password, starttls=True, simulado=False,
+                 max_workers=MAX_WORKERS_SMTP, reintentos=REINTENTOS_SMTP,
+                 espera_base=ESPERA_BASE_REINTENTO):
+        self.host = host
+        self.puerto = puerto
+        self.usuario = usuario
+        self.password = password
+        self.starttls = starttls
+        self.simulado = simulado
+        self.max_workers = max_workers
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        # Latencia extremo a extremo de los últimos avisos (detección -> último email)
+        self.ultimas_latencias = deque(maxlen=50)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='smtp')
+        self._lock_lote = threading.Lock()
+
+    # --------------------------------------------
+    # Sesiones SMTP
+    # --------------------------------------------
+    def _abrir_sesion(self):
+        import smtplib
+        smtp = smtplib.SMTP(self.host, self.puerto, timeout=TIMEOUT_SMTP)
+        if self.starttls:
+            smtp.starttls()
+        # Los servidores de prueba locales no anuncian AUTH
+        if self.usuario and self.password and smtp.has_extn('auth'):
+            smtp.login(self.usuario, self.password)
+        return smtp
+
+    @staticmethod
+    def _cerrar_sesion(smtp):
+        import smtplib
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def _entregar(self, sesiones, destinatario, mensaje):
+        """Envía a un destinatario con reintentos; las sesiones rotas se reabren"""
+        enviado = self._entregar_con_reintentos(sesiones, destinatario, mensaje)
+        (_ENVIADOS if enviado else _FALLIDOS).sumar()
+        return enviado
+
+    def _entregar_con_reintentos(self, sesiones, destinatario, mensaje):
+        if self.simulado:
+            print(f"[SIMULADO] Email a {destinatario}: {mensaje.asunto}")
+            return True
+
+        import smtplib
+        # Errores tras los que la sesión queda inservible y hay que reconectar
+        errores_conexion = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+        texto = mensaje.para(destinatario)
+        smtp = sesiones.get()
+        try:
+            for intento in range(self.reintentos + 1):
+                try:
+                    if smtp is None:
+                        smtp = self._abrir_sesion()
+                    inicio = time.perf_counter()
+                    smtp.sendmail(self.usuario, destinatario, texto)
+                    _DURACION_SMTP.desde(inicio)
+                    return True
+                except smtplib.SMTPRecipientsRefused as e:
+                    # Dirección rechazada: reintentar no sirve
+                    print(f"Error al enviar email a {destinatario}: {e}")
+                    return False
+                except (smtplib.SMTPException, OSError) as e:
+                    if isinstance(e, errores_conexion) or smtp is None:
+                        self._cerrar_sesion(smtp)
+                        smtp = None
+                    if intento == self.reintentos:
+                        print(f"Error al enviar email a {destinatario}: {e}")
+                        return False
+                    time.sleep(self.espera_base * (2 ** intento))
+        finally:
+            sesiones.put(smtp)
+
+    # --------------------------------------------
+    # Envío de un lote
+    # --------------------------------------------
+    def enviar_lote(self, destinatarios, aviso, t_deteccion=None):
+        """Envía el aviso a todos los destinatarios ({'id', 'email'}) en paralelo.
+
+        `aviso.para(destinatario)` da su MensajePreparado (plantillas.AvisoRenderizado:
+        una variante renderizada por idioma y formato). Devuelve una lista de
+        (usuario_id, enviado) en el mismo orden.
+        """
+        inicio = time.monotonic()
+        if t_deteccion is None:
+            t_deteccion = inicio
+
+        # Un lote a la vez: las sesiones del lote se abren bajo demanda y se cierran al final
+        with self._lock_lote:
+            n_sesiones = min(self.max_workers, len(destinatarios)) or 1
+            sesiones = queue.Queue()
+            for _ in range(n_sesiones):
+                sesiones.put(None)
+
+            futuros = [self._executor.submit(self._entregar, sesiones, u['email'], aviso.para(u))
+                       for u in destinatarios]
+            resultados = []
+            for u, f in zip(destinatarios, futuros):
+                try:
+                    enviado = f.result()
+                except Exception as e:
+                    print(f"Error al enviar email a {u['email']}: {e}")
+                    enviado = False
+                resultados.append((u['id'], enviado))
+
+            while not sesiones.empty():
+                self._cerrar_sesion(sesiones.get_nowait())
+
+        fin = time.monotonic()
+        _LATENCIA_AVISO.observar(fin - t_deteccion)
+        self.ultimas_latencias.append({
+            'destinatarios': len(destinatarios),
+            'enviados': sum(1 for _, ok in resultados if ok),
+            'envio_s': round(fin - inicio, 3),
+            'latencia_s': round(fin - t_deteccion, 3),
+        })
+        return resultados
@@ -0,0 +1,151 @@
+"""Cola persistente de avisos salientes (outbox) y su despachador con reintentos."""
+import json
+import threading
+import time
+import uuid
+
+# Reintentos: espera = BASE * 2^intentos, con tope
+ESPERA_BASE_S = 5
+ESPERA_MAXIMA_S = 600
+MAX_INTENTOS = 20
+# Un aviso reclamado y no resuelto en este tiempo se considera abandonado (proceso caído)
+LEASE_S = 300
+# Avisos que el despachador reclama por vuelta
+LOTE_RECLAMO = 10
+
+
+def nuevo_id_alerta():
+    return uuid.uuid4().hex
+
+
+def crear_tablas(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS outbox
+              (id INTEGER PRIMARY KEY AUTOINCREMENT,
+               alerta_id TEXT UNIQUE NOT NULL,
+               payload TEXT NOT NULL,
+               estado TEXT NOT NULL DEFAULT 'pendiente',
+               intentos INTEGER NOT NULL DEFAULT 0,
+               proximo_intento REAL NOT NULL,
+               reclamado_hasta REAL,
+               ultimo_error TEXT,
+               creado REAL NOT NULL,
+               enviado REAL)''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_outbox_pendientes ON outbox(estado, proximo_intento)')
+
+
+class Outbox:
+    """Operaciones sobre la tabla outbox (enqueue, claim, completar, reintentar)"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._hay_trabajo = threading.Event()
+
+    def enqueue(self, alerta_id, payload):
+        """Encola un aviso; un alerta_id repetido se ignora (deduplicación)"""
+        ahora = time.time()
+        with self.pool.conexion() as conn:
+            with conn:
+                c = conn.execute('''INSERT OR IGNORE INTO outbox (alerta_id, payload, proximo_intento, creado)
+                                    VALUES (?, ?, ?, ?)''',
+                                 (alerta_id, json.dumps(payload, ensure_ascii=False), ahora, ahora))
+        self._hay_trabajo.set()
+        return c.rowcount == 1
+
+    def claim(self, limite=LOTE_RECLAMO):
+        """Reclama avisos vencidos (pendientes o con lease caducado) para este despachador"""
+        ahora = time.time()
+        with self.pool.conexion() as conn:
+            with conn:
+                filas = conn.execute('''SELECT id, alerta_id, payload, intentos FROM outbox
+                                        WHERE (estado = 'pendiente' AND proximo_intento <= ?)
+                                           OR (estado = 'en_curso' AND reclamado_hasta < ?)
+                                        ORDER BY proximo_intento LIMIT ?''',
+                                     (ahora, ahora, limite)).fetchall()
+                conn.executemany("UPDATE outbox SET estado = 'en_curso', reclamado_hasta = ? WHERE id = ?",
+                                 [(ahora + LEASE_S, f[0]) for f in filas])
+        return [{'id': f[0], 'alerta_id': f[1], 'payload': json.loads(f[2]), 'intentos': f[3]}
+                for f in filas]
+
+    def completar(self, id_):
+        with self.pool.conexion() as conn:
+            with conn:
+                conn.execute("UPDATE outbox SET estado = 'enviado', enviado = ?, reclamado_hasta = NULL WHERE id = ?",
+                             (time.time(), id_))
+
+    def reintentar(self, id_, intentos, error, payload=None):
+        """Devuelve el aviso a pendiente con backoff exponencial, o lo marca fallido.
+
+        Si se pasa `payload` se guarda actualizado (p. ej. solo los destinatarios pendientes).
+        """
+        intentos += 1
+        estado = 'fallido' if intentos >= MAX_INTENTOS else 'pendiente'
+        espera = min(ESPERA_BASE_S * (2 ** (intentos - 1)), ESPERA_MAXIMA_S)
+        with self.pool.conexion() as conn:
+            with conn:
+                conn.execute('''UPDATE outbox SET estado = ?, intentos = ?, proximo_intento = ?,
+                                reclamado_hasta = NULL, ultimo_error = ? WHERE id = ?''',
+                             (estado, intentos, time.time() + espera, str(error)[:500], id_))
+                if payload is not None:
+                    conn.execute('UPDATE outbox SET payload = ? WHERE id = ?',
+                                 (json.dumps(payload, ensure_ascii=False), id_))
+
+    def profundidad(self):
+        """Avisos aún no entregados (pendientes + en curso)"""
+        with self.pool.conexion() as conn:
+            return conn.execute("SELECT COUNT(*) FROM outbox WHERE estado IN ('pendiente', 'en_curso')").fetchone()[0]
+
+    def edad_pendiente_mas_antigua(self):
+        """Segundos desde que se encoló el aviso pendiente más antiguo (0 si no hay)"""
+        with self.pool.conexion() as conn:
+            creado = conn.execute("SELECT MIN(creado) FROM outbox WHERE estado IN ('pendiente', 'en_curso')").fetchone()[0]
+        return time.time() - creado if creado else 0
+
+    def esperar_trabajo(self, timeout):
+        self._hay_trabajo.wait(timeout)
+        self._hay_trabajo.clear()
+
+
+class Despachador:
+    """Hilo dedicado que vacía la outbox llamando a `entregar(payload)`.
+
+    `entregar` debe devolver True si el aviso quedó entregado; False o una
+    excepción lo devuelven a la cola con backoff. `entregar` puede modificar
+    el payload y el cambio se persiste para el siguiente intento.
+    """
+
+    def __init__(self, outbox, entregar, intervalo=1.0):
+        self.outbox = outbox
+        self.entregar = entregar
+        self.intervalo = intervalo
+        self._hilo = None
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._bucle, name='despachador-outbox', daemon=True)
+        self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            try:
+                avisos = self.outbox.claim()
+            except Exception as e:
+                print(f"❌ Error leyendo outbox: {e}")
+                avisos = []
+            for aviso in avisos:
+                self._procesar(aviso)
+            if not avisos:
+                self.outbox.esperar_trabajo(self.intervalo)
+
+    def _procesar(self, aviso):
+        try:
+            ok = self.entregar(aviso['payload'])
+            error = 'entrega incompleta'
+        except Exception as e:
+            ok, error = False, e
+        try:
+            if ok:
+                self.outbox.completar(aviso['id'])
+            else:
+                print(f"⚠️ Aviso {aviso['alerta_id']} no entregado ({error}); se reintentará")
+                self.outbox.reintentar(aviso['id'], aviso['intentos'], error, aviso['payload'])
+        except Exception as e:
+            print(f"❌ Error actualizando outbox: {e}")
@@ -0,0 +1,195 @@
+"""Plantillas de los emails de alerta: compiladas una vez por tipo e idioma, renderizadas una vez por aviso.
+
+Un aviso se renderiza (asunto, cuerpo y MIME completo) una sola vez por cada
+variante (idioma, formato) que pidan sus destinatarios; a cada destinatario
+solo se le antepone su cabecera To (notificaciones.MensajePreparado). Con 10k
+destinatarios en el idioma por defecto son un render y 10k concatenaciones.
+
+Preferencias de cada usuario (columnas idioma y formato_email de usuarios;
+NULL o un valor desconocido usan las de por defecto):
+- idioma: 'es' o 'en' (textos y formato de la fecha).
+- formato: 'texto' o 'html' (multipart/alternative con las dos versiones).
+"""
+import html
+from datetime import datetime
+
+import notificaciones
+
+IDIOMA_POR_DEFECTO = 'es'
+FORMATO_POR_DEFECTO = 'texto'
+FORMATOS = ('texto', 'html')
+
+# Por idioma: formato de fecha, línea del dispositivo, nombres de las variables
+# y (asunto, cuerpo) de cada tipo de aviso, con campos de str.format
+TEXTOS = {
+    'es': {
+        'fecha': '%d/%m/%Y %H:%M:%S',
+        'dispositivo': '\nDispositivo: {}',
+        'variables': {'temperatura': 'temperatura', 'humo': 'humo'},
+        'conjuncion': ' y ',
+        'emergencia_manual': ("🚨 EMERGENCIA ACTIVADA MANUALMENTE", """\
+🚨 ¡EMERGENCIA ACTIVADA POR ADMINISTRADOR!
+El administrador ha activado manualmente el protocolo de emergencia.
+¡EVACUAR INMEDIATAMENTE!
+Hora: {hora}
+"""),
+        # Detector de subida (deteccion.py): los valores aún no alcanzan el umbral
+        'subida': ("AVISO: Subida rápida de {variables}", """\
+⚠️ ¡SUBIDA RÁPIDA DETECTADA!
+Los valores suben de forma sostenida, aunque aún no alcanzan el umbral de peligro:
+- Temperatura: {temp:.1f}°C (Umbral: {umbral_temp}°C)
+- Humo: {humo:.0f} ppm (Umbral: {umbral_humo} ppm)
+Verificar inmediatamente.
+Hora: {hora}
+"""),
+        'incendio': ("ALERTA CRÍTICA: Incendio Detectado", """\
+🚨 ¡ALERTA CRÍTICA!
+Se ha detectado una emergencia por MÚLTIPLES RIESGOS:
+- Temperatura: {temp:.1f}°C (Umbral: {umbral_temp}°C)
+- Humo: {humo:.0f} ppm (Umbral: {umbral_humo} ppm)
+¡EVACUAR INMEDIATAMENTE!
+Hora: {hora}
+"""),
+        'temperatura': ("ALERTA: Temperatura Alta", """\
+🔥 ¡PELIGRO DE INCENDIO!
+Temperatura crítica detectada:
+- Temperatura: {temp:.1f}°C (Umbral: {umbral_temp}°C)
+Verificar inmediatamente.
+Hora: {hora}
+"""),
+        'humo': ("ALERTA: Humo Detectado", """\
+💨 ¡HUMO DETECTADO!
+Nivel de humo elevado:
+- Humo: {humo:.0f} ppm (Umbral: {umbral_humo} ppm)
+Evacuar el área.
+Hora: {hora}
+"""),
+    },
+    'en': {
+        'fecha': '%Y-%m-%d %H:%M:%S',
+        'dispositivo': '\nDevice: {}',
+        'variables': {'temperatura': 'temperature', 'humo': 'smoke'},
+        'conjuncion': ' and ',
+        'emergencia_manual': ("🚨 EMERGENCY TRIGGERED MANUALLY", """\
+🚨 EMERGENCY TRIGGERED BY AN ADMINISTRATOR!
+An administrator has manually started the emergency protocol.
+EVACUATE IMMEDIATELY!
+Time: {hora}
+"""),
+        'subida': ("WARNING: Rapid rise in {variables}", """\
+⚠️ RAPID RISE DETECTED!
+Readings are rising steadily, although they have not reached the danger threshold yet:
+- Temperature: {temp:.1f}°C (Threshold: {umbral_temp}°C)
+- Smoke: {humo:.0f} ppm (Threshold: {umbral_humo} ppm)
+Check immediately.
+Time: {hora}
+"""),
+        'incendio': ("CRITICAL ALERT: Fire Detected", """\
+🚨 CRITICAL ALERT!
+An emergency with MULTIPLE HAZARDS has been detected:
+- Temperature: {temp:.1f}°C (Threshold: {umbral_temp}°C)
+- Smoke: {humo:.0f} ppm (Threshold: {umbral_humo} ppm)
+EVACUATE IMMEDIATELY!
+Time: {hora}
+"""),
+        'temperatura': ("ALERT: High Temperature", """\
+🔥 FIRE HAZARD!
+Critical temperature detected:
+- Temperature: {temp:.1f}°C (Threshold: {umbral_temp}°C)
+Check immediately.
+Time: {hora}
+"""),
+        'humo': ("ALERT: Smoke Detected", """\
+💨 SMOKE DETECTED!
+High smoke level:
+- Smoke: {humo:.0f} ppm (Threshold: {umbral_humo} ppm)
+Evacuate the area.
+Time: {hora}
+"""),
+    },
+}
+IDIOMAS = tuple(TEXTOS)
+TIPOS = ('emergencia_manual', 'subida', 'incendio', 'temperatura', 'humo')
+
+
+def tipo_plantilla(tipos, motivo=None):
+    """Plantilla que corresponde a un aviso por sus tipos de alerta y su motivo"""
+    if 'emergencia_manual' in tipos:
+        return 'emergencia_manual'
+    if motivo == 'subida':
+        return 'subida'
+    if 'temperatura' in tipos and 'humo' in tipos:
+        return 'incendio'
+    return 'temperatura' if 'temperatura' in tipos else 'humo'
+
+
+class Plantilla:
+    """Asunto y cuerpo de un tipo de aviso en un idioma, con sus formateadores ya resueltos"""
+
+    __slots__ = ('_asunto', '_cuerpo', '_fecha', '_dispositivo', '_variables', '_conjuncion')
+
+    def __init__(self, textos, tipo):
+        asunto, cuerpo = textos[tipo]
+        self._asunto = asunto.format_map
+        self._cuerpo = cuerpo.format_map
+        self._fecha = textos['fecha']
+        self._dispositivo = textos['dispositivo'].format
+        self._variables = textos['variables']
+        self._conjuncion = textos['conjuncion']
+
+    def renderizar(self, valores):
+        """(asunto, cuerpo) con `valores`: temp, humo, umbral_temp, umbral_humo, detectado, dispositivo y tipos"""
+        hora = datetime.fromtimestamp(valores['detectado']).strftime(self._fecha)
+        if valores.get('dispositivo', '*') != '*':
+            hora += self._dispositivo(valores['dispositivo'])
+        campos = dict(valores, hora=hora,
+                      variables=self._conjuncion.join(self._variables.get(t, t) for t in valores['tipos']))
+        return self._asunto(campos), self._cuerpo(campos)
+
+
+# Compiladas al importar: una por (tipo, idioma)
+_PLANTILLAS = {(tipo, idioma): Plantilla(textos, tipo) for idioma, textos in TEXTOS.items() for tipo in TIPOS}
+
+
+def a_html(cuerpo):
+    """Versión HTML del cuerpo de texto (mismas líneas, escapadas)"""
+    lineas = '<br>\n'.join(html.escape(linea) for linea in cuerpo.rstrip('\n').split('\n'))
+    return f'<!DOCTYPE html>\n<html><body style="font-family: sans-serif">\n{lineas}\n</body></html>\n'
+
+
+class AvisoRenderizado:
+    """Un aviso y sus variantes (idioma, formato), cada una renderizada la primera vez que se pide.
+
+    No es seguro entre hilos: `para` se llama desde el hilo que reparte el lote.
+    """
+
+    def __init__(self, remitente, tipos, motivo, valores):
+        self.remitente = remitente
+        self.tipo = tipo_plantilla(tipos, motivo)
+        self.valores = dict(valores, tipos=list(tipos))
+        self._variantes = {}
+
+    def variante(self, idioma=IDIOMA_POR_DEFECTO, formato=FORMATO_POR_DEFECTO):
+        clave = (idioma, formato)
+        mensaje = self._variantes.get(clave)
+        if mensaje is None:
+            asunto, cuerpo = _PLANTILLAS[self.tipo, idioma].renderizar(self.valores)
+            mensaje = notificaciones.MensajePreparado(self.remitente, asunto, cuerpo,
+                                                      a_html(cuerpo) if formato == 'html' else None)
+            self._variantes[clave] = mensaje
+        return mensaje
+
+    def para(self, usuario):
+        """Mensaje con las preferencias del usuario ({'idioma', 'formato'}, opcionales)"""
+        idioma = usuario.get('idioma')
+        formato = usuario.get('formato')
+        return self.variante(idioma if idioma in TEXTOS else IDIOMA_POR_DEFECTO,
+                             formato if formato in FORMATOS else FORMATO_POR_DEFECTO)
+
+    @property
+    def variantes(self):
+        return len(self._variantes)
+
+    def texto(self):
+        """Cuerpo en el idioma por defecto (el que se guarda con la alerta)"""
+        return self.variante().cuerpo
@@ -0,0 +1,163 @@
+"""Protocolo serie de las placas: líneas de texto 'T:..,H:..,RH:..' o tramas binarias de tamaño fijo.
+
+Cada decodificador sabe trocear su propio flujo: `extraer(pendiente)` recibe los
+bytes acumulados y devuelve las muestras completas, lo que queda a medias y
+cuántas unidades (líneas o tramas) llegaron y cuántas eran inválidas.
+
+Trama binaria (11 bytes, little-endian), para placas que puedan enviarla:
+
+    0xAA | secuencia u16 | temperatura i16 (0.01 °C) | humo u16 (0.1 ppm) | humedad u16 (0.01 %) | CRC u16
+
+El CRC es CRC-16/XMODEM (`_crc_xmodem_update` de avr-libc) sobre los bytes 1..8.
+"""
+import re
+import struct
+from binascii import crc_hqx
+
+# Longitud máxima de una línea de texto antes de darla por basura
+MAX_LINEA = 256
+
+# float() valida cada número ("1.2.3" -> ValueError)
+_NUMERO = rb'([-+.\d]+)'
+_CAMPOS = rb'T: ?' + _NUMERO + rb' ?, ?H: ?' + _NUMERO + rb'(?: ?, ?RH: ?' + _NUMERO + rb')?'
+PATRON_TEXTO = re.compile(_CAMPOS)
+# Un solo recorrido por bloque: una coincidencia por línea que empieza por 'T:'
+PATRON_BLOQUE = re.compile('^' + _CAMPOS.decode('ascii') + '[^\n]*$', re.M)
+# Formato antiguo del firmware: "Temp: 25.3°C | Humo: 310 ppm"
+PATRON_LEGADO = re.compile(rb'Temp:\s*' + _NUMERO + rb'.*?Humo:\s*' + _NUMERO)
+# Eco de un comando recibido por el firmware: "ACK:V"
+PATRON_ACK = re.compile(rb'\s*ACK:\s*([A-Za-z])')
+
+SYNC = 0xAA
+TRAMA = struct.Struct('<BHhHHH')
+TAM_TRAMA = TRAMA.size
+_SYNC_BYTE = bytes([SYNC])
+
+
+class DecodificadorTexto:
+    """Líneas 'T:25.1,H:310.0,RH:60.0' (RH opcional) y, como respaldo, el formato 'Temp:/Humo:'"""
+
+    binario = False
+
+    def __init__(self, max_linea=MAX_LINEA):
+        self.max_linea = max_linea
+        # Bytes de comando confirmados ('ACK:<byte>') en el último extraer(); los vacía el lector
+        self.confirmaciones = []
+
+    @staticmethod
+    def _valores(linea):
+        m = PATRON_TEXTO.search(linea)
+        try:
+            if m is not None:
+                temp, humo, humedad = m.groups()
+                return float(temp), float(humo), float(humedad) if humedad is not None else None
+            m = PATRON_LEGADO.search(linea)
+            if m is not None:
+                return float(m.group(1)), float(m.group(2)), None
+        except ValueError:
+            # Números mal formados ("1.2.3", "-"): línea corrupta
+            pass
+        return None
+
+    def extraer(self, pendiente):
+        corte = pendiente.rfind(b'\n') + 1
+        resto = pendiente[corte:]
+        malformadas = 0
+        if len(resto) > self.max_linea:
+            # Una línea más larga que esto es basura (sin '\n' en el flujo): se descarta
+            resto = b''
+            malformadas += 1
+        if not corte:
+            return [], resto, malformadas, malformadas
+
+        # Camino rápido: todas las líneas completas son 'T:..,H:..[,RH:..]'.
+        # latin-1 decodifica sin validar (copia byte a byte) y findall recorre el bloque una vez.
+        texto = pendiente[:corte].decode('latin-1')
+        lineas = texto.count('\n')
+        encontrados = PATRON_BLOQUE.findall(texto)
+        if len(encontrados) == lineas:
+            try:
+                muestras = [(float(t), float(h), float(rh) if rh else None) for t, h, rh in encontrados]
+                return muestras, resto, lineas + malformadas, malformadas
+            except ValueError:
+                pass
+
+        # Camino lento: hay líneas en blanco, ecos de comandos, formato antiguo o corruptas
+        muestras = []
+        recibidas = malformadas
+        for linea in bytes(pendiente[:corte]).split(b'\n')[:-1]:
+            if not linea or linea.isspace():
+                continue
+            ack = PATRON_ACK.match(linea)
+            if ack is not None:
+                self.confirmaciones.append(ack.group(1))
+                continue
+            recibidas += 1
+            muestra = self._valores(linea)
+            if muestra is None:
+                malformadas += 1
+            else:
+                muestras.append(muestra)
+        return muestras, resto, recibidas, malformadas
+
+
+def codificar_trama(secuencia, temperatura, humo, humedad=0.0):
+    """Trama binaria de una muestra (lo que enviaría el firmware)"""
+    cuerpo = TRAMA.pack(SYNC, secuencia & 0xFFFF, round(temperatura * 100), round(humo * 10),
+                        round(humedad * 100), 0)[1:-2]
+    return _SYNC_BYTE + cuerpo + struct.pack('<H', crc_hqx(cuerpo, 0))
+
+
+class DecodificadorBinario:
+    """Tramas de tamaño fijo: busca el byte de sincronía y valida el CRC antes de aceptar"""
+
+    binario = True
+    # Las tramas binarias no llevan ecos de comandos
+    confirmaciones = ()
+
+    def __init__(self):
+        self.ultima_secuencia = None
+        self.perdidas = 0
+
+    def extraer(self, pendiente):
+        vista = memoryview(pendiente)
+        fin = len(pendiente)
+        i = 0
+        muestras = []
+        recibidas = malformadas = 0
+        try:
+            while fin - i >= TAM_TRAMA:
+                if pendiente[i] != SYNC:
+                    # Basura o desincronización: salta al siguiente byte de sincronía
+                    j = pendiente.find(_SYNC_BYTE, i + 1)
+                    recibidas += 1
+                    malformadas += 1
+                    i = fin if j < 0 else j
+                    continue
+                _, secuencia, temperatura, humo, humedad, crc = TRAMA.unpack_from(vista, i)
+                if crc_hqx(vista[i + 1:i + TAM_TRAMA - 2], 0) != crc:
+                    # 0xAA dentro de otra trama o trama corrupta: se resincroniza un byte más allá
+                    recibidas += 1
+                    malformadas += 1
+                    i += 1
+                    continue
+                if self.ultima_secuencia is not None:
+                    self.perdidas += (secuencia - self.ultima_secuencia - 1) & 0xFFFF
+                self.ultima_secuencia = secuencia
+                muestras.append((temperatura / 100, humo / 10, humedad / 100))
+                recibidas += 1
+                i += TAM_TRAMA
+            resto = bytes(vista[i:])
+        finally:
+            vista.release()
+        return muestras, resto, recibidas, malformadas
+
+
+PROTOCOLOS = {'texto': DecodificadorTexto, 'binario': DecodificadorBinario}
+
+
+def crear_decodificador(protocolo='texto'):
+    try:
+        return PROTOCOLOS[protocolo]()
+    except KeyError:
+        raise ValueError(f"Protocolo desconocido: {protocolo!r} (opciones: {', '.join(PROTOCOLOS)})") from None
@@ -0,0 +1,202 @@
+"""Histórico persistente de alertas: una fila por alerta con inicio, fin, duración y picos.
+
+La alerta se abre al detectar el peligro (misma `alerta_id` que su aviso en la
+outbox y sus notificaciones) y se cierra al volver a seguro, con los valores
+máximos alcanzados mientras duró; los picos se acumulan en memoria, sin
+escrituras por muestra. /alertas pagina por id (`?after_id=`) para que cada
+cliente pida solo lo nuevo.
+"""
+import threading
+import time
+from datetime import datetime
+
+# Alertas por página de /alertas (por defecto y máximo)
+LIMITE_POR_DEFECTO = 20
+LIMITE_MAXIMO = 500
+# Segundos que se reutiliza el total de alertas (lo consulta /estadisticas en cada petición)
+TTL_TOTAL_S = 1.0
+
+# Valores posibles de la columna tipo: el filtro ?tipo=humo se resuelve con IN sobre el índice
+TIPOS = ('temperatura', 'humo', 'temperatura,humo', 'emergencia_manual')
+
+_COLUMNAS = 'id, alerta_id, dispositivo, tipo, inicio, fin, temperatura, humo, temperatura_max, humo_max, motivo, config_version'
+
+
+def crear_tablas(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS alertas
+              (id INTEGER PRIMARY KEY AUTOINCREMENT,
+               alerta_id TEXT UNIQUE NOT NULL,
+               dispositivo TEXT NOT NULL,
+               tipo TEXT NOT NULL,
+               inicio REAL NOT NULL,
+               fin REAL,
+               duracion REAL,
+               temperatura REAL,
+               humo REAL,
+               temperatura_max REAL,
+               humo_max REAL,
+               mensaje TEXT)''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_alertas_inicio ON alertas(inicio)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_alertas_tipo_inicio ON alertas(tipo, inicio)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_alertas_dispositivo ON alertas(dispositivo, id)')
+
+
+def tipos_con(tipo):
+    """Valores de la columna que incluyen `tipo` (p. ej. 'humo' -> 'humo' y 'temperatura,humo')"""
+    return [t for t in TIPOS if tipo in t.split(',')]
+
+
+def a_dict(fila):
+    id_, alerta_id, dispositivo, tipo, inicio, fin, temp, humo, temp_max, humo_max, motivo, config_version = fila
+    return {
+        'id': id_,
+        'alerta_id': alerta_id,
+        'timestamp': datetime.fromtimestamp(inicio).strftime('%Y-%m-%d %H:%M:%S'),
+        'dispositivo': dispositivo,
+        'tipo': tipo.split(','),
+        'motivo': motivo,
+        'config_version': config_version,
+        'temperatura': temp,
+        'humo': humo,
+        'inicio': inicio,
+        'fin': fin,
+        'duracion_s': round(fin - inicio, 3) if fin is not None else None,
+        'temperatura_max': temp_max,
+        'humo_max': humo_max,
+        'activa': fin is None,
+    }
+
+
+class AlertaAbierta:
+    """Alerta en curso: picos acumulados y placas que aún la mantienen enganchada.
+
+    Una alerta de todo el edificio (emergencia manual) la comparten varias placas, cada
+    una bajo su propio lock: cada placa acumula sus picos en su propia entrada y se
+    combinan al cerrar la alerta, cuando ya no la mantiene ninguna.
+    """
+
+    __slots__ = ('id', 'alerta_id', 'dispositivo', 'inicio', 'temperatura_max', 'humo_max', 'placas', 'picos')
+
+    def __init__(self, id_, alerta_id, dispositivo, inicio, temp, humo, placas):
+        self.id = id_
+        self.alerta_id = alerta_id
+        self.dispositivo = dispositivo
+        self.inicio = inicio
+        self.temperatura_max = temp
+        self.humo_max = humo
+        self.placas = set(placas)
+        # Entradas creadas aquí: luego cada hilo lector solo reemplaza el valor de la suya
+        self.picos = dict.fromkeys(self.placas, (temp, humo))
+
+    def actualizar(self, device_id, temp, humo):
+        """Cada muestra de `device_id` mientras dura (bajo el lock de esa placa): solo memoria"""
+        temp_max, humo_max = self.picos.get(device_id, (temp, humo))
+        if temp > temp_max or humo > humo_max:
+            self.picos[device_id] = (max(temp, temp_max), max(humo, humo_max))
+
+    def combinar_picos(self):
+        """Al cerrar: máximos de todas las placas que la mantuvieron"""
+        for temp, humo in self.picos.values():
+            self.temperatura_max = max(self.temperatura_max, temp)
+            self.humo_max = max(self.humo_max, humo)
+
+
+class RegistroAlertas:
+    """Operaciones sobre la tabla alertas (abrir, soltar/cerrar, listar, contar)"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._total = None
+
+    def abrir(self, alerta_id, dispositivo, tipos, temp, humo, placas=None, motivo=None, config_version=None):
+        """Inserta la alerta al detectarla; `placas` son las que deben soltarla para cerrarla.
+
+        `motivo` es el detector que la abrió ('umbral', 'subida'; ver deteccion.py) y
+        `config_version` la versión de los umbrales vigente (ver umbrales.py).
+        """
+        inicio = time.time()
+        with self.pool.conexion() as conn:
+            with conn:
+                c = conn.execute('''INSERT INTO alertas (alerta_id, dispositivo, tipo, inicio, temperatura, humo,
+                                                         temperatura_max, humo_max, motivo, config_version)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                 (alerta_id, dispositivo, ','.join(tipos), inicio, temp, humo, temp, humo, motivo,
+                                  config_version))
+        with self._lock:
+            self._total = None
+        return AlertaAbierta(c.lastrowid, alerta_id, dispositivo, inicio, temp, humo,
+                             (dispositivo,) if placas is None else placas)
+
+    def soltar(self, alerta, device_id):
+        """La placa `device_id` volvió a seguro; la alerta se cierra cuando ya no la mantiene ninguna"""
+        with self._lock:
+            alerta.placas.discard(device_id)
+            if alerta.placas:
+                return None
+        return self.cerrar(alerta)
+
+    def cerrar(self, alerta):
+        fin = time.time()
+        alerta.combinar_picos()
+        with self.pool.conexion() as conn:
+            with conn:
+                conn.execute('''UPDATE alertas SET fin = ?, duracion = ?, temperatura_max = ?, humo_max = ?
+                                WHERE id = ?''',
+                             (fin, fin - alerta.inicio, alerta.temperatura_max, alerta.humo_max, alerta.id))
+        return {'id': alerta.id, 'alerta_id': alerta.alerta_id, 'dispositivo': alerta.dispositivo,
+                'fin': fin, 'duracion_s': round(fin - alerta.inicio, 3),
+                'temperatura_max': alerta.temperatura_max, 'humo_max': alerta.humo_max}
+
+    def cerrar_huerfanas(self):
+        """Al arrancar: las alertas que quedaron abiertas (proceso caído) se cierran ahora.
+
+        El latch de las placas no sobrevive al reinicio; si el peligro sigue, se abre otra.
+        """
+        ahora = time.time()
+        with self.pool.conexion() as conn:
+            with conn:
+                c = conn.execute('UPDATE alertas SET fin = ?, duracion = ? - inicio WHERE fin IS NULL', (ahora, ahora))
+        return c.rowcount
+
+    def listar(self, after_id=None, limite=LIMITE_POR_DEFECTO, tipo=None, dispositivo=None, desde=None, hasta=None):
+        """Alertas en orden de id. Con `after_id`, las posteriores a ese id (las primeras `limite`);
+        sin él, las `limite` más recientes."""
+        condiciones, parametros = [], []
+        if after_id is not None:
+            condiciones.append('id > ?')
+            parametros.append(after_id)
+        if tipo:
+            tipos = tipos_con(tipo)
+            condiciones.append(f"tipo IN ({','.join('?' * len(tipos))})" if tipos else '0')
+            parametros.extend(tipos)
+        if dispositivo:
+            # Las alertas de todo el edificio ('*', emergencia manual) afectan a todas las placas
+            condiciones.append("dispositivo IN (?, '*')")
+            parametros.append(dispositivo)
+        if desde is not None:
+            condiciones.append('inicio >= ?')
+            parametros.append(desde)
+        if hasta is not None:
+            condiciones.append('inicio < ?')
+            parametros.append(hasta)
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+        orden = 'ASC' if after_id is not None else 'DESC'
+        with self.pool.conexion() as conn:
+            filas = conn.execute(f'SELECT {_COLUMNAS} FROM alertas {where} ORDER BY id {orden} LIMIT ?',
+                                 (*parametros, limite)).fetchall()
+        if orden == 'DESC':
+            filas.reverse()
+        return [a_dict(f) for f in filas]
+
+    def total(self):
+        """Número de alertas registradas (cacheado TTL_TOTAL_S)"""
+        ahora = time.monotonic()
+        with self._lock:
+            if self._total is not None and ahora < self._total[1]:
+                return self._total[0]
+        with self.pool.conexion() as conn:
+            n = conn.execute('SELECT COUNT(*) FROM alertas').fetchone()[0]
+        with self._lock:
+            self._total = (n, ahora + TTL_TOTAL_S)
+        return n
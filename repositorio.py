@@ -0,0 +1,338 @@
+"""Capa de acceso a datos: pool de conexiones SQLite y consultas de usuarios/notificaciones."""
+import json
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import exportacion
+import outbox
+import registro_alertas
+import serie_temporal
+import umbrales
+from autenticacion import hash_password, verificar_password, KDFSaturado, ITERACIONES_KDF
+
+RUTA_DB = 'alertas.db'
+
+# Conexiones ociosas que se conservan para reutilizar
+MAX_CONEXIONES_OCIOSAS = 8
+# Sentencias preparadas que cachea cada conexión (sqlite3 las reutiliza por texto SQL)
+SENTENCIAS_CACHEADAS = 128
+# Milisegundos que una escritura espera a que otra libere la base antes de fallar
+BUSY_TIMEOUT_MS = 5000
+
+
+class PoolConexiones:
+    """Pool thread-safe: cada conexión se abre y configura una sola vez y se reutiliza"""
+
+    def __init__(self, ruta, max_ociosas=MAX_CONEXIONES_OCIOSAS):
+        self.ruta = ruta
+        self._ociosas = queue.LifoQueue(maxsize=max_ociosas)
+        self._abiertas = 0
+        self._lock = threading.Lock()
+
+    def _abrir(self):
+        conn = sqlite3.connect(self.ruta, check_same_thread=False,
+                               cached_statements=SENTENCIAS_CACHEADAS)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        with self._lock:
+            self._abiertas += 1
+        return conn
+
+    @contextmanager
+    def conexion(self):
+        """Presta una conexión; al salir vuelve al pool (LIFO: la más caliente primero)"""
+        try:
+            conn = self._ociosas.get_nowait()
+        except queue.Empty:
+            conn = self._abrir()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._ociosas.put_nowait(conn)
+            except queue.Full:
+                self._cerrar(conn)
+
+    def _cerrar(self, conn):
+        conn.close()
+        with self._lock:
+            self._abiertas -= 1
+
+    def cerrar_todas(self):
+        while True:
+            try:
+                self._cerrar(self._ociosas.get_nowait())
+            except queue.Empty:
+                return
+
+
+pool = PoolConexiones(RUTA_DB)
+
+
+# ============================================
+# ESQUEMA
+# ============================================
+def inicializar_db():
+    with pool.conexion() as conn:
+        c = conn.cursor()
+
+        c.execute('''CREATE TABLE IF NOT EXISTS usuarios
+                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   nombre TEXT NOT NULL,
+                   email TEXT UNIQUE NOT NULL,
+                   telefono TEXT,
+                   password_hash TEXT NOT NULL,
+                   rol TEXT DEFAULT 'usuario',
+                   notificaciones_activas INTEGER DEFAULT 1,
+                   fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+        c.execute('''CREATE TABLE IF NOT EXISTS notificaciones
+                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   usuario_id INTEGER,
+                   tipo TEXT NOT NULL,
+                   temperatura REAL,
+                   humo REAL,
+                   mensaje TEXT,
+                   enviado INTEGER DEFAULT 0,
+                   fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                   FOREIGN KEY (usuario_id) REFERENCES usuarios(id))''')
+
+        _agregar_columna(c, 'notificaciones', 'alerta_id', 'TEXT')
+        # Preferencias de los emails (ver plantillas.py); NULL = las de por defecto
+        _agregar_columna(c, 'usuarios', 'idioma', 'TEXT')
+        _agregar_columna(c, 'usuarios', 'formato_email', 'TEXT')
+
+        # Sesiones compartidas entre procesos web (modo multiproceso)
+        c.execute('''CREATE TABLE IF NOT EXISTS sesiones
+                  (sid TEXT PRIMARY KEY,
+                   usuario_id INTEGER NOT NULL,
+                   datos TEXT NOT NULL,
+                   expira REAL NOT NULL)''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_sesiones_usuario ON sesiones(usuario_id)')
+
+        # Índices para la búsqueda de destinatarios y el historial de /perfil
+        c.execute('CREATE INDEX IF NOT EXISTS idx_usuarios_notificables ON usuarios(notificaciones_activas)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_notificaciones_usuario_fecha ON notificaciones(usuario_id, fecha)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_notificaciones_alerta ON notificaciones(alerta_id)')
+
+        # Serie temporal de lecturas + agregados por minuto y hora
+        serie_temporal.crear_tablas(c)
+        # Cola persistente de avisos salientes
+        outbox.crear_tablas(c)
+        # Histórico de alertas (una fila por alerta; las notificaciones la referencian por alerta_id)
+        registro_alertas.crear_tablas(c)
+        _agregar_columna(c, 'alertas', 'motivo', 'TEXT')
+        _agregar_columna(c, 'alertas', 'config_version', 'INTEGER')
+        # Catálogo de ficheros de archivo (datos antiguos fuera de la base)
+        exportacion.crear_tablas(c)
+        # Versiones de la configuración de umbrales (la vigente es la de mayor versión)
+        umbrales.crear_tablas(c)
+
+        conn.commit()
+
+        # Crear usuario admin por defecto si no existe (OR IGNORE: varios procesos pueden arrancar a la vez)
+        c.execute("SELECT 1 FROM usuarios WHERE email = 'admin@sistema.com'")
+        if not c.fetchone():
+            c.execute('''INSERT OR IGNORE INTO usuarios (nombre, email, telefono, password_hash, rol)
+                        VALUES (?, ?, ?, ?, ?)''',
+                      ('Administrador', 'admin@sistema.com', '',
+                       hash_password('admin123'), 'admin'))
+            conn.commit()
+            if c.rowcount:
+                print("✅ Usuario admin creado: admin@sistema.com / admin123")
+
+    print("✅ Base de datos inicializada")
+
+
+def _agregar_columna(c, tabla, columna, definicion):
+    """Migración mínima: añade la columna si la base es de una versión anterior"""
+    columnas = {fila[1] for fila in c.execute(f'PRAGMA table_info({tabla})')}
+    if columna not in columnas:
+        c.execute(f'ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}')
+
+
+# ============================================
+# USUARIOS
+# ============================================
+def registrar_usuario(nombre, email, telefono, password, kdf=None):
+    """Crea el usuario; con `kdf` (PoolKDF) el hash se calcula fuera del hilo de la petición"""
+    try:
+        password_hash = kdf.hash_password(password) if kdf else hash_password(password)
+        with pool.conexion() as conn:
+            with conn:
+                c = conn.execute('INSERT INTO usuarios (nombre, email, telefono, password_hash) VALUES (?, ?, ?, ?)',
+                                 (nombre, email, telefono, password_hash))
+            return True, c.lastrowid
+    except sqlite3.IntegrityError:
+        return False, "Email ya registrado"
+    except KDFSaturado:
+        raise
+    except Exception as e:
+        return False, str(e)
+
+# Hash con el que se compara si el email no existe: misma espera que con uno real
+_HASH_SENUELO = 'pbkdf2_sha256${}${}${}'.format(ITERACIONES_KDF, secrets.token_hex(16), secrets.token_hex(32))
+
+def verificar_usuario(email, password, kdf=None):
+    """Verifica las credenciales del usuario (incluyendo ROL).
+
+    Busca por email y compara el hash en tiempo constante; los hashes antiguos
+    (SHA-256 sin sal o con menos iteraciones) se rehacen tras un login correcto.
+    """
+    verificar = kdf.verificar_password if kdf else verificar_password
+    try:
+        with pool.conexion() as conn:
+            u = conn.execute('''SELECT id, nombre, telefono, notificaciones_activas, rol, password_hash
+                                FROM usuarios WHERE email = ?''', (email,)).fetchone()
+        correcta, rehacer = verificar(password or '', u[5] if u else _HASH_SENUELO)
+        if not (u and correcta):
+            return False, "Credenciales incorrectas"
+        if rehacer:
+            nuevo = kdf.hash_password(password) if kdf else hash_password(password)
+            with pool.conexion() as conn:
+                with conn:
+                    conn.execute('UPDATE usuarios SET password_hash = ? WHERE id = ?', (nuevo, u[0]))
+        return True, {
+            'id': u[0],
+            'nombre': u[1],
+            'telefono': u[2],
+            'notificaciones_activas': u[3],
+            'rol': u[4]
+        }
+    except KDFSaturado:
+        raise
+    except Exception as e:
+        return False, str(e)
+
+def obtener_usuarios_notificables(ids=None):
+    """Usuarios con notificaciones activas; `ids` restringe a esos usuarios (reintentos)"""
+    try:
+        with pool.conexion() as conn:
+            usuarios = conn.execute('SELECT id, nombre, email, idioma, formato_email FROM usuarios '
+                                    'WHERE notificaciones_activas = 1').fetchall()
+        if ids is not None:
+            ids = set(ids)
+            usuarios = [u for u in usuarios if u[0] in ids]
+        return [{'id': u[0], 'nombre': u[1], 'email': u[2], 'idioma': u[3], 'formato': u[4]} for u in usuarios]
+    except Exception as e:
+        print(f"Error usuarios: {e}")
+        return []
+
+def obtener_usuario(uid):
+    """Fila del perfil: (nombre, email, telefono, notificaciones_activas, fecha_registro, rol, idioma, formato_email)"""
+    with pool.conexion() as conn:
+        return conn.execute('SELECT nombre, email, telefono, notificaciones_activas, fecha_registro, rol, idioma, formato_email '
+                            'FROM usuarios WHERE id = ?', (uid,)).fetchone()
+
+def obtener_notificaciones_usuario(uid, limite=20):
+    """Últimas notificaciones del usuario para /perfil (tipo, valores y texto salen de su alerta)"""
+    with pool.conexion() as conn:
+        return conn.execute('''SELECT COALESCE(a.tipo, n.tipo), COALESCE(a.temperatura, n.temperatura),
+                                      COALESCE(a.humo, n.humo), COALESCE(a.mensaje, n.mensaje), n.enviado, n.fecha
+                               FROM notificaciones n LEFT JOIN alertas a ON a.alerta_id = n.alerta_id
+                               WHERE n.usuario_id = ? ORDER BY n.fecha DESC, n.id DESC LIMIT ?''',
+                            (uid, limite)).fetchall()
+
+def alternar_notificaciones(uid):
+    """Activa/desactiva las notificaciones del usuario y devuelve el nuevo estado"""
+    with pool.conexion() as conn:
+        with conn:
+            conn.execute('UPDATE usuarios SET notificaciones_activas = NOT notificaciones_activas WHERE id = ?', (uid,))
+            fila = conn.execute('SELECT notificaciones_activas FROM usuarios WHERE id = ?', (uid,)).fetchone()
+    return bool(fila[0])
+
+def cambiar_preferencias_email(uid, idioma, formato):
+    """Idioma y formato de los emails del usuario (ya validados)"""
+    with pool.conexion() as conn:
+        with conn:
+            conn.execute('UPDATE usuarios SET idioma = ?, formato_email = ? WHERE id = ?', (idioma, formato, uid))
+
+def cambiar_rol(uid, rol):
+    """Asigna el rol ('admin' o 'usuario'); False si el usuario no existe"""
+    with pool.conexion() as conn:
+        with conn:
+            c = conn.execute('UPDATE usuarios SET rol = ? WHERE id = ?', (rol, uid))
+    return c.rowcount > 0
+
+
+# ============================================
+# SESIONES (persistidas para compartirlas entre procesos)
+# ============================================
+class AlmacenSesiones:
+    """Respaldo en SQLite de `autenticacion.Sesiones` cuando hay varios procesos web"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def guardar(self, sid, datos, expira):
+        with self.pool.conexion() as conn:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO sesiones (sid, usuario_id, datos, expira) VALUES (?, ?, ?, ?)',
+                             (sid, datos['id'], json.dumps(datos), expira))
+
+    def cargar(self, sid, expira):
+        """Datos de la sesión si sigue viva, alargando su caducidad hasta `expira`"""
+        ahora = time.time()
+        with self.pool.conexion() as conn:
+            with conn:
+                c = conn.execute('UPDATE sesiones SET expira = ? WHERE sid = ? AND expira > ?', (expira, sid, ahora))
+                if not c.rowcount:
+                    return None
+                fila = conn.execute('SELECT datos FROM sesiones WHERE sid = ?', (sid,)).fetchone()
+        return json.loads(fila[0]) if fila else None
+
+    def borrar(self, sid):
+        with self.pool.conexion() as conn:
+            with conn:
+                conn.execute('DELETE FROM sesiones WHERE sid = ?', (sid,))
+
+    def borrar_usuario(self, uid):
+        with self.pool.conexion() as conn:
+            with conn:
+                conn.execute('DELETE FROM sesiones WHERE usuario_id = ?', (uid,))
+
+    def purgar(self):
+        with self.pool.conexion() as conn:
+            with conn:
+                return conn.execute('DELETE FROM sesiones WHERE expira <= ?', (time.time(),)).rowcount
+
+
+# ============================================
+# NOTIFICACIONES
+# ============================================
+def registrar_notificaciones_lote(alerta_id, mensaje, filas, tipo='', temperatura=None, humo=None):
+    """Guarda todas las notificaciones de un aviso en una sola transacción.
+
+    El texto se guarda una vez en la alerta; cada destinatario solo enlaza a ella.
+    filas: iterable de (usuario_id, enviado). `tipo`, `temperatura` y `humo` solo se
+    copian si el aviso no tiene fila en alertas (avisos encolados antes del histórico).
+    """
+    try:
+        with pool.conexion() as conn:
+            with conn:
+                c = conn.execute('UPDATE alertas SET mensaje = ? WHERE alerta_id = ?', (mensaje, alerta_id))
+                if c.rowcount:
+                    conn.executemany("INSERT INTO notificaciones (alerta_id, usuario_id, tipo, enviado) VALUES (?, ?, '', ?)",
+                                     [(alerta_id, uid, enviado) for uid, enviado in filas])
+                else:
+                    conn.executemany('INSERT INTO notificaciones (alerta_id, usuario_id, tipo, temperatura, humo, mensaje, enviado) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                     [(alerta_id, uid, tipo, temperatura, humo, mensaje, enviado) for uid, enviado in filas])
+    except Exception as e:
+        print(f"Error DB notif: {e}")
+
+def marcar_notificaciones_enviadas(alerta_id, usuario_ids):
+    """Marca como enviadas las notificaciones de un aviso entregadas en un reintento"""
+    try:
+        with pool.conexion() as conn:
+            with conn:
+                conn.executemany('UPDATE notificaciones SET enviado = 1 WHERE alerta_id = ? AND usuario_id = ?',
+                                 [(alerta_id, uid) for uid in usuario_ids])
+    except Exception as e:
+        print(f"Error DB notif: {e}")
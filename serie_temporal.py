@@ -0,0 +1,247 @@
+"""Almacenamiento persistente de lecturas con escritura por lotes y agregados 1m/1h."""
+import math
+import queue
+import threading
+import time
+from datetime import datetime
+
+import metricas
+
+# Escritura por lotes: se confirma cada LOTE lecturas o cada INTERVALO_MS, lo que llegue antes
+LOTE_ESCRITURA = 100
+INTERVALO_ESCRITURA_MS = 500
+# Lecturas en espera antes de empezar a descartar (el hilo lector nunca se bloquea)
+MAX_PENDIENTES = 50000
+# Intentos de un lote que falla antes de darlo por perdido (con espera creciente entre ellos)
+MAX_INTENTOS_LOTE = 5
+ESPERA_REINTENTO_MAX_S = 30
+
+DURACION_ESCRITURA = metricas.histograma('db_escritura_lecturas_segundos',
+                                         'Transacción de un lote de lecturas (inserción + agregados)')
+
+# Tablas de agregados: sufijo -> tamaño del bucket en segundos
+TABLAS_AGREGADAS = (('1h', 3600), ('1m', 60))
+# Puntos máximos que devuelve /historico cuando se pide resolución automática
+MAX_PUNTOS_AUTO = 1000
+
+_SQL_INSERTAR = 'INSERT INTO lecturas (ts, dispositivo, temperatura, humo) VALUES (?, ?, ?, ?)'
+_SQL_ACUMULAR = '''INSERT INTO lecturas_{sufijo}
+    (dispositivo, bucket, n, temp_min, temp_max, temp_suma, humo_min, humo_max, humo_suma)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(dispositivo, bucket) DO UPDATE SET
+        n = n + excluded.n,
+        temp_min = MIN(temp_min, excluded.temp_min),
+        temp_max = MAX(temp_max, excluded.temp_max),
+        temp_suma = temp_suma + excluded.temp_suma,
+        humo_min = MIN(humo_min, excluded.humo_min),
+        humo_max = MAX(humo_max, excluded.humo_max),
+        humo_suma = humo_suma + excluded.humo_suma'''
+
+
+def _columnas(c, tabla):
+    return {fila[1] for fila in c.execute(f'PRAGMA table_info({tabla})')}
+
+
+def crear_tablas(c, dispositivo_por_defecto='principal'):
+    """Crea la tabla de lecturas crudas y las de agregados por minuto y hora"""
+    c.execute('''CREATE TABLE IF NOT EXISTS lecturas
+              (ts REAL NOT NULL,
+               dispositivo TEXT NOT NULL,
+               temperatura REAL NOT NULL,
+               humo REAL NOT NULL)''')
+    # Bases anteriores al soporte multi-dispositivo: todo pertenecía a la placa única
+    if 'dispositivo' not in _columnas(c, 'lecturas'):
+        c.execute(f"ALTER TABLE lecturas ADD COLUMN dispositivo TEXT NOT NULL DEFAULT '{dispositivo_por_defecto}'")
+    c.execute('CREATE INDEX IF NOT EXISTS idx_lecturas_ts ON lecturas(ts)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_lecturas_dispositivo_ts ON lecturas(dispositivo, ts)')
+
+    for sufijo, tam in TABLAS_AGREGADAS:
+        tabla = f'lecturas_{sufijo}'
+        existentes = _columnas(c, tabla)
+        reconstruir = bool(existentes) and 'dispositivo' not in existentes
+        if reconstruir:
+            # Los agregados son derivables: se regeneran con la nueva clave
+            c.execute(f'DROP TABLE {tabla}')
+        c.execute(f'''CREATE TABLE IF NOT EXISTS {tabla}
+                  (dispositivo TEXT NOT NULL,
+                   bucket INTEGER NOT NULL,
+                   n INTEGER NOT NULL,
+                   temp_min REAL, temp_max REAL, temp_suma REAL,
+                   humo_min REAL, humo_max REAL, humo_suma REAL,
+                   PRIMARY KEY (dispositivo, bucket))''')
+        c.execute(f'CREATE INDEX IF NOT EXISTS idx_{tabla}_bucket ON {tabla}(bucket)')
+        if reconstruir:
+            c.execute(f'''INSERT INTO {tabla}
+                      SELECT dispositivo, CAST(ts / {tam} AS INTEGER) * {tam}, COUNT(*),
+                             MIN(temperatura), MAX(temperatura), SUM(temperatura),
+                             MIN(humo), MAX(humo), SUM(humo)
+                      FROM lecturas GROUP BY 1, 2''')
+
+
+def _agregar(filas, tam_bucket):
+    """Resume un lote en memoria por bucket antes del UPSERT (pocas filas por lote)"""
+    buckets = {}
+    for ts, dispositivo, temp, humo in filas:
+        b = (dispositivo, int(ts // tam_bucket) * tam_bucket)
+        acc = buckets.get(b)
+        if acc is None:
+            buckets[b] = [1, temp, temp, temp, humo, humo, humo]
+        else:
+            acc[0] += 1
+            if temp < acc[1]: acc[1] = temp
+            if temp > acc[2]: acc[2] = temp
+            acc[3] += temp
+            if humo < acc[4]: acc[4] = humo
+            if humo > acc[5]: acc[5] = humo
+            acc[6] += humo
+    return [(*b, *acc) for b, acc in buckets.items()]
+
+
+class EscritorLecturas:
+    """Hilo de fondo que persiste las lecturas en lotes sin bloquear al lector"""
+
+    def __init__(self, pool, lote=LOTE_ESCRITURA, intervalo_ms=INTERVALO_ESCRITURA_MS,
+                 max_pendientes=MAX_PENDIENTES):
+        self.pool = pool
+        self.lote = lote
+        self.intervalo = intervalo_ms / 1000
+        self.descartadas = 0
+        self.escritas = 0
+        # Lecturas de lotes que siguieron fallando tras MAX_INTENTOS_LOTE
+        self.perdidas = 0
+        self._cola = queue.Queue(maxsize=max_pendientes)
+        self._hilo = None
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._bucle, name='escritor-lecturas', daemon=True)
+        self._hilo.start()
+
+    def registrar(self, ts, dispositivo, temperatura, humo):
+        """Encola una lectura; si el disco no da abasto se descarta en lugar de esperar"""
+        try:
+            self._cola.put_nowait((ts, dispositivo, temperatura, humo))
+        except queue.Full:
+            self.descartadas += 1
+
+    def pendientes(self):
+        return self._cola.qsize()
+
+    def _bucle(self):
+        # El escritor se queda con una conexión del pool mientras le funcione; ningún error lo detiene
+        while True:
+            try:
+                with self.pool.conexion() as conn:
+                    self._escribir_continuo(conn)
+            except Exception as e:
+                print(f"❌ Escritor de lecturas sin conexión: {e}")
+                time.sleep(1)
+
+    def _recoger(self):
+        """Siguiente lote: espera la primera lectura y junta las que lleguen en `intervalo`"""
+        filas = [self._cola.get()]
+        limite = time.monotonic() + self.intervalo
+        while len(filas) < self.lote:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                filas.append(self._cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return filas
+
+    def _escribir_continuo(self, conn):
+        filas, intentos = [], 0
+        while True:
+            if not filas:
+                filas = self._recoger()
+            try:
+                inicio = time.perf_counter()
+                self._escribir(conn, filas)
+                DURACION_ESCRITURA.observar(time.perf_counter() - inicio)
+                self.escritas += len(filas)
+                filas, intentos = [], 0
+            except Exception as e:
+                # El lote es una transacción: tras el rollback se reintenta entero
+                intentos += 1
+                espera = min(2 ** (intentos - 1), ESPERA_REINTENTO_MAX_S)
+                if intentos >= MAX_INTENTOS_LOTE:
+                    print(f"❌ Error guardando lecturas: {e}. Se pierden {len(filas)} tras {intentos} intentos")
+                    self.perdidas += len(filas)
+                    filas, intentos = [], 0
+                else:
+                    print(f"❌ Error guardando lecturas: {e}. Reintento {intentos} en {espera}s")
+                time.sleep(espera)
+
+    @staticmethod
+    def _escribir(conn, filas):
+        with conn:
+            conn.executemany(_SQL_INSERTAR, filas)
+            for sufijo, tam in TABLAS_AGREGADAS:
+                conn.executemany(_SQL_ACUMULAR.format(sufijo=sufijo), _agregar(filas, tam))
+
+
+# ============================================
+# CONSULTAS DE HISTÓRICO
+# ============================================
+def parsear_instante(valor):
+    """Acepta segundos epoch o fecha ISO ('2024-05-01T10:00'); devuelve epoch"""
+    try:
+        instante = float(valor)
+    except ValueError:
+        return datetime.fromisoformat(valor).timestamp()
+    # float() también acepta 'inf' y 'nan', que no son instantes
+    if not math.isfinite(instante):
+        raise ValueError(f"instante no válido: {valor!r}")
+    return instante
+
+
+def resolucion_automatica(desde, hasta):
+    """Bucket más pequeño de una tabla disponible que no supere MAX_PUNTOS_AUTO"""
+    rango = max(hasta - desde, 1)
+    for tam in (1, 60, 3600):
+        if rango / tam <= MAX_PUNTOS_AUTO:
+            return tam
+    return int(-(-rango // (MAX_PUNTOS_AUTO * 3600))) * 3600
+
+
+def _origen(resolucion):
+    """Tabla más agregada cuyo bucket divide exactamente la resolución pedida"""
+    for sufijo, tam in TABLAS_AGREGADAS:
+        if resolucion % tam == 0:
+            return f'lecturas_{sufijo}'
+    return None
+
+
+def consultar_historico(conn, desde, hasta, resolucion, dispositivo=None):
+    """Devuelve buckets min/avg/max de temperatura y humo entre desde y hasta.
+
+    Sin `dispositivo` los buckets combinan todas las placas (vista agregada).
+    """
+    resolucion = int(resolucion)
+    if resolucion <= 0:
+        raise ValueError('resolucion debe ser positiva')
+    filtro, extra = ('AND dispositivo = ?', (dispositivo,)) if dispositivo else ('', ())
+    tabla = _origen(resolucion)
+    if tabla:
+        filas = conn.execute(f'''SELECT (bucket / ?) * ? AS b, SUM(n),
+                   MIN(temp_min), SUM(temp_suma), MAX(temp_max),
+                   MIN(humo_min), SUM(humo_suma), MAX(humo_max)
+                 FROM {tabla} WHERE bucket >= ? AND bucket < ? {filtro}
+                 GROUP BY b ORDER BY b''',
+                 (resolucion, resolucion, int(desde // resolucion) * resolucion, hasta, *extra)).fetchall()
+    else:
+        filas = conn.execute(f'''SELECT CAST(ts / ? AS INTEGER) * ? AS b, COUNT(*),
+                   MIN(temperatura), SUM(temperatura), MAX(temperatura),
+                   MIN(humo), SUM(humo), MAX(humo)
+                 FROM lecturas WHERE ts >= ? AND ts < ? {filtro}
+                 GROUP BY b ORDER BY b''',
+                 (resolucion, resolucion, desde, hasta, *extra)).fetchall()
+
+    temperatura, humo = [], []
+    for b, n, t_min, t_suma, t_max, h_min, h_suma, h_max in filas:
+        hora = datetime.fromtimestamp(b).strftime('%Y-%m-%d %H:%M:%S')
+        temperatura.append({'ts': b, 'time': hora, 'min': t_min, 'avg': t_suma / n, 'max': t_max, 'value': t_suma / n})
+        humo.append({'ts': b, 'time': hora, 'min': h_min, 'avg': h_suma / n, 'max': h_max, 'value': h_suma / n})
+    return {'resolucion': resolucion, 'desde': desde, 'hasta': hasta, 'dispositivo': dispositivo or '*',
+            'temperatura': temperatura, 'humo': humo}
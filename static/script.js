@@ -6,6 +6,15 @@ let alertaCerradaManualmente = false;  // Controla cierre manual
 let ultimoEstadoPeligro = false;       // Para detectar cambios de estado
 let tiempoUltimoCierre = 0;            // Timestamp del último cierre manual
 
+// Placa a mostrar (?dispositivo=piso1 en la URL); sin él, vista agregada del edificio
+const FILTRO_DISPOSITIVO = new URLSearchParams(window.location.search).get('dispositivo');
+
+function conFiltro(url) {
+    if (!FILTRO_DISPOSITIVO) return url;
+    const separador = url.includes('?') ? '&' : '?';
+    return `${url}${separador}dispositivo=${encodeURIComponent(FILTRO_DISPOSITIVO)}`;
+}
+
 // 🔑 TU REQUISITO: 20 SEGUNDOS 🔑
 const TIEMPO_REABRIR = 20000;          // 20 segundos
 
@@ -14,12 +23,130 @@ document.addEventListener('DOMContentLoaded', function() {
     console.log('✅ Página cargada - Inicializando sistema');
     inicializarGraficos();
     
-    // Configuración de intervalos para actualización continua
-    setInterval(actualizar, 1000);        // Actualizar valores en tiempo real cada 1s
-    setInterval(actualizarHistorico, 5000); // Actualizar gráficos cada 5s
-    setInterval(actualizarAlertas, 3000);  // Actualizar lista de alertas cada 3s
+    // Estado inicial una sola vez; después el servidor empuja solo los cambios
+    actualizarHistorico();
+    actualizarAlertas();
+    
+    if (window.WebSocket) {
+        conectarWS();
+    } else if (window.EventSource) {
+        conectarStream();
+    } else {
+        // Navegadores sin SSE: sondeo clásico
+        setInterval(actualizar, 1000);        // Actualizar valores en tiempo real cada 1s
+        setInterval(actualizarHistorico, 5000); // Actualizar gráficos cada 5s
+        setInterval(actualizarAlertas, 3000);  // Actualizar lista de alertas cada 3s
+    }
 });
 
+// Máximo de puntos visibles en cada gráfico (igual que el histórico del servidor)
+const MAX_PUNTOS_GRAFICO = 50;
+
+// Lectura empujada por el servidor (/ws o /stream)
+function recibirLectura(data) {
+    procesarLectura(data);
+    // Una placa obsoleta repite su última muestra: no es un punto nuevo (la vista agregada sí avanza)
+    if (data.obsoleta && !data.dispositivos_obsoletos) return;
+    agregarPuntoGrafico(graficoTemperatura, data.timestamp, data.temperatura);
+    agregarPuntoGrafico(graficoHumo, data.timestamp, data.humo);
+}
+
+// Canal WebSocket con /ws: lecturas y alertas llegan como ["tipo", datos] y las
+// órdenes de control viajan por la misma conexión (["r", id, código, cuerpo] de vuelta)
+let socketWS = null;
+let siguienteOrden = 1;
+const ordenesPendientes = new Map();  // id de la orden -> resolve de su promesa
+
+function conectarWS() {
+    const protocolo = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const ws = new WebSocket(conFiltro(`${protocolo}//${window.location.host}/ws`));
+    let abierto = false;
+    
+    ws.onopen = () => {
+        abierto = true;
+        socketWS = ws;
+        // Tras una reconexión se resincroniza lo que se haya perdido
+        actualizarHistorico();
+        actualizarAlertas();
+    };
+    
+    ws.onmessage = (evento) => {
+        const [tipo, ...resto] = JSON.parse(evento.data);
+        if (tipo === 'lectura') {
+            recibirLectura(resto[0]);
+        } else if (tipo === 'alerta') {
+            agregarAlertaLista(resto[0]);
+        } else if (tipo === 'r') {
+            const [id, codigo, cuerpo] = resto;
+            const resolver = ordenesPendientes.get(id);
+            if (resolver) {
+                ordenesPendientes.delete(id);
+                resolver({...cuerpo, codigo});
+            }
+        }
+    };
+    
+    ws.onclose = () => {
+        socketWS = null;
+        // Las órdenes sin resultado se dan por fallidas
+        ordenesPendientes.forEach(resolver => resolver({success: false, mensaje: 'Conexión perdida'}));
+        ordenesPendientes.clear();
+        marcarDesconectado();
+        if (!abierto && window.EventSource) {
+            // El servidor (o un proxy) no acepta WebSocket: Server-Sent Events
+            conectarStream();
+            return;
+        }
+        setTimeout(conectarWS, 3000);
+    };
+}
+
+// Orden de control: por /ws si está conectado; si no, POST a la ruta clásica
+function enviarOrden(url, orden) {
+    if (socketWS && socketWS.readyState === WebSocket.OPEN) {
+        const id = siguienteOrden++;
+        socketWS.send(JSON.stringify([orden[0], id, ...orden.slice(1)]));
+        return new Promise(resolve => ordenesPendientes.set(id, resolve));
+    }
+    return fetch(url, {method: 'POST'}).then(res => res.json());
+}
+
+// Conexión Server-Sent Events con /stream
+function conectarStream() {
+    const fuente = new EventSource(conFiltro('/stream'));
+    
+    fuente.addEventListener('lectura', (evento) => {
+        recibirLectura(JSON.parse(evento.data));
+    });
+    
+    fuente.addEventListener('alerta', (evento) => {
+        agregarAlertaLista(JSON.parse(evento.data));
+    });
+    
+    fuente.onerror = () => {
+        // EventSource reintenta solo; mientras tanto se marca la desconexión
+        marcarDesconectado();
+    };
+    
+    fuente.onopen = () => {
+        // Tras una reconexión se resincroniza lo que se haya perdido
+        actualizarHistorico();
+        actualizarAlertas();
+    };
+}
+
+// Añade un punto al final del gráfico descartando el más antiguo
+function agregarPuntoGrafico(grafico, etiqueta, valor) {
+    if (!grafico) return;
+    grafico.data.labels.push(etiqueta);
+    grafico.data.datasets[0].data.push(valor);
+    if (grafico.data.labels.length > MAX_PUNTOS_GRAFICO) {
+        grafico.data.labels.shift();
+        grafico.data.datasets[0].data.shift();
+    }
+    grafico.update('none');
+}
+
 // Inicializar gráficos con Chart.js
 function inicializarGraficos() {
     const ctxTemp = document.getElementById('grafico-temperatura').getContext('2d');
@@ -81,64 +208,79 @@ function inicializarGraficos() {
 
 // 🔑 FUNCIÓN ACTUALIZAR (CORREGIDA Y SIMPLIFICADA)
 function actualizar() {
-    fetch('/leer') // Pregunta al servidor (que ahora tiene el estado "enganchado")
+    fetch(conFiltro('/leer')) // Pregunta al servidor (que ahora tiene el estado "enganchado")
         .then(res => res.json())
-        .then(data => {
-            // Actualizar valores
-            document.getElementById('temp-valor').textContent = data.temperatura.toFixed(1);
-            document.getElementById('humo-valor').textContent = data.humo.toFixed(1);
-            
-            // Actualizar estados
-            actualizarEstado('temp-estado', data.nivel_temperatura);
-            actualizarEstado('humo-estado', data.nivel_humo);
-            
-            // Actualizar timestamp
-            document.getElementById('ultima-actualizacion').textContent = 
-                `Última actualización: ${data.timestamp}`;
-            
-            // Actualizar conexión
-            document.getElementById('estado-conexion').textContent = '● Conectado';
-            document.getElementById('estado-conexion').className = 'conectado';
-            
-            // 🔑 LÓGICA DEL MODAL (CON TEMPORIZADOR DE 20s)
-            const tiempoActual = Date.now();
-            const tiempoDesdeUltimoCierre = tiempoActual - tiempoUltimoCierre;
-            
-            if (data.alerta) {
-                // HAY PELIGRO (Detectado por el servidor y "enganchado")
-                if (!alertaActiva) {
-                    // La alerta no está visible actualmente
-                    if (!alertaCerradaManualmente || tiempoDesdeUltimoCierre > TIEMPO_REABRIR) {
-                        // Mostrar si: no fue cerrada manualmente O ya pasó el tiempo de espera (20s)
-                        console.log("Mostrando modal: peligro detectado y temporizador expirado.");
-                        mostrarAlertaEmergencia(data);
-                        alertaActiva = true;
-                        alertaCerradaManualmente = false; // Reset
-                    } else {
-                        console.log("Peligro persiste, pero modal suprimido (esperando 20s).");
-                    }
-                }
-                ultimoEstadoPeligro = true;
-            } else {
-                // NO HAY PELIGRO
-                if (alertaActiva) {
-                    // Cerrar alerta automáticamente
-                    console.log("Cerrando modal: peligro ha pasado.");
-                    ocultarAlertaEmergencia();
-                    alertaActiva = false;
-                }
-                // Reset completo cuando no hay peligro
-                alertaCerradaManualmente = false;
-                ultimoEstadoPeligro = false;
-            }
-        })
+        .then(procesarLectura)
         .catch(error => {
             console.error('❌ Error al actualizar:', error);
-            document.getElementById('estado-conexion').textContent = '● Desconectado';
-            document.getElementById('estado-conexion').className = 'desconectado';
+            marcarDesconectado();
         });
 }
 
+function marcarDesconectado() {
+    document.getElementById('estado-conexion').textContent = '● Desconectado';
+    document.getElementById('estado-conexion').className = 'desconectado';
+}
+
+// Aplica una lectura (venga de /leer o de /stream) a la interfaz
+function procesarLectura(data) {
+    // Actualizar valores
+    document.getElementById('temp-valor').textContent = data.temperatura.toFixed(1);
+    document.getElementById('humo-valor').textContent = data.humo.toFixed(1);
+    
+    // Actualizar estados
+    actualizarEstado('temp-estado', data.nivel_temperatura);
+    actualizarEstado('humo-estado', data.nivel_humo);
+    
+    // Actualizar timestamp
+    document.getElementById('ultima-actualizacion').textContent = 
+        `Última actualización: ${data.timestamp}`;
+    
+    // Actualizar conexión (el supervisor marca 'obsoleta' si una placa deja de enviar muestras)
+    const estadoConexion = document.getElementById('estado-conexion');
+    if (data.obsoleta) {
+        estadoConexion.textContent = data.dispositivos_obsoletos
+            ? `● Sin datos de ${data.dispositivos_obsoletos.join(', ')}`
+            : '● Sin datos recientes';
+        estadoConexion.className = 'desconectado';
+    } else {
+        estadoConexion.textContent = '● Conectado';
+        estadoConexion.className = 'conectado';
+    }
+    
+    // 🔑 LÓGICA DEL MODAL (CON TEMPORIZADOR DE 20s)
+    const tiempoActual = Date.now();
+    const tiempoDesdeUltimoCierre = tiempoActual - tiempoUltimoCierre;
+    
+    if (data.alerta) {
+        // HAY PELIGRO (Detectado por el servidor y "enganchado")
+        if (!alertaActiva) {
+            // La alerta no está visible actualmente
+            if (!alertaCerradaManualmente || tiempoDesdeUltimoCierre > TIEMPO_REABRIR) {
+                // Mostrar si: no fue cerrada manualmente O ya pasó el tiempo de espera (20s)
+                console.log("Mostrando modal: peligro detectado y temporizador expirado.");
+                mostrarAlertaEmergencia(data);
+                alertaActiva = true;
+                alertaCerradaManualmente = false; // Reset
+            } else {
+                console.log("Peligro persiste, pero modal suprimido (esperando 20s).");
+            }
+        }
+        ultimoEstadoPeligro = true;
+    } else {
+        // NO HAY PELIGRO
+        if (alertaActiva) {
+            // Cerrar alerta automáticamente
+            console.log("Cerrando modal: peligro ha pasado.");
+            ocultarAlertaEmergencia();
+            alertaActiva = false;
+        }
+        // Reset completo cuando no hay peligro
+        alertaCerradaManualmente = false;
+        ultimoEstadoPeligro = false;
+    }
+}
+
 // Actualizar el estado visual de los indicadores
 function actualizarEstado(elementId, nivel) {
     const elemento = document.getElementById(elementId);
@@ -254,7 +396,7 @@ function reproducirSonidoAlerta() {
 
 // Actualizar gráficos históricos
 function actualizarHistorico() {
-    fetch('/historico')
+    fetch(conFiltro('/historico'))
         .then(res => res.json())
         .then(data => {
             if (data.temperatura.length > 0) {
@@ -280,42 +422,29 @@ function actualizarHistorico() {
         });
 }
 
+// Id de la última alerta mostrada: el sondeo solo pide las posteriores (?after_id=)
+let ultimoIdAlerta = null;
+
 // Actualizar registro de alertas
 function actualizarAlertas() {
-    fetch('/alertas')
+    const url = ultimoIdAlerta === null ? '/alertas' : `/alertas?after_id=${ultimoIdAlerta}`;
+    fetch(conFiltro(url))
         .then(res => res.json())
         .then(data => {
-            const listaAlertas = document.getElementById('lista-alertas');
-            
-            if (data.alertas.length === 0) {
-                listaAlertas.innerHTML = '<p class="sin-alertas">No hay alertas registradas</p>';
-            } else {
-                listaAlertas.innerHTML = '';
-                
-                data.alertas.slice().reverse().forEach(alerta => {
-                    const alertaDiv = document.createElement('div');
-                    alertaDiv.className = 'alerta-item';
-                    
-                    const tiposTexto = alerta.tipo.map(t => {
-                        if (t === 'temperatura') return '🌡️ Temperatura';
-                        if (t === 'humo') return '💨 Humo';
-                        if (t === 'emergencia_manual') return '🚨 Emergencia Manual';
-                        return t;
-                    }).join(' y ');
-                    
-                    alertaDiv.innerHTML = `
-                        <div class="alerta-item-header">
-                            <strong>⚠️ Alerta: ${tiposTexto}</strong>
-                            <span>${alerta.timestamp}</span>
-                        </div>
-                        <div class="alerta-item-detalles">
-                            <span>Temperatura: ${alerta.temperatura.toFixed(1)}°C</span>
-                            <span>Humo: ${alerta.humo.toFixed(1)} ppm</span>
-                        </div>
-                    `;
-                    
-                    listaAlertas.appendChild(alertaDiv);
-                });
+            if (ultimoIdAlerta === null) {
+                const listaAlertas = document.getElementById('lista-alertas');
+                if (data.alertas.length === 0) {
+                    listaAlertas.innerHTML = '<p class="sin-alertas">No hay alertas registradas</p>';
+                } else {
+                    listaAlertas.innerHTML = '';
+                }
+            }
+            // Vienen en orden de id: cada una se inserta al principio
+            data.alertas.forEach(agregarAlertaLista);
+            if (data.ultimo_id !== null && data.ultimo_id !== undefined) {
+                ultimoIdAlerta = data.ultimo_id;
+            } else if (ultimoIdAlerta === null) {
+                ultimoIdAlerta = 0;
             }
         })
         .catch(error => {
@@ -323,6 +452,50 @@ function actualizarAlertas() {
         });
 }
 
+// Máximo de alertas visibles (igual que el histórico del servidor)
+const MAX_ALERTAS_LISTA = 20;
+
+// Inserta una alerta recibida por /stream al principio de la lista
+function agregarAlertaLista(alerta) {
+    if (alerta.id !== undefined && ultimoIdAlerta !== null && alerta.id <= ultimoIdAlerta) return;
+    if (alerta.id !== undefined) ultimoIdAlerta = alerta.id;
+    const listaAlertas = document.getElementById('lista-alertas');
+    const vacio = listaAlertas.querySelector('.sin-alertas');
+    if (vacio) vacio.remove();
+    
+    listaAlertas.insertBefore(crearElementoAlerta(alerta), listaAlertas.firstChild);
+    while (listaAlertas.children.length > MAX_ALERTAS_LISTA) {
+        listaAlertas.lastChild.remove();
+    }
+}
+
+function crearElementoAlerta(alerta) {
+    const alertaDiv = document.createElement('div');
+    alertaDiv.className = 'alerta-item';
+    
+    const tiposTexto = alerta.tipo.map(t => {
+        if (t === 'temperatura') return '🌡️ Temperatura';
+        if (t === 'humo') return '💨 Humo';
+        if (t === 'emergencia_manual') return '🚨 Emergencia Manual';
+        return t;
+    }).join(' y ');
+    // Alertas tempranas del detector de subida (aún por debajo del umbral)
+    const motivo = alerta.motivo === 'subida' ? ' (subida rápida)' : '';
+    const origen = alerta.dispositivo && alerta.dispositivo !== '*' ? ` (${alerta.dispositivo})` : '';
+    
+    alertaDiv.innerHTML = `
+        <div class="alerta-item-header">
+            <strong>⚠️ Alerta: ${tiposTexto}${motivo}${origen}</strong>
+            <span>${alerta.timestamp}</span>
+        </div>
+        <div class="alerta-item-detalles">
+            <span>Temperatura: ${alerta.temperatura.toFixed(1)}°C</span>
+            <span>Humo: ${alerta.humo.toFixed(1)} ppm</span>
+        </div>
+    `;
+    return alertaDiv;
+}
+
 // BOTÓN DE EMERGENCIA MANUAL
 function activarEmergenciaManual() {
     if (!confirm('¿Está seguro de que desea activar el modo de emergencia? Esto encenderá el ventilador y abrirá las puertas.')) {
@@ -331,13 +504,12 @@ function activarEmergenciaManual() {
     
     mostrarNotificacion('🚨 Activando modo de emergencia...', 'info');
     
-    fetch('/emergencia/manual', {method: 'POST'})
-        .then(res => res.json())
+    enviarOrden('/emergencia/manual', ['emergencia'])
         .then(data => {
             if (data.success) {
                 mostrarNotificacion('🚨 MODO DE EMERGENCIA ACTIVADO: Ventilador encendido y puertas abiertas', 'success');
-                // Forzar actualización de alertas ya que el servidor registró la manual
-                actualizarAlertas(); 
+                // Con /ws o /stream la alerta llega sola; en modo sondeo se fuerza la actualización
+                if (!window.EventSource && !socketWS) actualizarAlertas(); 
             } else {
                 mostrarNotificacion(`❌ Error: ${data.mensaje || 'No se pudo activar la emergencia'}`, 'error');
             }
@@ -350,8 +522,7 @@ function activarEmergenciaManual() {
 
 // Funciones de control del Ventilador
 function encenderVentilador() {
-    fetch('/ventilador/on', {method: 'POST'})
-        .then(res => res.json())
+    enviarOrden('/ventilador/on', ['ventilador', 'on'])
         .then(data => {
             console.log('Ventilador encendido:', data);
             mostrarNotificacion('🌀 Ventilador encendido - Evacuando humo', 'success');
@@ -363,8 +534,7 @@ function encenderVentilador() {
 }
 
 function apagarVentilador() {
-    fetch('/ventilador/off', {method: 'POST'})
-        .then(res => res.json())
+    enviarOrden('/ventilador/off', ['ventilador', 'off'])
         .then(data => {
             console.log('Ventilador apagado:', data);
             mostrarNotificacion('⏹️ Ventilador apagado', 'success');
@@ -377,8 +547,7 @@ function apagarVentilador() {
 
 // Funciones de control de Servomotores
 function abrirPuertas() {
-    fetch('/servomotor/abrir', {method: 'POST'})
-        .then(res => res.json())
+    enviarOrden('/servomotor/abrir', ['servomotor', 'abrir'])
         .then(data => {
             console.log('Puertas abiertas:', data);
             mostrarNotificacion('🔓 Puertas de evacuación ABIERTAS', 'success');
@@ -390,8 +559,7 @@ function abrirPuertas() {
 }
 
 function cerrarPuertas() {
-    fetch('/servomotor/cerrar', {method: 'POST'})
-        .then(res => res.json())
+    enviarOrden('/servomotor/cerrar', ['servomotor', 'cerrar'])
         .then(data => {
             console.log('Puertas cerradas:', data);
             mostrarNotificacion('🔒 Puertas de evacuación CERRADAS', 'success');
@@ -0,0 +1,172 @@
+"""Supervisor de los hilos lectores: edad de la última muestra, ritmo por placa, reinicios y /health, /ready.
+
+Cada hilo lector anota en su Dispositivo cuándo llegó la última muestra (reloj
+monotónico) y cuántas lleva. Un hilo aparte las revisa cada INTERVALO_S y:
+
+- marca la lectura publicada como obsoleta ('obsoleta': true en /leer, /stream
+  y /ws) cuando la placa lleva más de EDAD_OBSOLETA_S sin muestras; la
+  siguiente muestra la vuelve a dejar en false;
+- reinicia el lector de una placa conectada que lleva EDAD_ATASCADO_S sin
+  muestras (read() bloqueado) o ERRORES_SEGUIDOS_MAX vueltas seguidas por el
+  except. Una placa desconectada no se toca: ya está reconectando con backoff;
+- deja codificado el cuerpo de /health y /ready. Las rutas solo leen esa
+  referencia: ni locks de dispositivo ni base de datos.
+
+En modo multiproceso el supervisor corre en el proceso de ingesta y su cuerpo
+viaja por el segmento compartido; cada proceso web lo sirve con SupervisorEspejo,
+que además comprueba que el segmento siga vivo.
+
+SUPERVISOR_OBSOLETA_S y SUPERVISOR_ATASCADO_S cambian los plazos (segundos).
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+EDAD_OBSOLETA_S = float(os.environ.get('SUPERVISOR_OBSOLETA_S', '5'))
+EDAD_ATASCADO_S = float(os.environ.get('SUPERVISOR_ATASCADO_S', '15'))
+ERRORES_SEGUIDOS_MAX = 5
+INTERVALO_S = 0.5
+# Ventana sobre la que se calcula el ritmo de muestras de cada placa
+VENTANA_RITMO_S = 5.0
+# Un cuerpo sin refrescar en este tiempo indica que el propio supervisor se detuvo
+PLAZO_CUERPO_S = 5 * INTERVALO_S
+
+
+def _json(datos):
+    return json.dumps(datos, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+CUERPO_DETENIDO = _json({'estado': 'supervisor_detenido', 'listo': False})
+
+
+class EstadoSalud:
+    """Cuerpo de /health y /ready ya codificado, publicado por intercambio de referencia"""
+
+    def __init__(self):
+        self.version = 0
+        # (cuerpo, listo, instante monotónico en que se generó)
+        self.actual = (_json({'estado': 'arrancando', 'listo': False}), False, time.monotonic())
+
+    def publicar(self, datos):
+        self.version += 1
+        self.actual = (_json(datos), datos['listo'], time.monotonic())
+
+    def salud(self):
+        """(cuerpo, código) de /health: 200 mientras el supervisor siga refrescando el cuerpo"""
+        cuerpo, _, generado = self.actual
+        if time.monotonic() - generado > PLAZO_CUERPO_S:
+            return CUERPO_DETENIDO, 503
+        return cuerpo, 200
+
+    def preparado(self):
+        """(cuerpo, código) de /ready: 200 si al menos una placa tiene lecturas frescas"""
+        cuerpo, listo, generado = self.actual
+        if time.monotonic() - generado > PLAZO_CUERPO_S:
+            return CUERPO_DETENIDO, 503
+        return cuerpo, 200 if listo else 503
+
+
+class Supervisor(EstadoSalud):
+    """Hilo que vigila los lectores de `registro` (solo en el proceso que abre los puertos).
+
+    `marcar_obsoleta(d)` republica la lectura de `d` con 'obsoleta': true;
+    `reiniciar(d, motivo)` arranca un lector nuevo para `d` ('atascado' o 'errores').
+    """
+
+    def __init__(self, registro, marcar_obsoleta, reiniciar, intervalo=INTERVALO_S):
+        super().__init__()
+        self.registro = registro
+        self.marcar_obsoleta = marcar_obsoleta
+        self.reiniciar = reiniciar
+        self.intervalo = intervalo
+        # Muestras por segundo de cada placa en la última ventana
+        self.ritmos = {}
+        self._ventanas = {}
+
+    def iniciar(self):
+        threading.Thread(target=self._bucle, name='supervisor', daemon=True).start()
+        return self
+
+    def _bucle(self):
+        while True:
+            try:
+                self.revisar()
+            except Exception as e:
+                print(f"⚠️ Error en el supervisor de lectores: {e}")
+            time.sleep(self.intervalo)
+
+    def revisar(self, ahora=None):
+        ahora = time.monotonic() if ahora is None else ahora
+        placas = {d.device_id: self._revisar_placa(d, ahora) for d in self.registro.todos()}
+        frescas = sum(not p['obsoleta'] for p in placas.values())
+        estado = 'ok' if frescas == len(placas) else 'degradado' if frescas else 'sin_datos'
+        self.publicar({'estado': estado, 'listo': frescas > 0, 'ts': round(time.time(), 3),
+                       'dispositivos': placas})
+
+    def _revisar_placa(self, d, ahora):
+        edad = None if d.ultima_muestra is None else ahora - d.ultima_muestra
+        ventana = self._ventanas.get(d.device_id)
+        if ventana is None:
+            ventana = self._ventanas[d.device_id] = deque(maxlen=int(VENTANA_RITMO_S / self.intervalo) + 1)
+        ventana.append((ahora, d.muestras))
+        inicio, muestras_inicio = ventana[0]
+        ritmo = (d.muestras - muestras_inicio) / (ahora - inicio) if ahora > inicio else 0.0
+        self.ritmos[d.device_id] = ritmo
+
+        obsoleta = edad is None or edad > EDAD_OBSOLETA_S
+        if obsoleta and not d.instantanea.lectura.get('obsoleta'):
+            print(f"⏳ '{d.device_id}' sin muestras en {EDAD_OBSOLETA_S:g}s: lectura marcada como obsoleta")
+            self.marcar_obsoleta(d)
+        motivo = self._motivo_reinicio(d, ahora)
+        if motivo is not None:
+            self.reiniciar(d, motivo)
+        return {'edad_s': None if edad is None else round(edad, 3), 'muestras_s': round(ritmo, 2),
+                'obsoleta': obsoleta, 'conectado': d.conexion is not None,
+                'errores': d.errores_lectura, 'reinicios': sum(d.reinicios.values())}
+
+    @staticmethod
+    def _motivo_reinicio(d, ahora):
+        if d.conexion is None:
+            # Reconectando (con su propio backoff): reiniciar no lo acelera
+            return None
+        if d.errores_seguidos >= ERRORES_SEGUIDOS_MAX:
+            return 'errores'
+        # Desde la última muestra o, si aún no hubo ninguna, desde que se abrió el puerto
+        desde = max(d.ultima_muestra or 0.0, d.ultima_conexion or 0.0)
+        if ahora - desde > EDAD_ATASCADO_S:
+            return 'atascado'
+        return None
+
+
+class SupervisorEspejo(EstadoSalud):
+    """Lado web: sirve el cuerpo del supervisor del proceso de ingesta mientras el segmento siga vivo"""
+
+    def __init__(self, espejo, plazo, intervalo=INTERVALO_S):
+        super().__init__()
+        self.espejo = espejo
+        self.plazo = plazo
+        self.intervalo = intervalo
+
+    def iniciar(self):
+        threading.Thread(target=self._bucle, name='supervisor', daemon=True).start()
+        return self
+
+    def _bucle(self):
+        while True:
+            try:
+                self.revisar()
+            except Exception as e:
+                print(f"⚠️ Error en el supervisor del espejo: {e}")
+            time.sleep(self.intervalo)
+
+    def revisar(self):
+        edad = self.espejo.edad_datos()
+        datos = self.espejo.salud
+        if datos is None or edad is None or edad > self.plazo:
+            # El proceso de ingesta no publica: las lecturas de este proceso están congeladas
+            self.publicar({'estado': 'sin_ingesta', 'listo': False, 'ts': round(time.time(), 3),
+                           'ingesta_edad_s': None if edad is None else round(edad, 3)})
+        else:
+            self.publicar(dict(datos, ingesta_edad_s=round(edad, 3)))
@@ -0,0 +1,233 @@
+"""Configuración de umbrales versionada: se valida al escribirla, se persiste y se publica por intercambio atómico.
+
+Cada cambio crea una `ConfiguracionUmbrales` nueva e inmutable con la versión
+siguiente y la guarda en la tabla configuracion_umbrales; al arrancar se carga
+la de mayor versión. El hilo lector lee `gestor.actual` una vez por muestra:
+la referencia se sustituye entera, así que nunca ve media configuración y no
+necesita lock.
+
+Por variable hay tres umbrales: normal, alto y peligro (por debajo de normal
+el nivel es 'bajo'). En `dispositivos` una placa puede sustituir algunos. Al
+construirse, la configuración compila las tablas de bordes de cada placa
+(clasificacion.bordes): clasificar una muestra es un bisect sobre una tupla.
+
+    POST /configuracion {"temperatura": {"peligro": 50},
+                         "dispositivos": {"cocina": {"humo": {"peligro": 700}}}}
+
+Un POST es un cambio parcial sobre la vigente (null en una placa o variable
+borra su sustitución). Las claves antiguas umbral_temperatura y umbral_humo
+se siguen aceptando como el umbral de peligro general.
+"""
+import json
+import math
+import threading
+import time
+
+import clasificacion
+
+VARIABLES = ('temperatura', 'humo')
+NOMBRES = ('normal', 'alto', 'peligro')
+UMBRALES_POR_DEFECTO = {
+    'temperatura': {'normal': 30, 'alto': 40, 'peligro': 45},
+    'humo': {'normal': 300, 'alto': 500, 'peligro': 600},
+}
+# Valores admitidos por variable (°C, ppm)
+RANGOS = {'temperatura': (-40, 150), 'humo': (0, 10000)}
+CLAVES_LEGADO = {'umbral_temperatura': 'temperatura', 'umbral_humo': 'humo'}
+# Campos de la respuesta de GET que se ignoran si el cliente los devuelve en el POST
+SOLO_LECTURA = ('version', 'creada', 'usuario_id')
+
+
+class ConfiguracionInvalida(ValueError):
+    """El cambio no supera la validación (400)"""
+
+
+class VersionObsoleta(Exception):
+    """El cambio se hizo sobre una versión que ya no es la vigente (409)"""
+
+
+def crear_tablas(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS configuracion_umbrales
+              (version INTEGER PRIMARY KEY,
+               datos TEXT NOT NULL,
+               creada REAL NOT NULL,
+               usuario_id INTEGER)''')
+
+
+# ============================================
+# VALIDACIÓN
+# ============================================
+def _numero(valor, nombre, variable):
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)) or not math.isfinite(valor):
+        raise ConfiguracionInvalida(f"{nombre} debe ser un número")
+    minimo, maximo = RANGOS[variable]
+    if not minimo <= valor <= maximo:
+        raise ConfiguracionInvalida(f"{nombre} fuera de rango ({minimo}..{maximo})")
+    return valor
+
+
+def _umbrales(valores, nombre, variable):
+    if not isinstance(valores, dict):
+        raise ConfiguracionInvalida(f"{nombre} debe ser un objeto con {', '.join(NOMBRES)}")
+    desconocidos = set(valores) - set(NOMBRES)
+    if desconocidos:
+        raise ConfiguracionInvalida(f"{nombre}: claves desconocidas {', '.join(sorted(desconocidos))}")
+    return {k: _numero(v, f'{nombre}.{k}', variable) for k, v in valores.items()}
+
+
+def _ordenados(umbrales, nombre):
+    if not umbrales['normal'] <= umbrales['alto'] <= umbrales['peligro']:
+        raise ConfiguracionInvalida(f"{nombre}: debe cumplirse normal <= alto <= peligro")
+
+
+def validar(cambios, base, dispositivos=()):
+    """Aplica el cambio parcial `cambios` sobre `base` y devuelve la configuración completa.
+
+    `dispositivos` son los ids admitidos en las sustituciones por placa (vacío: cualquiera).
+    """
+    if not isinstance(cambios, dict):
+        raise ConfiguracionInvalida("Se esperaba un objeto JSON")
+    desconocidas = set(cambios) - set(VARIABLES) - set(CLAVES_LEGADO) - set(SOLO_LECTURA) - {'dispositivos'}
+    if desconocidas:
+        raise ConfiguracionInvalida(f"Claves desconocidas: {', '.join(sorted(desconocidas))}")
+
+    datos = {v: dict(base[v]) for v in VARIABLES}
+    for legado, variable in CLAVES_LEGADO.items():
+        if legado in cambios:
+            datos[variable]['peligro'] = _numero(cambios[legado], legado, variable)
+    for variable in VARIABLES:
+        if variable in cambios:
+            datos[variable].update(_umbrales(cambios[variable], variable, variable))
+        _ordenados(datos[variable], variable)
+
+    sustituciones = {d: {v: dict(u) for v, u in propia.items()} for d, propia in base['dispositivos'].items()}
+    por_placa = cambios.get('dispositivos', {})
+    if not isinstance(por_placa, dict):
+        raise ConfiguracionInvalida("dispositivos debe ser un objeto {id: {variable: umbrales}}")
+    for device_id, cambio in por_placa.items():
+        if dispositivos and device_id not in dispositivos:
+            raise ConfiguracionInvalida(f"Dispositivo desconocido: {device_id}")
+        if cambio is None:
+            sustituciones.pop(device_id, None)
+            continue
+        if not isinstance(cambio, dict) or set(cambio) - set(VARIABLES):
+            raise ConfiguracionInvalida(f"{device_id}: se esperaba {{{', '.join(VARIABLES)}}}")
+        propia = sustituciones.setdefault(device_id, {})
+        for variable, valores in cambio.items():
+            if valores is None:
+                propia.pop(variable, None)
+            else:
+                propia.setdefault(variable, {}).update(_umbrales(valores, f'{device_id}.{variable}', variable))
+        if not propia:
+            del sustituciones[device_id]
+    # Cada sustitución se comprueba combinada con los umbrales generales
+    for device_id, propia in sustituciones.items():
+        for variable, valores in propia.items():
+            _ordenados({**datos[variable], **valores}, f'{device_id}.{variable}')
+    datos['dispositivos'] = sustituciones
+    return datos
+
+
+# ============================================
+# CONFIGURACIÓN COMPILADA
+# ============================================
+class Umbrales:
+    """Umbrales efectivos de una placa: tablas de bordes y umbral de peligro por variable"""
+
+    __slots__ = ('valores', 'bordes', 'peligro')
+
+    def __init__(self, valores):
+        self.valores = valores
+        self.bordes = tuple(clasificacion.bordes(*(valores[v][n] for n in NOMBRES)) for v in VARIABLES)
+        self.peligro = tuple(valores[v]['peligro'] for v in VARIABLES)
+
+    def nivel(self, valor, variable):
+        return clasificacion.nivel(valor, self.bordes[VARIABLES.index(variable)])
+
+
+class ConfiguracionUmbrales:
+    """Una versión de la configuración, inmutable, con los umbrales de cada placa ya compilados"""
+
+    def __init__(self, version, datos, creada=None, usuario_id=None):
+        self.version = version
+        self.datos = datos
+        self.creada = creada
+        self.usuario_id = usuario_id
+        self.general = Umbrales(datos)
+        self._por_dispositivo = {
+            device_id: Umbrales({v: {**datos[v], **propia.get(v, {})} for v in VARIABLES})
+            for device_id, propia in datos['dispositivos'].items()
+        }
+
+    def para(self, device_id):
+        """Umbrales que aplican a la placa (los generales si no tiene sustituciones)"""
+        return self._por_dispositivo.get(device_id, self.general)
+
+    def json(self):
+        return {
+            'version': self.version,
+            'creada': self.creada,
+            'usuario_id': self.usuario_id,
+            **self.datos,
+            'umbral_temperatura': self.general.peligro[0],
+            'umbral_humo': self.general.peligro[1],
+        }
+
+
+def por_defecto():
+    """Versión 0: UMBRALES_POR_DEFECTO sin sustituciones por placa"""
+    datos = {v: dict(u) for v, u in UMBRALES_POR_DEFECTO.items()}
+    datos['dispositivos'] = {}
+    return ConfiguracionUmbrales(0, datos)
+
+
+class GestorUmbrales:
+    """Versión vigente (`actual`) y sus cambios: valida, guarda en la base y publica"""
+
+    def __init__(self, pool, dispositivos=()):
+        self.pool = pool
+        self.dispositivos = tuple(dispositivos)
+        self.actual = por_defecto()
+        # Serializa a los que escriben; los lectores solo leen `actual`
+        self._lock = threading.Lock()
+
+    def cargar(self):
+        """Al arrancar: la última versión guardada (o la por defecto, versión 0)"""
+        with self.pool.conexion() as conn:
+            fila = conn.execute('''SELECT version, datos, creada, usuario_id FROM configuracion_umbrales
+                                   ORDER BY version DESC LIMIT 1''').fetchone()
+        if fila is not None:
+            self.actual = ConfiguracionUmbrales(fila[0], json.loads(fila[1]), fila[2], fila[3])
+            print(f"⚙️ Umbrales: versión {fila[0]}")
+        return self.actual
+
+    def aplicar(self, cambios, usuario_id=None, version=None):
+        """Valida el cambio, guarda la versión nueva y la publica. Sin cambios reales no crea versión.
+
+        `version` es la que el cliente leyó: si ya no es la vigente, VersionObsoleta.
+        """
+        with self._lock:
+            actual = self.actual
+            if version is not None and version != actual.version:
+                raise VersionObsoleta(f"La versión vigente es la {actual.version}, no la {version}")
+            datos = validar(cambios, actual.datos, self.dispositivos)
+            if datos == actual.datos:
+                return actual
+            nueva = ConfiguracionUmbrales(actual.version + 1, datos, time.time(), usuario_id)
+            with self.pool.conexion() as conn:
+                with conn:
+                    conn.execute('INSERT INTO configuracion_umbrales (version, datos, creada, usuario_id) '
+                                 'VALUES (?, ?, ?, ?)',
+                                 (nueva.version, json.dumps(datos), nueva.creada, usuario_id))
+            # Intercambio atómico: el hilo lector ve la versión anterior o la nueva, entera
+            self.actual = nueva
+        return nueva
+
+    def version(self, numero):
+        """Una versión pasada (para analizar las alertas que la registraron); None si no existe"""
+        if numero == 0:
+            return por_defecto()
+        with self.pool.conexion() as conn:
+            fila = conn.execute('SELECT version, datos, creada, usuario_id FROM configuracion_umbrales '
+                                'WHERE version = ?', (numero,)).fetchone()
+        return ConfiguracionUmbrales(fila[0], json.loads(fila[1]), fila[2], fila[3]) if fila else None